@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from photocircuit.component_detection.consensus import consensus_merge
+from photocircuit.component_detection.model import (
+  CircuitComponents, ConsensusSizedCircuitComponents, SizedCircuitComponents, SizedComponent
+)
+from photocircuit.evaluation.scoring import matched_distances
+from photocircuit.utils.component_detection import comp_counts
+from photocircuit.utils.instrumentation import stage
+
+DEFAULT_BATCH_SIZE = 2
+DEFAULT_MIN_SAMPLES = 3
+DEFAULT_MAX_SAMPLES = 9
+DEFAULT_POSITION_TOLERANCE = 5
+
+
+@dataclass(frozen=True)
+class AdaptiveSamplingResult:
+  consensus: ConsensusSizedCircuitComponents
+  # llm requests sent, including failed ones
+  calls: int
+  failed: int
+  # stopped because the consensus was stable, rather than at max_samples
+  converged: bool
+
+
+def to_sized(components: CircuitComponents | SizedCircuitComponents, approximate_size: int) -> SizedCircuitComponents:
+  """
+  :param approximate_size: size given to components that have none
+  """
+  if isinstance(components, SizedCircuitComponents):
+    return components
+  return SizedCircuitComponents(sized_components=[
+    SizedComponent(**comp.dict(), approximate_size=approximate_size) for comp in components.components
+  ])
+
+
+def is_stable(previous: SizedCircuitComponents, current: SizedCircuitComponents, position_tolerance: float) -> bool:
+  """
+  :return: whether both have the same number of each type of component, each within position_tolerance pixels of its
+           counterpart
+  """
+  previous_comps = CircuitComponents(components=previous.sized_components)
+  current_comps = CircuitComponents(components=current.sized_components)
+  if comp_counts(previous_comps) != comp_counts(current_comps):
+    return False
+  distances = matched_distances(previous_comps, current_comps)
+  return len(distances) == len(current.sized_components) and bool(np.all(distances <= position_tolerance))
+
+
+class AdaptiveSampler:
+  """
+  Draws samples of a detection a batch at a time until the consensus of the samples stops changing.
+
+  After each batch the consensus of all samples so far is compared with the consensus without the last batch_size of
+  them, sampling stops once the component counts are equal and every component moved less than position_tolerance.
+  Easy circuits stop after the first min_samples, noisy ones keep sampling up to max_samples.
+  """
+  def __init__(
+      self,
+      batch_size: int = DEFAULT_BATCH_SIZE,
+      min_samples: int = DEFAULT_MIN_SAMPLES,
+      max_samples: int = DEFAULT_MAX_SAMPLES,
+      position_tolerance: float = DEFAULT_POSITION_TOLERANCE,
+      min_votes: Optional[int] = None
+  ):
+    """
+    :param batch_size: samples requested in parallel per round
+    :param min_samples: successful samples needed before the first check
+    :param max_samples: samples requested at most
+    :param position_tolerance: max movement in pixels of a component between rounds of a stable consensus
+    :param min_votes: min number of samples that must find a component, defaults to a majority
+    """
+    self.batch_size = batch_size
+    self.min_samples = min_samples
+    self.max_samples = max_samples
+    self.position_tolerance = position_tolerance
+    self.min_votes = min_votes
+
+  async def asample(
+      self,
+      draw: Callable[[int], Awaitable[list]],
+      approximate_size: int
+  ) -> AdaptiveSamplingResult:
+    """
+    :param draw: requests n samples at once, returning each sample or its exception
+    :param approximate_size: merge size for samples without approximate_size, e.g. the grid spacing
+    :raises: the first error if every sample failed
+    """
+    samples: list[SizedCircuitComponents] = []
+    errors: list[BaseException] = []
+    converged = False
+    while len(samples) + len(errors) < self.max_samples:
+      calls = len(samples) + len(errors)
+      batch = self.min_samples if calls == 0 else self.batch_size
+      for result in await draw(min(batch, self.max_samples - calls)):
+        if isinstance(result, BaseException):
+          errors.append(result)
+        else:
+          samples.append(to_sized(result, approximate_size))
+      if len(samples) < self.min_samples:
+        continue
+
+      held_out = min(self.batch_size, len(samples) - 1)
+      previous = consensus_merge(samples[:-held_out], self.min_votes)
+      if is_stable(previous, consensus_merge(samples, self.min_votes), self.position_tolerance):
+        converged = True
+        break
+
+    if not samples:
+      raise errors[0]
+    calls = len(samples) + len(errors)
+    with stage('post_process', service=type(self).__name__, calls=calls, converged=converged):
+      consensus = consensus_merge(samples, self.min_votes)
+    return AdaptiveSamplingResult(consensus=consensus, calls=calls, failed=len(errors), converged=converged)
@@ -1,10 +1,12 @@
 from abc import ABC, abstractmethod
 from typing import Any
 
+from photocircuit.utils.circuit_image import CircuitImage
+
 
 class BaseComponentDetectionService(ABC):
   @abstractmethod
-  def label_components(self, base64_image: str) -> list[Any]:
+  def label_components(self, base64_image: CircuitImage | str) -> list[Any]:
     """
     :param base64_image: image of circuit
     :return: list of components
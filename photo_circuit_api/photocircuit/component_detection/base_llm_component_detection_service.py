@@ -0,0 +1,374 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, Generic, TypeVar
+
+import httpx
+import numpy as np
+import yaml
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
+from pydantic.v1 import BaseModel
+
+from photocircuit.component_detection.base_component_detection_service import BaseComponentDetectionService
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.llm_registry import chat_model, output_parser, format_instructions
+from photocircuit.component_detection.streaming_parser import StreamingItemParser, list_items
+from photocircuit.utils.async_utils import gather_limited, DEFAULT_CONCURRENCY
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.image_encoder import ImageEncoder, EncodedImage
+from photocircuit.utils.instrumentation import record_stage, stage
+from photocircuit.utils.prompt_utils import load_prompt, generate_image_with_grid
+
+MODEL = "gpt-4o"
+MAX_TOKENS = 1024
+
+T = TypeVar('T', bound=BaseModel)
+
+
+def token_usage(message: BaseMessage) -> dict[str, int]:
+  """
+  :return: prompt_tokens and completion_tokens of an llm response or response chunk, empty if it does not report them
+  """
+  usage = getattr(message, 'usage_metadata', None)
+  if usage:
+    return {'prompt_tokens': usage['input_tokens'], 'completion_tokens': usage['output_tokens']}
+  usage = message.response_metadata.get('token_usage') or {}
+  return {name: usage[name] for name in ('prompt_tokens', 'completion_tokens') if name in usage}
+
+
+class StreamTimer:
+  """
+  Times a streamed response, which is requested and parsed chunk by chunk, and records it as its llm_request and parse
+  stages once the stream ends. The llm_request stage also includes the time the consumer of the stream spends between
+  items.
+  """
+  def __init__(self, service: str, parser: StreamingItemParser):
+    self.service = service
+    self.parser = parser
+    self.usage: dict[str, int] = {}
+    self.parse_seconds = 0.0
+    self.first_item_seconds: Optional[float] = None
+    self._start = time.perf_counter()
+
+  def feed(self, chunk: BaseMessage) -> list:
+    """
+    :return: items completed by chunk, see StreamingItemParser.feed
+    """
+    self.usage.update(token_usage(chunk))
+    start = time.perf_counter()
+    items = self.parser.feed(chunk.content)
+    self.parse_seconds += time.perf_counter() - start
+    if items and self.first_item_seconds is None:
+      self.first_item_seconds = time.perf_counter() - self._start
+    return items
+
+  def close(self) -> list:
+    """
+    :return: items completed by the end of the response, see StreamingItemParser.close
+    """
+    start = time.perf_counter()
+    try:
+      return self.parser.close()
+    finally:
+      self.parse_seconds += time.perf_counter() - start
+      record_stage('llm_request', time.perf_counter() - self._start - self.parse_seconds, service=self.service,
+                   streamed=True, first_item_seconds=self.first_item_seconds, **self.usage)
+      record_stage('parse', self.parse_seconds, service=self.service, dropped_items=self.parser.dropped)
+
+
+class BaseLlmComponentDetectionService(Generic[T]):
+  """
+  Shared request handling for services that send a gridded circuit image to the vision llm and parse the response
+  into `output_model`
+  """
+  def __init__(
+      self,
+      output_model: type[T],
+      system_prompt: str,
+      temperature: float = 0,
+      cache: Optional[DetectionCache] = None,
+      image_encoder: Optional[ImageEncoder] = None,
+      candidate_detector: Optional[BaseComponentDetectionService] = None,
+      json_mode: bool = True,
+      http_async_client: Optional[httpx.AsyncClient] = None
+  ):
+    """
+    :param output_model: pydantic model the llm response is parsed into
+    :param system_prompt: path of system prompt under photocircuit/prompts
+    :param temperature: sampling temperature of the vision llm
+    :param cache: optional cache of llm responses, requests with identical inputs are only sent once
+    :param image_encoder: encodes the gridded image for the request, defaults to ImageEncoder()
+    :param candidate_detector: optional fast detector, e.g. TemplateComponentDetectionService, whose components are
+                               given to the llm as candidates to check
+    :param json_mode: request json output and parse it with FastOutputParser, otherwise request yaml and parse it with
+                      langchain's YamlOutputParser
+    :param http_async_client: client for async llm requests, e.g. pooled_async_client() shared by every service of a
+                              server, defaults to the client shared by every service of the process
+    """
+    self.output_model = output_model
+    self.temperature = temperature
+    self.cache = cache
+    self.image_encoder = image_encoder or ImageEncoder()
+    self.candidate_detector = candidate_detector
+    self.candidate_prompt = load_prompt('candidate_hints.txt') if candidate_detector is not None else None
+    # shared by every service of the process, see llm_registry
+    self.llm = chat_model(MODEL, MAX_TOKENS, http_async_client)
+    self.json_mode = json_mode
+    self.parser = output_parser(output_model, json_mode)
+    self.format_instructions = format_instructions(output_model, json_mode)
+    # llm with the temperature and output format of this service bound
+    output_format = {'response_format': {'type': 'json_object'}} if json_mode else {}
+    self.output_llm = self.llm.bind(temperature=temperature, **output_format)
+    self.system_prompt = load_prompt(system_prompt)
+  
+  def _detect(
+      self,
+      image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool,
+      bypass_cache: bool,
+      temperature: Optional[float] = None
+  ) -> T:
+    """
+    :param temperature: sampling temperature of this request, defaults to the service's
+    """
+    img_with_grid, hints, cache_key, cached = self._prepare(image, int_size, include_grid, bypass_cache, temperature)
+    if cached is not None:
+      return cached
+    return self._store(cache_key, self._invoke(self.build_messages(img_with_grid, hints), temperature))
+  
+  async def _adetect(
+      self,
+      image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool,
+      bypass_cache: bool,
+      temperature: Optional[float] = None
+  ) -> T:
+    """
+    async version of _detect
+    """
+    img_with_grid, hints, cache_key, cached = await asyncio.to_thread(
+      self._prepare, image, int_size, include_grid, bypass_cache, temperature
+    )
+    if cached is not None:
+      return cached
+    return self._store(cache_key, await self._ainvoke(self.build_messages(img_with_grid, hints), temperature))
+  
+  def _stream(self, image: CircuitImage | str, int_size: int, include_grid: bool, bypass_cache: bool) -> Iterator:
+    """
+    Streams the llm response, yielding each item of the output model's list field as soon as it is complete, see
+    StreamingItemParser. The complete response is cached once the stream ends, and recorded as its llm_request and
+    parse stages, see StreamTimer.
+    """
+    img_with_grid, hints, cache_key, cached = self._prepare(image, int_size, include_grid, bypass_cache)
+    if cached is not None:
+      yield from list_items(cached)
+      return
+    
+    parser = StreamingItemParser(self.output_model)
+    timer = StreamTimer(type(self).__name__, parser)
+    for chunk in self.output_llm.stream(self.build_messages(img_with_grid, hints)):
+      yield from timer.feed(chunk)
+    yield from timer.close()
+    self._store(cache_key, parser.result())
+  
+  async def _astream(
+      self,
+      image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool,
+      bypass_cache: bool
+  ) -> AsyncIterator:
+    """
+    async version of _stream
+    """
+    img_with_grid, hints, cache_key, cached = await asyncio.to_thread(
+      self._prepare, image, int_size, include_grid, bypass_cache
+    )
+    if cached is not None:
+      for item in list_items(cached):
+        yield item
+      return
+    
+    parser = StreamingItemParser(self.output_model)
+    timer = StreamTimer(type(self).__name__, parser)
+    async for chunk in self.output_llm.astream(self.build_messages(img_with_grid, hints)):
+      for item in timer.feed(chunk):
+        yield item
+    for item in timer.close():
+      yield item
+    self._store(cache_key, parser.result())
+  
+  async def _asampler(
+      self,
+      image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool,
+      concurrency: int
+  ) -> Callable[[int], Awaitable[list[T | BaseException]]]:
+    """
+    Grids and encodes the image once for drawing any number of samples of the same request, the cache is bypassed so
+    every sample is a fresh llm response
+    
+    :return: function sending the request n times concurrently, returning each sample or its exception if it failed
+    """
+    img_with_grid, hints, _, _ = await asyncio.to_thread(self._prepare, image, int_size, include_grid, True)
+    messages = self.build_messages(img_with_grid, hints)
+    
+    async def draw(num_samples: int) -> list[T | BaseException]:
+      return await gather_limited((lambda: self._ainvoke(messages) for _ in range(num_samples)), concurrency)
+    
+    return draw
+  
+  async def _asample(
+      self,
+      image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool,
+      num_samples: int,
+      concurrency: int
+  ) -> list[T | BaseException]:
+    """
+    Sends the same request num_samples times concurrently, see _asampler
+    """
+    draw = await self._asampler(image, int_size, include_grid, concurrency)
+    return await draw(num_samples)
+  
+  async def _adetect_many(
+      self,
+      images: list[CircuitImage | str],
+      int_sizes: int | list[int],
+      include_grid: bool,
+      bypass_cache: bool,
+      concurrency: int
+  ) -> list[T | BaseException]:
+    if isinstance(int_sizes, int):
+      int_sizes = [int_sizes] * len(images)
+    return await gather_limited(
+      (
+        lambda img=img, int_size=int_size: self._adetect(img, int_size, include_grid, bypass_cache)
+        for img, int_size in zip(images, int_sizes)
+      ),
+      concurrency
+    )
+  
+  def _invoke(self, messages: list, temperature: Optional[float] = None) -> T:
+    """
+    Sends messages to the llm and parses its response, recorded as separate llm_request and parse stages
+
+    :param temperature: sampling temperature of this request, defaults to the service's
+    """
+    with self._stage('llm_request') as attributes:
+      message = self._output_llm(temperature).invoke(messages)
+      attributes.update(token_usage(message))
+    with self._stage('parse'):
+      return self.parser.parse(message.content)
+  
+  async def _ainvoke(self, messages: list, temperature: Optional[float] = None) -> T:
+    """
+    async version of _invoke
+    """
+    with self._stage('llm_request') as attributes:
+      message = await self._output_llm(temperature).ainvoke(messages)
+      attributes.update(token_usage(message))
+    with self._stage('parse'):
+      return self.parser.parse(message.content)
+  
+  def _output_llm(self, temperature: Optional[float]):
+    """
+    :return: output_llm, or a binding of it sampling at temperature, which costs nothing to create
+    """
+    if temperature is None or temperature == self.temperature:
+      return self.output_llm
+    return self.output_llm.bind(temperature=temperature)
+  
+  def build_messages(self, img_with_grid: EncodedImage, hints: Optional[str] = None) -> list:
+    """
+    :param img_with_grid: encoded gridded image
+    :param hints: candidate components from the candidate detector, see candidate_hints
+    """
+    content = [{"type": "text", "text": self.format_instructions}]
+    if hints is not None:
+      content.append({"type": "text", "text": hints})
+    content.append({"type": "image_url", "image_url": {"url": img_with_grid.data_url}})
+    return [
+      SystemMessage(content=self.system_prompt),
+      HumanMessage(content=content)
+    ]
+  
+  def candidate_hints(self, image: CircuitImage) -> Optional[str]:
+    """
+    :return: text listing the components the candidate detector finds in image, None without a candidate detector
+    """
+    if self.candidate_detector is None:
+      return None
+    candidates = self.candidate_detector.label_components(image)
+    listed = [
+      {'component_name': comp.component_name.value, 'position': {'x': comp.position.x, 'y': comp.position.y}}
+      for comp in candidates.components
+    ]
+    return f"{self.candidate_prompt}\n```yaml\n{yaml.safe_dump({'candidates': listed}, sort_keys=False)}```"
+  
+  def _prepare(
+      self,
+      image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool,
+      bypass_cache: bool,
+      temperature: Optional[float] = None
+  ) -> tuple[EncodedImage, Optional[str], Optional[str], Optional[T]]:
+    """
+    :param temperature: sampling temperature of the request, part of the cache key, defaults to the service's
+    :return: (encoded gridded image, candidate hints, cache key if the cache should be used, cached response on a hit)
+    """
+    image = self._decode(image)
+    with self._stage('grid_render'):
+      gridded = generate_image_with_grid(image, int_size, include_grid)
+    img_with_grid = self._encode(gridded)
+    hints = self.candidate_hints(image)
+    
+    if self.cache is None or bypass_cache:
+      return img_with_grid, hints, None, None
+    temperature = self.temperature if temperature is None else temperature
+    cache_key = DetectionCache.make_key(img_with_grid.data, self.system_prompt, self.format_instructions, MODEL,
+                                        temperature, int_size, hints)
+    return img_with_grid, hints, cache_key, self._lookup(cache_key)
+  
+  def _stage(self, name: str, **attributes):
+    """
+    Times a stage of this service, see Instrumentation.stage
+    """
+    return stage(name, service=type(self).__name__, **attributes)
+  
+  def _decode(self, image: CircuitImage | str) -> CircuitImage:
+    """
+    :return: image with its pixels decoded
+    """
+    with self._stage('decode') as attributes:
+      image = CircuitImage.of(image)
+      height, width = image.shape[:2]
+      attributes['pixels'] = height * width
+    return image
+  
+  def _encode(self, image: CircuitImage | np.ndarray) -> EncodedImage:
+    """
+    :return: image encoded for the request by image_encoder
+    """
+    with self._stage('encode') as attributes:
+      encoded = self.image_encoder.encode(image)
+      attributes.update(payload_bytes=len(encoded.data), format=encoded.format)
+    return encoded
+  
+  def _lookup(self, cache_key: str) -> Optional[T]:
+    """
+    :return: cached response for cache_key, None on a miss
+    """
+    with self._stage('cache_lookup') as attributes:
+      cached = self.cache.get(cache_key)
+      attributes['cache_hit'] = cached is not None
+      return self.output_model.parse_raw(cached) if cached is not None else None
+  
+  def _store(self, cache_key: Optional[str], components: T) -> T:
+    if cache_key is not None:
+      self.cache.put(cache_key, components.json())
+    return components
@@ -0,0 +1,102 @@
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.component_detection.model import (
+  ComponentPosition, ConsensusSizedCircuitComponents, SizedCircuitComponents, VotedSizedComponent
+)
+from photocircuit.utils.component_detection import renumber_components
+
+# components of the same type from different samples are the same component if their centers are closer than this
+# fraction of the larger of their approximate sizes
+DEFAULT_RADIUS_SCALE = 0.5
+
+
+def cluster_samples(
+    positions: np.ndarray,
+    sizes: np.ndarray,
+    samples: np.ndarray,
+    radius_scale: float = DEFAULT_RADIUS_SCALE
+) -> np.ndarray:
+  """
+  Groups detections of one component type from several samples, each group holds at most one detection per sample.
+
+  Detections agreed on by the most samples seed groups first, each group takes the closest unclaimed detection of
+  every other sample within the merge radius.
+
+  :param positions: (n, 2) centers
+  :param sizes: (n,) approximate sizes
+  :param samples: (n,) index of the sample each detection is from
+  :param radius_scale: merge radius as a fraction of the larger approximate size of two detections
+  :return: (n,) group of each detection
+  """
+  n = len(positions)
+  distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=2)
+  radius = radius_scale * np.maximum(sizes[:, None], sizes[None, :])
+  close = (distances <= radius) & (samples[:, None] != samples[None, :])
+  np.fill_diagonal(close, True)
+  num_samples = samples.max() + 1
+  # support of a detection: number of samples with a detection close to it
+  support = np.zeros((n, num_samples), dtype=bool)
+  rows, cols = np.nonzero(close)
+  support[rows, samples[cols]] = True
+  order = np.lexsort((distances.sum(axis=1), -support.sum(axis=1)))
+
+  groups = np.full(n, -1)
+  group = 0
+  for seed in order:
+    if groups[seed] >= 0:
+      continue
+    candidates = np.flatnonzero(close[seed] & (groups < 0))
+    # closest candidate of each sample, the seed is its own closest
+    candidates = candidates[np.argsort(distances[seed, candidates], kind='stable')]
+    _, first = np.unique(samples[candidates], return_index=True)
+    groups[candidates[first]] = group
+    group += 1
+  return groups
+
+
+def consensus_merge(
+    samples: list[SizedCircuitComponents],
+    min_votes: Optional[int] = None,
+    radius_scale: float = DEFAULT_RADIUS_SCALE
+) -> ConsensusSizedCircuitComponents:
+  """
+  Merges repeated detections of the same circuit into the components enough of them agree on.
+
+  :param samples: detections of the same image
+  :param min_votes: min number of samples that must find a component for it to be kept, defaults to a majority
+  :param radius_scale: merge radius as a fraction of the approximate size of the components
+  :return: one component per group of agreeing detections, at the median position / size of the group with the most
+           common direction, and the number of samples that found it
+  """
+  min_votes = len(samples) // 2 + 1 if min_votes is None else min_votes
+  components = [comp for sample in samples for comp in sample.sized_components]
+  if not components:
+    return ConsensusSizedCircuitComponents(sized_components=[], samples=len(samples))
+  sample_index = np.repeat(np.arange(len(samples)), [len(sample.sized_components) for sample in samples])
+  positions = np.array([(comp.position.x, comp.position.y) for comp in components], dtype=np.float64)
+  sizes = np.array([comp.approximate_size for comp in components], dtype=np.float64)
+  directions = np.array([comp.positive_input_direction for comp in components])
+  names = np.array([comp.component_name.value for comp in components])
+
+  merged = []
+  for name in np.unique(names):
+    members_of_type = np.flatnonzero(names == name)
+    groups = cluster_samples(
+      positions[members_of_type], sizes[members_of_type], sample_index[members_of_type], radius_scale
+    )
+    for group in np.unique(groups):
+      members = members_of_type[groups == group]
+      if len(members) < min_votes:
+        continue
+      x, y = np.round(np.median(positions[members], axis=0)).astype(int)
+      values, counts = np.unique(directions[members], return_counts=True)
+      merged.append(VotedSizedComponent(
+        **components[members[0]].dict(exclude={'position', 'approximate_size', 'positive_input_direction'}),
+        position=ComponentPosition(x=int(x), y=int(y)),
+        approximate_size=int(round(np.median(sizes[members]))),
+        positive_input_direction=int(values[np.argmax(counts)]),
+        votes=len(members)
+      ))
+  return ConsensusSizedCircuitComponents(sized_components=renumber_components(merged), samples=len(samples))
@@ -0,0 +1,149 @@
+import asyncio
+from typing import Optional
+
+import httpx
+import numpy as np
+import yaml
+
+from photocircuit.component_detection.base_llm_component_detection_service import BaseLlmComponentDetectionService, \
+  MODEL
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.model import (
+  RefinedCircuitComponents, SizedCircuitComponents, SizedComponent
+)
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.component_detection import renumber_components
+from photocircuit.utils.image_encoder import ImageEncoder, EncodedImage
+from photocircuit.utils.mosaic import component_mosaic, DEFAULT_CELL_SIZE, DEFAULT_CROP_MARGIN
+from photocircuit.utils.prompt_utils import load_prompt
+
+
+def apply_refinements(components: list[SizedComponent], refined: RefinedCircuitComponents) -> list[SizedComponent]:
+  """
+  :param components: components in the order of their crops, crop numbers start at 1
+  :param refined: llm response for the mosaic of the components
+  :return: components with the refined names and directions, components the response skipped are kept as they were,
+           renumbered since their names can change
+  """
+  updates = {comp.crop: comp for comp in refined.refined_components}
+  updated = []
+  for crop, comp in enumerate(components, start=1):
+    refinement = updates.get(crop)
+    if refinement is not None:
+      comp = comp.copy(update={
+        'component_name': refinement.component_name,
+        'positive_input_direction': refinement.positive_input_direction,
+        'positive_input_direction_reasoning': refinement.positive_input_direction_reasoning,
+      })
+    updated.append(comp)
+  return renumber_components(updated)
+
+
+class CropRefinementService(BaseLlmComponentDetectionService[RefinedCircuitComponents]):
+  """
+  Second look at already located components: every component is cropped from the image into one numbered mosaic, and
+  the names and directions of all of them are checked in a single llm request.
+  """
+  def __init__(
+      self,
+      cache: Optional[DetectionCache] = None,
+      image_encoder: Optional[ImageEncoder] = None,
+      cell_size: int = DEFAULT_CELL_SIZE,
+      crop_margin: float = DEFAULT_CROP_MARGIN,
+      json_mode: bool = True,
+      http_async_client: Optional[httpx.AsyncClient] = None
+  ):
+    """
+    :param cache: optional cache of llm responses
+    :param image_encoder: encodes the mosaic within a byte budget, defaults to ImageEncoder()
+    :param cell_size: side length in pixels every crop is resampled to
+    :param crop_margin: crops are this many times the approximate size of their component
+    :param json_mode: request json output and parse it with FastOutputParser, otherwise yaml
+    :param http_async_client: client for async llm requests, defaults to the client shared by every service
+    """
+    super().__init__(RefinedCircuitComponents, 'crop_refinement/system.txt', 0, cache, image_encoder,
+                     json_mode=json_mode, http_async_client=http_async_client)
+    self.cell_size = cell_size
+    self.crop_margin = crop_margin
+    self.crops_prompt = load_prompt('crop_refinement/crops.txt')
+
+  def refine(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      components: SizedCircuitComponents,
+      bypass_cache: bool = False
+  ) -> list[SizedComponent]:
+    """
+    :param base64_circuit_img: image the components were found in
+    :param components: located components, e.g. from MultistageLlmComponentDetectionService.get_positioned_components
+    :param bypass_cache: always call the llm
+    :return: components with refined names and directions
+    """
+    if not components.sized_components:
+      return []
+    mosaic, crops, cache_key, cached = self._prepare_mosaic(base64_circuit_img, components, bypass_cache)
+    refined = cached
+    if refined is None:
+      refined = self._store(cache_key, self._invoke(self.build_messages(mosaic, crops)))
+    with self._stage('post_process'):
+      return apply_refinements(components.sized_components, refined)
+
+  async def arefine(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      components: SizedCircuitComponents,
+      bypass_cache: bool = False
+  ) -> list[SizedComponent]:
+    """
+    async version of refine
+    """
+    if not components.sized_components:
+      return []
+    mosaic, crops, cache_key, cached = await asyncio.to_thread(
+      self._prepare_mosaic, base64_circuit_img, components, bypass_cache
+    )
+    refined = cached
+    if refined is None:
+      refined = self._store(cache_key, await self._ainvoke(self.build_messages(mosaic, crops)))
+    with self._stage('post_process'):
+      return apply_refinements(components.sized_components, refined)
+
+  def crops_text(self, components: SizedCircuitComponents) -> str:
+    """
+    :return: text listing the first stage guess for every crop of the mosaic
+    """
+    listed = [
+      {
+        'crop': crop,
+        'component_name': comp.component_name.value,
+        'positive_input_direction': comp.positive_input_direction,
+      }
+      for crop, comp in enumerate(components.sized_components, start=1)
+    ]
+    return f"{self.crops_prompt}\n```yaml\n{yaml.safe_dump({'crops': listed}, sort_keys=False)}```"
+
+  def _prepare_mosaic(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      components: SizedCircuitComponents,
+      bypass_cache: bool
+  ) -> tuple[EncodedImage, str, Optional[str], Optional[RefinedCircuitComponents]]:
+    """
+    :return: (encoded mosaic, crop listing, cache key if the cache should be used, cached response on a hit)
+    """
+    image = self._decode(base64_circuit_img)
+    comps = components.sized_components
+    with self._stage('grid_render', crops=len(comps)):
+      centers = np.array([(comp.position.x, comp.position.y) for comp in comps])
+      sizes = np.array([comp.approximate_size for comp in comps])
+      mosaic_array = component_mosaic(
+        image.array, centers, sizes, [str(crop) for crop in range(1, len(comps) + 1)], self.cell_size, self.crop_margin
+      )
+    mosaic = self._encode(mosaic_array)
+    crops = self.crops_text(components)
+
+    if self.cache is None or bypass_cache:
+      return mosaic, crops, None, None
+    cache_key = DetectionCache.make_key(mosaic.data, self.system_prompt, self.format_instructions, MODEL,
+                                        self.temperature, self.cell_size, crops)
+    return mosaic, crops, cache_key, self._lookup(cache_key)
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from photocircuit.utils.cache import CacheStats, digest
+
+DEFAULT_CACHE_PATH = os.path.expanduser('~/.cache/photocircuit/detections.sqlite')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+
+class DetectionCache:
+  """
+  Persistent cache of parsed vision llm responses, keyed by a hash of everything that is sent to the llm.
+  
+  Entries are stored as the json of the parsed pydantic model in a sqlite database. Entries older than max_age_seconds
+  are never returned, and when the total size of stored entries goes over max_bytes the least recently used entries
+  are evicted.
+  """
+  def __init__(
+      self,
+      path: str = DEFAULT_CACHE_PATH,
+      max_bytes: int = DEFAULT_MAX_BYTES,
+      max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS
+  ):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.max_age_seconds = max_age_seconds
+    self.stats = CacheStats()
+    self._lock = threading.Lock()
+    
+    if path != ':memory:':
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    with self._conn:
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS detections ('
+        ' key TEXT PRIMARY KEY,'
+        ' value TEXT NOT NULL,'
+        ' size INTEGER NOT NULL,'
+        ' created_at REAL NOT NULL,'
+        ' accessed_at REAL NOT NULL'
+        ')'
+      )
+      self._conn.execute('CREATE INDEX IF NOT EXISTS detections_accessed_at ON detections (accessed_at)')
+  
+  @staticmethod
+  def make_key(
+      image: str | bytes,
+      system_prompt: str,
+      format_instructions: str,
+      model: str,
+      temperature: float,
+      step_size: int,
+      hints: Optional[str] = None
+  ) -> str:
+    """
+    :param image: gridded image exactly as sent to the llm
+    :param hints: any extra text sent with the image, e.g. candidate components
+    :return: key identifying a request to the llm
+    """
+    parts = [image, system_prompt, format_instructions, model, repr(float(temperature)), str(step_size)]
+    # requests without hints keep the keys they had before hints existed
+    if hints is not None:
+      parts.append(hints)
+    return digest(*parts)
+  
+  def get(self, key: str) -> Optional[str]:
+    """
+    :return: cached value, or None on a miss
+    """
+    now = time.time()
+    with self._lock, self._conn:
+      row = self._conn.execute(
+        'SELECT value FROM detections WHERE key = ? AND created_at >= ?',
+        (key, now - self.max_age_seconds)
+      ).fetchone()
+      if row is None:
+        self.stats.misses += 1
+        return None
+      self._conn.execute('UPDATE detections SET accessed_at = ? WHERE key = ?', (now, key))
+      self.stats.hits += 1
+      return row[0]
+  
+  def put(self, key: str, value: str):
+    now = time.time()
+    with self._lock, self._conn:
+      self._conn.execute(
+        'INSERT OR REPLACE INTO detections (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+        (key, value, len(value), now, now)
+      )
+      self._evict(now)
+  
+  def _evict(self, now: float):
+    expired = self._conn.execute('DELETE FROM detections WHERE created_at < ?', (now - self.max_age_seconds,))
+    self.stats.evictions += expired.rowcount
+    
+    total_size, = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM detections').fetchone()
+    if total_size <= self.max_bytes:
+      return
+    # walk entries from least recently used until enough space is freed
+    keys_to_evict = []
+    for key, size in self._conn.execute('SELECT key, size FROM detections ORDER BY accessed_at'):
+      if total_size <= self.max_bytes:
+        break
+      keys_to_evict.append((key,))
+      total_size -= size
+    self._conn.executemany('DELETE FROM detections WHERE key = ?', keys_to_evict)
+    self.stats.evictions += len(keys_to_evict)
+  
+  def clear(self):
+    with self._lock, self._conn:
+      self._conn.execute('DELETE FROM detections')
+  
+  def __len__(self) -> int:
+    with self._lock:
+      return self._conn.execute('SELECT COUNT(*) FROM detections').fetchone()[0]
+  
+  def close(self):
+    self._conn.close()
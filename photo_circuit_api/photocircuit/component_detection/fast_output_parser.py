@@ -0,0 +1,257 @@
+import json
+import re
+from contextvars import ContextVar
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Callable, Optional, Type, TypeVar
+
+import yaml
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import BaseOutputParser
+from pydantic.v1 import BaseModel
+from pydantic.v1.fields import ModelField, SHAPE_LIST, SHAPE_SINGLETON
+
+from photocircuit.utils.instrumentation import annotate
+
+T = TypeVar('T', bound=BaseModel)
+
+# body of the first fenced code block, or of an unterminated one the response was cut off in
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|ya?ml)?\s*\n?(?P<body>.*?)(?:```|$)", re.DOTALL)
+
+FORMAT_INSTRUCTIONS = """The output should be a single JSON object, without any other text, that conforms to the JSON schema below.
+```
+{schema}
+```"""
+
+# libyaml's loader when pyyaml was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+type Validator = Callable[[Any], Any]
+
+
+# items dropped from lists while validating the current response, see parse_structured_output
+_dropped_items: ContextVar[Optional[list[int]]] = ContextVar('dropped_items', default=None)
+
+
+def _to_int(value: Any) -> int:
+  if isinstance(value, bool):
+    raise ValueError(f"expected an integer, got {value!r}")
+  if isinstance(value, int):
+    return value
+  if isinstance(value, float) and value.is_integer():
+    return int(value)
+  if isinstance(value, str):
+    return int(float(value.strip()))
+  if isinstance(value, float):
+    return round(value)
+  raise ValueError(f"expected an integer, got {value!r}")
+
+
+def _to_str(value: Any) -> str:
+  if isinstance(value, str):
+    return value
+  if isinstance(value, (int, float)) and not isinstance(value, bool):
+    return str(value)
+  raise ValueError(f"expected a string, got {value!r}")
+
+
+def _enum_validator(enum_type: type[Enum]) -> Validator:
+  by_value = {str(member.value).lower(): member for member in enum_type}
+
+  def validate(value: Any) -> Enum:
+    member = by_value.get(str(value).strip().lower())
+    if member is None:
+      raise ValueError(f"{value!r} is not a valid {enum_type.__name__}")
+    return member
+
+  return validate
+
+
+def type_validator(tp: type) -> Validator:
+  """
+  :return: validator for a single value of type tp, raising ValueError or TypeError if it does not fit
+  """
+  if isinstance(tp, type) and issubclass(tp, BaseModel):
+    return compile_validator(tp)
+  if isinstance(tp, type) and issubclass(tp, Enum):
+    return _enum_validator(tp)
+  if tp is int:
+    return _to_int
+  if tp is str:
+    return _to_str
+  if tp is float:
+    return float
+  raise TypeError(f"no fast validator for fields of type {tp!r}")
+
+
+def _field_validator(field: ModelField) -> Validator:
+  validate_item = type_validator(field.type_)
+  if field.shape == SHAPE_SINGLETON:
+    validate = validate_item
+  elif field.shape == SHAPE_LIST:
+    def validate(value: Any) -> list:
+      if not isinstance(value, list):
+        raise ValueError(f"expected a list, got {value!r}")
+      items = []
+      for item in value:
+        try:
+          items.append(validate_item(item))
+        except (ValueError, TypeError):
+          # one bad item does not lose the rest of the list
+          dropped = _dropped_items.get()
+          if dropped is not None:
+            dropped[0] += 1
+      return items
+  else:
+    raise TypeError(f"no fast validator for field {field.name} of shape {field.shape}")
+
+  if not field.allow_none:
+    return validate
+  return lambda value: None if value is None else validate(value)
+
+
+@lru_cache(maxsize=None)
+def compile_validator(model: type[T]) -> Callable[[Any], T]:
+  """
+  Builds a validator for model once, so responses skip pydantic's per call validation machinery.
+
+  The validator coerces the field types our models use (nested models, lists, enums matched by value ignoring case,
+  ints given as floats or strings, optional strings) and constructs the model without validating it again. Items of
+  a list that fail validation are dropped instead of failing the whole model.
+
+  :return: function validating a parsed json object into model, raising ValueError if it does not fit
+  """
+  fields = [
+    (name, field.alias, _field_validator(field), field.required, field.default)
+    for name, field in model.__fields__.items()
+  ]
+
+  def validate(value: Any) -> T:
+    if not isinstance(value, dict):
+      raise ValueError(f"expected an object for {model.__name__}, got {value!r}")
+    values = {}
+    for name, alias, validate_field, required, default in fields:
+      if alias in value:
+        values[name] = validate_field(value[alias])
+      elif required:
+        raise ValueError(f"{model.__name__} is missing {alias}")
+      else:
+        values[name] = default
+    return model.construct(**values)
+
+  return validate
+
+
+def load_yaml(text: str) -> Any:
+  return yaml.load(text, Loader=YAML_LOADER)
+
+
+def strip_code_fence(text: str) -> str:
+  """
+  :return: body of the first code block in text, or text itself without one
+  """
+  text = text.strip()
+  match = CODE_FENCE_PATTERN.search(text)
+  return match.group('body').strip() if match is not None and text.startswith('```') else text
+
+
+def salvage_json_items(text: str, model: type[T]) -> T:
+  """
+  Recovers the complete items of the list fields of model from truncated or otherwise broken json, by decoding every
+  object after each list's key on its own.
+
+  :raises: ValueError if no list field of model is found in text
+  """
+  decoder = json.JSONDecoder()
+  validate = compile_validator(model)
+  values, found = {}, False
+  for field in model.__fields__.values():
+    if field.shape != SHAPE_LIST:
+      continue
+    key = re.search(rf'"{re.escape(field.alias)}"\s*:\s*\[', text)
+    if key is None:
+      continue
+    found = True
+    validate_item = type_validator(field.type_)
+    items, position = [], key.end()
+    while (position := text.find('{', position)) != -1:
+      try:
+        item, end = decoder.raw_decode(text, position)
+        validate_item(item)
+        items.append(item)
+        position = end
+      except (ValueError, TypeError):
+        # a truncated or invalid item, continue from the next object, possibly one nested in it
+        position += 1
+    values[field.alias] = items
+  if not found:
+    raise ValueError(f"no list of {model.__name__} found")
+  return validate(values)
+
+
+def salvage_yaml_items(text: str, model: type[T]) -> T:
+  """
+  Recovers the complete items of truncated yaml, by dropping trailing lines until the rest parses.
+
+  :raises: ValueError if no prefix of text parses into model
+  """
+  validate = compile_validator(model)
+  lines = text.splitlines()
+  for end in range(len(lines) - 1, 0, -1):
+    try:
+      return validate(load_yaml("\n".join(lines[:end])))
+    except (yaml.YAMLError, ValueError, TypeError):
+      continue
+  raise ValueError(f"no {model.__name__} found")
+
+
+def parse_structured_output(text: str, model: type[T]) -> tuple[T, int]:
+  """
+  Parses an llm response into model: as json, then as yaml for models ignoring json mode, then by salvaging the
+  complete items of a broken response.
+
+  :return: (parsed model, number of list items dropped because they were invalid or incomplete)
+  :raises: ValueError if nothing could be recovered from text
+  """
+  validate = compile_validator(model)
+  body = strip_code_fence(text)
+  dropped = [0]
+  token = _dropped_items.set(dropped)
+  try:
+    for load in (json.loads, load_yaml):
+      try:
+        return validate(load(body)), dropped[0]
+      except (ValueError, TypeError, yaml.YAMLError):
+        dropped[0] = 0
+    salvage = salvage_json_items if body.lstrip().startswith('{') else salvage_yaml_items
+    # the item being written when the response was cut off is lost
+    return salvage(body, model), dropped[0] + 1
+  finally:
+    _dropped_items.reset(token)
+
+
+class FastOutputParser(BaseOutputParser[T]):
+  """
+  Drop in replacement for YamlOutputParser for responses in json mode, see parse_structured_output
+  """
+  pydantic_object: Type[T]
+
+  def parse(self, text: str) -> T:
+    try:
+      parsed, dropped = parse_structured_output(text, self.pydantic_object)
+    except ValueError as e:
+      raise OutputParserException(
+        f"Failed to parse {self.pydantic_object.__name__} from completion {text}. Got: {e}", llm_output=text
+      ) from e
+    if dropped:
+      # recorded on the parse stage the parser runs in
+      annotate(dropped_items=dropped)
+    return parsed
+
+  def get_format_instructions(self) -> str:
+    schema = {k: v for k, v in self.pydantic_object.schema().items() if k not in ('title', 'type')}
+    return FORMAT_INSTRUCTIONS.format(schema=json.dumps(schema))
+
+  @property
+  def _type(self) -> str:
+    return 'fast_structured_output'
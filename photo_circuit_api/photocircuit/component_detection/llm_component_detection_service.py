@@ -1,33 +1,212 @@
-from langchain.output_parsers import YamlOutputParser
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_openai import ChatOpenAI
+import asyncio
+from typing import AsyncIterator, Iterator, Optional
 
-from photocircuit.component_detection.model import CircuitComponents
-from photocircuit.utils.prompt_utils import load_prompt, generate_image_with_grid_base64
+import httpx
+
+from photocircuit.component_detection.adaptive_sampling import AdaptiveSampler, AdaptiveSamplingResult
+from photocircuit.component_detection.base_component_detection_service import BaseComponentDetectionService
+from photocircuit.component_detection.base_llm_component_detection_service import BaseLlmComponentDetectionService
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.model import CircuitComponents, Component
+from photocircuit.component_detection.packed_llm_component_detection_service import \
+  PackedLlmComponentDetectionService
+from photocircuit.utils.async_utils import gather_limited, DEFAULT_CONCURRENCY
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.image_encoder import ImageEncoder
+from photocircuit.utils.shelf_packing import PackedBin
 
 
 # class LlmComponentDetectionService(BaseComponentDetectionService):
-class LlmComponentDetectionService:
-  def __init__(self, temperature: float = 0):
-    self.llm = ChatOpenAI(temperature=temperature, model="gpt-4o", max_tokens=1024)
-    self.parser = YamlOutputParser(pydantic_object=CircuitComponents)
-    self.format_instructions = self.parser.get_format_instructions()
-    self.system_prompt = load_prompt('llm_component_detection/system.txt')
-    self.chain = self.llm | self.parser
+class LlmComponentDetectionService(BaseLlmComponentDetectionService[CircuitComponents]):
+  def __init__(
+      self,
+      temperature: float = 0,
+      cache: Optional[DetectionCache] = None,
+      image_encoder: Optional[ImageEncoder] = None,
+      candidate_detector: Optional[BaseComponentDetectionService] = None,
+      json_mode: bool = True,
+      http_async_client: Optional[httpx.AsyncClient] = None
+  ):
+    """
+    :param temperature: sampling temperature of the vision llm
+    :param cache: optional cache of llm responses, requests with identical inputs are only sent once
+    :param image_encoder: encodes the gridded image within a byte budget, defaults to ImageEncoder()
+    :param candidate_detector: optional fast detector whose components are given to the llm as candidates
+    :param json_mode: request json output and parse it with FastOutputParser, otherwise yaml
+    :param http_async_client: client for async llm requests, shared with the packed service
+    """
+    super().__init__(
+      CircuitComponents, 'llm_component_detection/system.txt', temperature, cache, image_encoder, candidate_detector,
+      json_mode, http_async_client
+    )
+    self.packed_service = PackedLlmComponentDetectionService(
+      temperature, cache, self.image_encoder, json_mode=json_mode, http_async_client=http_async_client
+    )
+    
+  def label_components(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      bypass_cache: bool = False,
+      temperature: Optional[float] = None
+  ) -> CircuitComponents:
+    """
+    :param base64_image: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels
+    :param include_grid: draw gridlines over the image, otherwise only coordinate labels are drawn
+    :param bypass_cache: always call the llm, use when deliberately sampling the same input multiple times
+    :param temperature: sampling temperature of this call, defaults to the service's, e.g. to sweep temperatures with
+                        one service
+    :return: components found in the image
+    """
+    return self._detect(base64_image, int_size, include_grid, bypass_cache, temperature)
+  
+  async def alabel_components(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      bypass_cache: bool = False,
+      temperature: Optional[float] = None
+  ) -> CircuitComponents:
+    """
+    async version of label_components
+    """
+    return await self._adetect(base64_image, int_size, include_grid, bypass_cache, temperature)
+  
+  def stream_components(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      bypass_cache: bool = False
+  ) -> Iterator[Component]:
+    """
+    Streams the llm response, yielding each component as soon as the llm has finished writing it, so the first
+    components are available long before the whole response
+    
+    :param base64_image: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels
+    :param include_grid: draw gridlines over the image, otherwise only coordinate labels are drawn
+    :param bypass_cache: always call the llm
+    :return: components found in the image, in the order the llm lists them
+    """
+    return self._stream(base64_image, int_size, include_grid, bypass_cache)
+  
+  def astream_components(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      bypass_cache: bool = False
+  ) -> AsyncIterator[Component]:
+    """
+    async version of stream_components
+    """
+    return self._astream(base64_image, int_size, include_grid, bypass_cache)
+  
+  async def alabel_components_many(
+      self,
+      base64_images: list[CircuitImage | str],
+      int_sizes: int | list[int],
+      include_grid: bool = True,
+      bypass_cache: bool = False,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> list[CircuitComponents | BaseException]:
+    """
+    Labels many images concurrently
+    
+    :param base64_images: images of circuits
+    :param int_sizes: grid spacing for all images, or one per image
+    :param concurrency: max number of llm requests in flight at once
+    :return: components for each image in input order, if labeling an image failed its exception is returned instead
+    """
+    return await self._adetect_many(base64_images, int_sizes, include_grid, bypass_cache, concurrency)
+  
+  def label_components_packed(
+      self,
+      base64_images: list[CircuitImage | str],
+      int_sizes: int | list[int],
+      include_grid: bool = True,
+      bypass_cache: bool = False,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> list[CircuitComponents | BaseException]:
+    """
+    Labels many small images with fewer llm requests, by bin packing them onto shared canvases with one request per
+    canvas. Each circuit gets its own numbered grid on the canvas, and its components are returned in its own
+    coordinates. Images too large to share a canvas are labelled alone, exactly as by label_components.
+    
+    :param base64_images: images of circuits
+    :param int_sizes: grid spacing for all images, or one per image
+    :param include_grid: draw gridlines over the images, otherwise only coordinate labels are drawn
+    :param bypass_cache: always call the llm
+    :param concurrency: max number of llm requests in flight at once
+    :return: components for each image in input order, if the request for an image failed its exception is returned
+             instead
+    """
+    return asyncio.run(
+      self.alabel_components_packed(base64_images, int_sizes, include_grid, bypass_cache, concurrency)
+    )
+  
+  async def alabel_components_packed(
+      self,
+      base64_images: list[CircuitImage | str],
+      int_sizes: int | list[int],
+      include_grid: bool = True,
+      bypass_cache: bool = False,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> list[CircuitComponents | BaseException]:
+    """
+    async version of label_components_packed
+    """
+    if isinstance(int_sizes, int):
+      int_sizes = [int_sizes] * len(base64_images)
+    regions, bins = await asyncio.to_thread(self.packed_service.pack, base64_images, int_sizes, include_grid)
+    
+    async def label_bin(packed_bin: PackedBin) -> list[CircuitComponents]:
+      if len(packed_bin.indices) == 1:
+        index, = packed_bin.indices
+        return [await self._adetect(base64_images[index], int_sizes[index], include_grid, bypass_cache)]
+      return await self.packed_service.alabel_bin(regions, packed_bin, bypass_cache)
     
-  def label_components(self, base64_image: str, int_size: int, include_grid: bool = True) -> CircuitComponents:
-    print('adding gridlines')
-    img_with_grid = generate_image_with_grid_base64(base64_image, int_size, include_grid)
+    bin_results = await gather_limited((lambda b=b: label_bin(b) for b in bins), concurrency)
+    results: list[CircuitComponents | BaseException] = [None] * len(base64_images)
+    for packed_bin, bin_result in zip(bins, bin_results):
+      for position, index in enumerate(packed_bin.indices):
+        results[index] = bin_result if isinstance(bin_result, BaseException) else bin_result[position]
+    return results
+  
+  def label_components_adaptive(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      sampler: Optional[AdaptiveSampler] = None,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> AdaptiveSamplingResult:
+    """
+    Samples the components of an image until the samples agree, see AdaptiveSampler
     
-    print('invoking gpt4o to label circuit image')
-    msgs = [
-      SystemMessage(content=self.system_prompt),
-      HumanMessage(
-        content=[
-          {"type": "text", "text": self.format_instructions},
-          {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_with_grid}"}},
-        ])
-    ]
-    components = self.chain.invoke(msgs)
-    print("got following response from vision llm: \n", components)
-    return components
+    :param base64_image: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels, also the merge size of the samples' components
+    :param include_grid: draw gridlines over the image, otherwise only coordinate labels are drawn
+    :param sampler: when to stop sampling, defaults to AdaptiveSampler()
+    :param concurrency: max number of llm requests in flight at once
+    :return: consensus of the samples and the number of llm calls used
+    """
+    return asyncio.run(self.alabel_components_adaptive(base64_image, int_size, include_grid, sampler, concurrency))
+  
+  async def alabel_components_adaptive(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      sampler: Optional[AdaptiveSampler] = None,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> AdaptiveSamplingResult:
+    """
+    async version of label_components_adaptive
+    """
+    draw = await self._asampler(base64_image, int_size, include_grid, concurrency)
+    return await (sampler or AdaptiveSampler()).asample(draw, int_size)
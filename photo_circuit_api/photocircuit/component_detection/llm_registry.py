@@ -0,0 +1,128 @@
+"""
+Process-wide registry of what every llm service would otherwise build for itself, so creating a service is cheap and
+services created for different stages, temperatures or experiments share their connections:
+
+- pooled http clients, whose keep-alive connections are reused by every chat model
+- one chat model per model and endpoint, shared by every temperature, which is bound per request instead
+- output parsers and their format instructions, built once per output model
+
+Prompt texts are memoized by load_prompt.
+"""
+import os
+import threading
+from functools import lru_cache
+from typing import Optional, TYPE_CHECKING
+
+import httpx
+from langchain_core.output_parsers import BaseOutputParser
+from pydantic.v1 import BaseModel
+
+from photocircuit.component_detection.fast_output_parser import FastOutputParser
+from photocircuit.utils.http_client import pooled_client, pooled_async_client, close_pools
+from photocircuit.utils.prompt_utils import load_prompt
+
+if TYPE_CHECKING:
+  from langchain_openai import ChatOpenAI
+
+_lock = threading.Lock()
+_http_clients: dict[str, httpx.Client | httpx.AsyncClient] = {}
+_chat_models: dict[tuple, 'ChatOpenAI'] = {}
+
+
+def shared_client() -> httpx.Client:
+  """
+  :return: pooled client for sync llm requests of every chat model of the process
+  """
+  with _lock:
+    if 'sync' not in _http_clients:
+      _http_clients['sync'] = pooled_client()
+    return _http_clients['sync']
+
+
+def shared_async_client() -> httpx.AsyncClient:
+  """
+  :return: pooled client for async llm requests of every chat model not given a client of its own, usable from any
+           event loop
+  """
+  with _lock:
+    if 'async' not in _http_clients:
+      _http_clients['async'] = pooled_async_client()
+    return _http_clients['async']
+
+
+def chat_model(model: str, max_tokens: int, http_async_client: Optional[httpx.AsyncClient] = None) -> 'ChatOpenAI':
+  """
+  The model is created with temperature 0, bind the temperature of each request with
+  chat_model(...).bind(temperature=...)
+
+  A model created for a client of the caller keeps the client alive as long as it is registered, call release with the
+  client once it is closed.
+
+  :param http_async_client: client for async requests, defaults to shared_async_client()
+  :return: chat model shared by every caller with the same arguments and the same OPENAI_BASE_URL / OPENAI_API_KEY
+  """
+  # read on every call, so services created after pointing the environment at another server use that server
+  endpoint = os.environ.get('OPENAI_BASE_URL') or os.environ.get('OPENAI_API_BASE'), os.environ.get('OPENAI_API_KEY')
+  key = (model, max_tokens, endpoint, http_async_client)
+  with _lock:
+    llm = _chat_models.get(key)
+  if llm is not None:
+    return llm
+
+  # imported here, the openai client is the slowest import of the package and only needed once a service is built
+  from langchain_openai import ChatOpenAI
+  client, async_client = shared_client(), http_async_client or shared_async_client()
+  with _lock:
+    if key not in _chat_models:
+      # stream_usage reports the token usage of streamed responses in their last chunk
+      _chat_models[key] = ChatOpenAI(
+        model=model, temperature=0, max_tokens=max_tokens, stream_usage=True, http_client=client,
+        http_async_client=async_client
+      )
+    return _chat_models[key]
+
+
+@lru_cache(maxsize=None)
+def output_parser(output_model: type[BaseModel], json_mode: bool) -> BaseOutputParser:
+  """
+  :param json_mode: FastOutputParser for json responses, otherwise langchain's YamlOutputParser
+  :return: parser shared by every service with the same output model, parsers keep no state between responses
+  """
+  if json_mode:
+    return FastOutputParser(pydantic_object=output_model)
+  from langchain.output_parsers import YamlOutputParser
+  return YamlOutputParser(pydantic_object=output_model)
+
+
+@lru_cache(maxsize=None)
+def format_instructions(output_model: type[BaseModel], json_mode: bool) -> str:
+  """
+  :return: format instructions of output_parser(output_model, json_mode)
+  """
+  return output_parser(output_model, json_mode).get_format_instructions()
+
+
+def release(http_async_client: httpx.AsyncClient):
+  """
+  Forgets the chat models created for a client of the caller, services created before keep using them
+  """
+  with _lock:
+    for key in [key for key in _chat_models if key[-1] is http_async_client]:
+      del _chat_models[key]
+
+
+def clear():
+  """
+  Forgets every shared client, chat model, parser and prompt. The shared clients are closed, so services created before
+  can no longer make sync requests, and their async requests open new connections.
+  """
+  with _lock:
+    client, async_client = _http_clients.pop('sync', None), _http_clients.pop('async', None)
+    _chat_models.clear()
+  if client is not None:
+    client.close()
+  if async_client is not None:
+    close_pools(async_client)
+  output_parser.cache_clear()
+  format_instructions.cache_clear()
+  load_prompt.cache_clear()
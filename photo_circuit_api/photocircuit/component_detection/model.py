@@ -53,3 +53,38 @@ class SizedComponent(Component):
 class SizedCircuitComponents(BaseModel):
   sized_components: list[SizedComponent] = Field(description="list of components with size in the image")
 
+
+class VotedSizedComponent(SizedComponent):
+  votes: int = Field(description="number of samples that found this component")
+
+
+class ConsensusSizedCircuitComponents(SizedCircuitComponents):
+  sized_components: list[VotedSizedComponent] = Field(description="components found by enough of the samples")
+  samples: int = Field(description="number of samples the consensus was taken over")
+
+
+class RefinedComponent(BaseModel):
+  crop: int = Field(description="number written above the crop of the component")
+  component_name: ComponentName = Field(description="name of component")
+  positive_input_direction: int = Field(
+    description="Angle (in degrees) for the positive terminal of the component. For non-polar elements, any wire "
+                "can be positive. 0 degrees: right, 90 degrees: top, 180 degrees: left, 270 degrees: bottom.",
+    examples=[0, 90, 180, 270]
+  )
+  positive_input_direction_reasoning: str = Field(
+    description="detailed description of choice for positive_input_direction",
+    default=None
+  )
+
+
+class RefinedCircuitComponents(BaseModel):
+  refined_components: list[RefinedComponent] = Field(description="one entry for every crop in the image")
+
+
+class PackedCircuit(BaseModel):
+  circuit: int = Field(description="number written above the circuit")
+  components: list[Component] = Field(description="list of components in this circuit")
+
+
+class PackedCircuitComponents(BaseModel):
+  circuits: list[PackedCircuit] = Field(description="components of every circuit in the image")
@@ -1,44 +1,211 @@
-from langchain.output_parsers import YamlOutputParser
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_openai import ChatOpenAI
+import asyncio
+from typing import AsyncIterator, Iterator, Optional
 
-from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
-from photocircuit.component_detection.model import CircuitComponents, SizedCircuitComponents
-from photocircuit.utils.common import scale_image, base64_to_numpy
-from photocircuit.utils.prompt_utils import load_prompt, generate_image_with_grid_base64
+import httpx
 
+from photocircuit.component_detection.adaptive_sampling import AdaptiveSampler, AdaptiveSamplingResult
+from photocircuit.component_detection.base_component_detection_service import BaseComponentDetectionService
+from photocircuit.component_detection.base_llm_component_detection_service import BaseLlmComponentDetectionService
+from photocircuit.component_detection.consensus import consensus_merge
+from photocircuit.component_detection.crop_refinement_service import CropRefinementService
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.model import (
+  CircuitComponents, SizedCircuitComponents, ConsensusSizedCircuitComponents, SizedComponent
+)
+from photocircuit.utils.async_utils import DEFAULT_CONCURRENCY
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.image_encoder import ImageEncoder
 
-class MultistageLlmComponentDetectionService:
-  def __init__(self):
-    self.llm_component_detection_service = LlmComponentDetectionService()
-    self.llm = ChatOpenAI(temperature=0, model="gpt-4o", max_tokens=1024)
-    self.parser = YamlOutputParser(pydantic_object=SizedCircuitComponents)
-    self.format_instructions = self.parser.get_format_instructions()
-    self.system_prompt = load_prompt('multistage_llm_component_detection/system.txt')
-    self.chain = self.llm | self.parser
-    
-  def get_positioned_components(self, base64_circuit_img: str, int_size: int) -> SizedCircuitComponents:
-    print('adding gridlines')
-    img_with_grid = generate_image_with_grid_base64(base64_circuit_img, int_size, True)
-    
-    print('invoking gpt4o to label circuit image')
-    msgs = [
-      SystemMessage(content=self.system_prompt),
-      HumanMessage(
-        content=[
-          {"type": "text", "text": self.format_instructions},
-          {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_with_grid}"}},
-        ])
-    ]
-    components = self.chain.invoke(msgs)
-    print("got following response from vision llm: \n", components)
-    return components
-    
-  def label_components(self, base64_circuit_img: str, int_size: int) -> CircuitComponents:
-    # first_stage_components = self.llm_component_detection_service.label_components(base64_circuit_img, int_size, True)
-    # print("[Stage 1] got following response from vision llm: \n", first_stage_components)
-    
-    print("[Stage 1] Initial Sized Components")
-    # first_stage_comps_sized = self.get_positioned_components()
-    
-    return CircuitComponents(components=[])
+DEFAULT_SAMPLES = 5
+
+
+class MultistageLlmComponentDetectionService(BaseLlmComponentDetectionService[SizedCircuitComponents]):
+  def __init__(
+      self,
+      cache: Optional[DetectionCache] = None,
+      image_encoder: Optional[ImageEncoder] = None,
+      candidate_detector: Optional[BaseComponentDetectionService] = None,
+      json_mode: bool = True,
+      http_async_client: Optional[httpx.AsyncClient] = None
+  ):
+    """
+    :param cache: optional cache of llm responses, shared with the crop refinement service
+    :param image_encoder: encodes the gridded image within a byte budget, shared with the crop refinement service
+    :param candidate_detector: optional fast detector whose components are given to the llm as candidates
+    :param json_mode: request json output and parse it with FastOutputParser, otherwise yaml
+    :param http_async_client: client for async llm requests, shared with the crop refinement service
+    """
+    super().__init__(
+      SizedCircuitComponents, 'multistage_llm_component_detection/system.txt', 0, cache, image_encoder,
+      candidate_detector, json_mode, http_async_client
+    )
+    self.crop_refinement_service = CropRefinementService(
+      cache=cache, image_encoder=self.image_encoder, json_mode=json_mode, http_async_client=http_async_client
+    )
+    
+  def get_positioned_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      bypass_cache: bool = False
+  ) -> SizedCircuitComponents:
+    return self._detect(base64_circuit_img, int_size, True, bypass_cache)
+  
+  async def aget_positioned_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      bypass_cache: bool = False
+  ) -> SizedCircuitComponents:
+    """
+    async version of get_positioned_components
+    """
+    return await self._adetect(base64_circuit_img, int_size, True, bypass_cache)
+  
+  def stream_positioned_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      bypass_cache: bool = False
+  ) -> Iterator[SizedComponent]:
+    """
+    Streams the llm response, yielding each sized component as soon as the llm has finished writing it
+    
+    :param base64_circuit_img: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels
+    :param bypass_cache: always call the llm
+    :return: sized components found in the image, in the order the llm lists them
+    """
+    return self._stream(base64_circuit_img, int_size, True, bypass_cache)
+  
+  def astream_positioned_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      bypass_cache: bool = False
+  ) -> AsyncIterator[SizedComponent]:
+    """
+    async version of stream_positioned_components
+    """
+    return self._astream(base64_circuit_img, int_size, True, bypass_cache)
+  
+  async def aget_positioned_components_many(
+      self,
+      base64_circuit_imgs: list[CircuitImage | str],
+      int_sizes: int | list[int],
+      bypass_cache: bool = False,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> list[SizedCircuitComponents | BaseException]:
+    """
+    Gets sized components of many images concurrently
+    
+    :param base64_circuit_imgs: images of circuits
+    :param int_sizes: grid spacing for all images, or one per image
+    :param concurrency: max number of llm requests in flight at once
+    :return: components for each image in input order, if an image failed its exception is returned instead
+    """
+    return await self._adetect_many(base64_circuit_imgs, int_sizes, True, bypass_cache, concurrency)
+    
+  def get_consensus_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      samples: int = DEFAULT_SAMPLES,
+      min_votes: Optional[int] = None,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> ConsensusSizedCircuitComponents:
+    """
+    Samples the sized components of an image several times at once and keeps the components the samples agree on
+    
+    :param base64_circuit_img: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels
+    :param samples: number of llm requests
+    :param min_votes: min number of samples that must find a component, defaults to a majority of the samples that
+                      succeeded
+    :param concurrency: max number of llm requests in flight at once
+    :return: consensus components with the number of samples that found each one
+    """
+    return asyncio.run(self.aget_consensus_components(base64_circuit_img, int_size, samples, min_votes, concurrency))
+  
+  async def aget_consensus_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      samples: int = DEFAULT_SAMPLES,
+      min_votes: Optional[int] = None,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> ConsensusSizedCircuitComponents:
+    """
+    async version of get_consensus_components, raises the error of the first sample if every sample failed
+    """
+    results = await self._asample(base64_circuit_img, int_size, True, samples, concurrency)
+    succeeded = [result for result in results if not isinstance(result, BaseException)]
+    if not succeeded:
+      raise results[0]
+    with self._stage('post_process', samples=len(succeeded)):
+      return consensus_merge(succeeded, min_votes)
+    
+  def get_positioned_components_adaptive(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      sampler: Optional[AdaptiveSampler] = None,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> AdaptiveSamplingResult:
+    """
+    Samples the sized components of an image until the samples agree, see AdaptiveSampler
+    
+    :param base64_circuit_img: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels
+    :param sampler: when to stop sampling, defaults to AdaptiveSampler()
+    :param concurrency: max number of llm requests in flight at once
+    :return: consensus of the samples and the number of llm calls used
+    """
+    return asyncio.run(self.aget_positioned_components_adaptive(base64_circuit_img, int_size, sampler, concurrency))
+  
+  async def aget_positioned_components_adaptive(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      sampler: Optional[AdaptiveSampler] = None,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ) -> AdaptiveSamplingResult:
+    """
+    async version of get_positioned_components_adaptive
+    """
+    draw = await self._asampler(base64_circuit_img, int_size, True, concurrency)
+    return await (sampler or AdaptiveSampler()).asample(draw, int_size)
+    
+  def label_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      bypass_cache: bool = False
+  ) -> CircuitComponents:
+    """
+    Locates the components on the gridded image, then refines the names and directions of all of them at once from a
+    mosaic of their crops, two llm requests in total
+    
+    :param base64_circuit_img: image of circuit
+    :param int_size: spacing of grid drawn over the image in pixels
+    :param bypass_cache: always call the llm
+    :return: components found in the image
+    """
+    sized_components = self.get_positioned_components(base64_circuit_img, int_size, bypass_cache)
+    return CircuitComponents(
+      components=self.crop_refinement_service.refine(base64_circuit_img, sized_components, bypass_cache)
+    )
+  
+  async def alabel_components(
+      self,
+      base64_circuit_img: CircuitImage | str,
+      int_size: int,
+      bypass_cache: bool = False
+  ) -> CircuitComponents:
+    """
+    async version of label_components
+    """
+    sized_components = await self.aget_positioned_components(base64_circuit_img, int_size, bypass_cache)
+    return CircuitComponents(
+      components=await self.crop_refinement_service.arefine(base64_circuit_img, sized_components, bypass_cache)
+    )
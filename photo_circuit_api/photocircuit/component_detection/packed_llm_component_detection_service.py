@@ -0,0 +1,179 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+import numpy as np
+import yaml
+
+from photocircuit.component_detection.base_llm_component_detection_service import BaseLlmComponentDetectionService, \
+  MODEL
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.model import CircuitComponents, PackedCircuitComponents
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.grid_renderer import label_glyph, render_grid
+from photocircuit.utils.image_encoder import ImageEncoder, EncodedImage
+from photocircuit.utils.prompt_utils import load_prompt
+from photocircuit.utils.shelf_packing import PackedBin, shelf_pack
+
+# side length of a packed canvas, the largest image the llm sees without downscaling it
+DEFAULT_CANVAS_SIZE = 1536
+# space between circuits on a canvas, so their grids and labels do not run into each other
+DEFAULT_GAP = 32
+TITLE_PADDING = 4
+
+
+@dataclass(frozen=True)
+class PackedRegion:
+  # circuit image with its own grid
+  gridded: np.ndarray
+  # size of the circuit image itself
+  width: int
+  height: int
+
+
+def circuit_title(number: int) -> str:
+  return f"circuit {number}"
+
+
+def title_height() -> int:
+  return label_glyph(circuit_title(0)).shape[0] + 2 * TITLE_PADDING
+
+
+def region_size(region: PackedRegion, max_number: int) -> tuple[int, int]:
+  """
+  :return: (width, height) of the region on a canvas, including the title above the gridded circuit
+  """
+  height, width = region.gridded.shape[:2]
+  return max(width, label_glyph(circuit_title(max_number)).shape[1]), title_height() + height
+
+
+def render_canvas(regions: list[PackedRegion], packed_bin: PackedBin) -> np.ndarray:
+  """
+  :return: white canvas with every region of the bin at its offset, titled with its number in the bin starting at 1
+  """
+  canvas = np.full((packed_bin.height, packed_bin.width, 3), 255, dtype=np.uint8)
+  top = title_height()
+  for number, (index, (x, y)) in enumerate(zip(packed_bin.indices, packed_bin.offsets.tolist()), start=1):
+    gridded = regions[index].gridded
+    h, w = gridded.shape[:2]
+    canvas[y + top:y + top + h, x:x + w] = gridded
+    glyph = label_glyph(circuit_title(number))
+    canvas[y + TITLE_PADDING:y + TITLE_PADDING + glyph.shape[0], x:x + glyph.shape[1]][glyph] = 0
+  return canvas
+
+
+def split_circuits(packed: PackedCircuitComponents, circuits: int) -> list[CircuitComponents]:
+  """
+  :param packed: llm response for a canvas of numbered circuits, numbers start at 1
+  :param circuits: number of circuits on the canvas
+  :return: components of each circuit in its own coordinates, empty for circuits the response skipped
+  """
+  components = [[] for _ in range(circuits)]
+  for circuit in packed.circuits:
+    if 1 <= circuit.circuit <= circuits:
+      components[circuit.circuit - 1].extend(circuit.components)
+  return [CircuitComponents(components=comps) for comps in components]
+
+
+class PackedLlmComponentDetectionService(BaseLlmComponentDetectionService[PackedCircuitComponents]):
+  """
+  Labels several small circuits in one llm request by packing them onto one canvas, each circuit with its own
+  numbered grid, so they share the per request latency and prompt. Use through
+  LlmComponentDetectionService.alabel_components_packed.
+  """
+  def __init__(
+      self,
+      temperature: float = 0,
+      cache: Optional[DetectionCache] = None,
+      image_encoder: Optional[ImageEncoder] = None,
+      canvas_size: int = DEFAULT_CANVAS_SIZE,
+      gap: int = DEFAULT_GAP,
+      json_mode: bool = True,
+      http_async_client: Optional[httpx.AsyncClient] = None
+  ):
+    """
+    :param temperature: sampling temperature of the vision llm
+    :param cache: optional cache of llm responses
+    :param image_encoder: encodes the canvas within a byte budget, defaults to ImageEncoder()
+    :param canvas_size: max width and height of a canvas
+    :param gap: space between circuits on a canvas in pixels
+    :param json_mode: request json output and parse it with FastOutputParser, otherwise yaml
+    :param http_async_client: client for async llm requests, defaults to the client shared by every service
+    """
+    super().__init__(PackedCircuitComponents, 'packed_llm_component_detection/system.txt', temperature, cache,
+                     image_encoder, json_mode=json_mode, http_async_client=http_async_client)
+    self.canvas_size = canvas_size
+    self.gap = gap
+    self.circuits_prompt = load_prompt('packed_llm_component_detection/circuits.txt')
+
+  def pack(
+      self,
+      images: list[CircuitImage | str],
+      int_sizes: list[int],
+      include_grid: bool
+  ) -> tuple[list[PackedRegion], list[PackedBin]]:
+    """
+    :return: (gridded region of every image, bins of images that share a canvas)
+    """
+    regions = []
+    for image, int_size in zip(images, int_sizes):
+      image = self._decode(image)
+      height, width = image.shape[:2]
+      with self._stage('grid_render'):
+        gridded = render_grid(image.array, int_size, include_grid)
+      regions.append(PackedRegion(gridded=gridded, width=width, height=height))
+    sizes = np.array([region_size(region, len(regions)) for region in regions])
+    return regions, shelf_pack(sizes, self.canvas_size, self.canvas_size, self.gap)
+
+  async def alabel_bin(
+      self,
+      regions: list[PackedRegion],
+      packed_bin: PackedBin,
+      bypass_cache: bool = False
+  ) -> list[CircuitComponents]:
+    """
+    :param regions: every packed region, see pack
+    :param packed_bin: bin of the regions to label together
+    :return: components of each circuit of the bin in packed_bin.indices order
+    """
+    canvas, circuits, cache_key, cached = await asyncio.to_thread(
+      self._prepare_canvas, regions, packed_bin, bypass_cache
+    )
+    packed = cached
+    if packed is None:
+      packed = self._store(cache_key, await self._ainvoke(self.build_messages(canvas, circuits)))
+    with self._stage('post_process', circuits=len(packed_bin.indices)):
+      return split_circuits(packed, len(packed_bin.indices))
+
+  def circuits_text(self, regions: list[PackedRegion]) -> str:
+    """
+    :param regions: regions on a canvas in the order of their numbers
+    :return: text listing the number and size of every circuit on the canvas
+    """
+    listed = [
+      {'circuit': number, 'width': region.width, 'height': region.height}
+      for number, region in enumerate(regions, start=1)
+    ]
+    return f"{self.circuits_prompt}\n```yaml\n{yaml.safe_dump({'circuits': listed}, sort_keys=False)}```"
+
+  def _prepare_canvas(
+      self,
+      regions: list[PackedRegion],
+      packed_bin: PackedBin,
+      bypass_cache: bool
+  ) -> tuple[EncodedImage, str, Optional[str], Optional[PackedCircuitComponents]]:
+    """
+    :return: (encoded canvas, circuit listing, cache key if the cache should be used, cached response on a hit)
+    """
+    with self._stage('grid_render', circuits=len(packed_bin.indices)):
+      canvas_array = render_canvas(regions, packed_bin)
+    canvas = self._encode(canvas_array)
+    circuits = self.circuits_text([regions[index] for index in packed_bin.indices])
+
+    if self.cache is None or bypass_cache:
+      return canvas, circuits, None, None
+    # the grid spacing of every circuit is drawn into the canvas
+    cache_key = DetectionCache.make_key(canvas.data, self.system_prompt, self.format_instructions, MODEL,
+                                        self.temperature, 0, circuits)
+    return canvas, circuits, cache_key, self._lookup(cache_key)
@@ -0,0 +1,198 @@
+import json
+import re
+from typing import Any, Generic, Optional, TypeVar
+
+import yaml
+from langchain_core.exceptions import OutputParserException
+from pydantic.v1 import BaseModel
+from pydantic.v1.fields import ModelField, SHAPE_LIST
+
+from photocircuit.component_detection.fast_output_parser import compile_validator, load_yaml, type_validator
+
+T = TypeVar('T', bound=BaseModel)
+
+# code fence opening a response, e.g. ```json
+OPENING_FENCE_PATTERN = re.compile(r"\s*```[a-z]*\n")
+
+
+def list_field(model: type[BaseModel]) -> ModelField:
+  """
+  :return: the one list field of model
+  """
+  list_fields = [field for field in model.__fields__.values() if field.shape == SHAPE_LIST]
+  if len(list_fields) != 1:
+    raise ValueError(f"{model.__name__} needs exactly one list field to stream, has {len(list_fields)}")
+  return list_fields[0]
+
+
+def list_items(parsed: BaseModel) -> list:
+  """
+  :return: items of the list field of an already parsed model, e.g. the components of CircuitComponents
+  """
+  return getattr(parsed, list_field(type(parsed)).name)
+
+
+class StreamingItemParser(Generic[T]):
+  """
+  Parses the items of the list field of a model, e.g. the components of CircuitComponents, out of an llm response while
+  it is still streaming in.
+
+  Feed the response chunk by chunk, every call returns the items completed by that chunk. A json item is complete when
+  its closing brace arrives, a yaml item when the next item or anything after the list starts. Each character is
+  scanned once, so feeding a whole response costs about as much as parsing it once.
+  """
+  def __init__(self, model: type[T]):
+    """
+    :param model: pydantic model with exactly one list field
+    """
+    self.model = model
+    self.field = list_field(model)
+    self.validate_item = type_validator(self.field.type_)
+    self.text = ''
+    # raw items parsed so far, validated again as a whole by result
+    self.raw_items: list[Any] = []
+    self.dropped = 0
+    self._format: Optional[str] = None
+    self._position = 0
+    self._finished = False
+    # json scanning state
+    self._depth = 0
+    self._in_string = False
+    self._escaped = False
+    self._item_start = 0
+    # yaml scanning state
+    self._item_indent: Optional[int] = None
+    self._block: list[str] = []
+
+  def feed(self, chunk: str) -> list:
+    """
+    :param chunk: next piece of the response
+    :return: items completed by chunk, in order
+    """
+    self.text += chunk
+    if self._finished:
+      return []
+    if self._format is None and not self._detect_format():
+      return []
+    return self._scan_json() if self._format == 'json' else self._scan_yaml(final=False)
+
+  def close(self) -> list:
+    """
+    Call once the response is complete
+
+    :return: items completed by the end of the response, e.g. the last yaml item
+    :raises OutputParserException: if the response did not contain the list at all
+    """
+    items = []
+    if self._format == 'yaml' and not self._finished:
+      items = self._scan_yaml(final=True)
+    if self._format == 'json':
+      found = self._position > 0
+    else:
+      found = self._item_indent is not None or f"{self.field.alias}:" in self.text
+    if not found:
+      raise OutputParserException(
+        f"Failed to parse {self.model.__name__} from completion {self.text}. Got: no {self.field.alias} found",
+        llm_output=self.text
+      )
+    return items
+
+  def result(self) -> T:
+    """
+    :return: model of every item parsed, the same as parsing the whole response
+    """
+    return compile_validator(self.model)({self.field.alias: self.raw_items})
+
+  def _detect_format(self) -> bool:
+    fence = OPENING_FENCE_PATTERN.match(self.text)
+    body_start = fence.end() if fence is not None else 0
+    body = self.text[body_start:].lstrip()
+    if not body or (fence is None and self.text.lstrip().startswith('`')):
+      return False
+    self._format = 'json' if body.startswith('{') else 'yaml'
+    return True
+
+  def _accept(self, raw: Any) -> list:
+    try:
+      item = self.validate_item(raw)
+    except (ValueError, TypeError):
+      self.dropped += 1
+      return []
+    self.raw_items.append(raw)
+    return [item]
+
+  def _scan_json(self) -> list:
+    items = []
+    if self._position == 0:
+      key = re.search(rf'"{re.escape(self.field.alias)}"\s*:\s*\[', self.text)
+      if key is None:
+        return items
+      self._position = key.end()
+
+    text = self.text
+    for i in range(self._position, len(text)):
+      char = text[i]
+      if self._in_string:
+        if self._escaped:
+          self._escaped = False
+        elif char == '\\':
+          self._escaped = True
+        elif char == '"':
+          self._in_string = False
+      elif char == '"':
+        self._in_string = True
+      elif char in '{[':
+        if self._depth == 0:
+          self._item_start = i
+        self._depth += 1
+      elif char in '}]':
+        if self._depth == 0:
+          # end of the list
+          self._finished = True
+          self._position = i + 1
+          return items
+        self._depth -= 1
+        if self._depth == 0:
+          try:
+            items.extend(self._accept(json.loads(text[self._item_start:i + 1])))
+          except ValueError:
+            self.dropped += 1
+    self._position = len(text)
+    return items
+
+  def _scan_yaml(self, final: bool) -> list:
+    items = []
+    end = len(self.text) if final else self.text.rfind('\n') + 1
+    lines = self.text[self._position:end].splitlines() if end > self._position else []
+    self._position = max(self._position, end)
+
+    for line in lines:
+      stripped = line.lstrip()
+      indent = len(line) - len(stripped)
+      if self._item_indent is None:
+        if stripped.startswith('- '):
+          self._item_indent = indent
+          self._block = [line]
+        continue
+      if stripped.startswith('```') or (stripped and indent <= self._item_indent and not stripped.startswith('- ')):
+        items.extend(self._flush_yaml())
+        self._finished = True
+        return items
+      if stripped.startswith('- ') and indent == self._item_indent:
+        items.extend(self._flush_yaml())
+      self._block.append(line)
+    if final:
+      items.extend(self._flush_yaml())
+    return items
+
+  def _flush_yaml(self) -> list:
+    block = "\n".join(line[self._item_indent:] for line in self._block)
+    self._block = []
+    if not block.strip():
+      return []
+    try:
+      parsed = load_yaml(block)
+    except yaml.YAMLError:
+      self.dropped += 1
+      return []
+    return self._accept(parsed[0]) if isinstance(parsed, list) and parsed else []
@@ -0,0 +1,284 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from photocircuit.component_detection.base_component_detection_service import BaseComponentDetectionService
+from photocircuit.component_detection.model import (
+  CircuitComponents, Component, ComponentName, ComponentPosition, SizedCircuitComponents, SizedComponent
+)
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.component_detection import ID_PREFIXES
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+
+TEMPLATES_DIR = os.path.dirname(os.path.abspath(__file__)) + "/templates"
+
+DEFAULT_SCALES = (0.7, 0.85, 1.0, 1.2)
+DEFAULT_THRESHOLD = 0.75
+# overlap is measured relative to the smaller box, a small template matching part of a bigger symbol is suppressed too
+DEFAULT_NMS_OVERLAP = 0.3
+# resolution matching runs at relative to the image, the blurred ink maps lose little detail at half size and
+# matching is ~16x cheaper
+DEFAULT_MATCH_SCALE = 0.5
+# best matches kept before non max suppression, bounds its pairwise overlap matrix
+MAX_CANDIDATES = 1024
+# pixels darker than this are ink, the light fill of the source templates is not
+INK_THRESHOLD = 128
+# blur of the ink maps, makes matching tolerant to line thickness and a pixel or two of misalignment
+INK_BLUR_SIGMA = 1.0
+
+# min ink under a match relative to the template's own ink, normalized correlation is meaningless over near blank areas
+MIN_INK_RATIO = 0.5
+
+# rows of lead wire kept above and below a symbol's body
+LEAD_MARGIN = 6
+
+# templates are drawn with the positive terminal at the top
+TEMPLATE_DIRECTION = 90
+# symbols that look the same rotated by 180 degrees, the direction of the others is only decided once they are found
+NON_POLAR = {ComponentName.RESISTOR, ComponentName.CAPACITOR, ComponentName.INDUCTOR}
+
+
+@dataclass(frozen=True)
+class TemplateVariant:
+  component_name: ComponentName
+  # direction of the positive terminal in degrees, 0: right, 90: top, 180: left, 270: bottom
+  direction: int
+  ink: np.ndarray
+  ink_mass: float
+  # ink rotated by 180 degrees for polar symbols, None for non polar ones
+  flipped_ink: np.ndarray | None
+
+
+@dataclass(frozen=True)
+class Detections:
+  """
+  Matches found in an image, one entry per detection
+  """
+  # (n, 4) x, y, w, h
+  boxes: np.ndarray
+  scores: np.ndarray
+  # index into TemplateComponentDetectionService.variants
+  variants: np.ndarray
+  # matched the variant rotated by 180 degrees
+  flipped: np.ndarray
+
+  def __len__(self):
+    return len(self.scores)
+
+
+def ink_map(gray: np.ndarray) -> np.ndarray:
+  """
+  :param gray: grayscale image, dark lines on a light background
+  :return: float32 map of where lines are, blurred
+  """
+  ink = (gray < INK_THRESHOLD).astype(np.float32)
+  return cv2.GaussianBlur(ink, (0, 0), INK_BLUR_SIGMA)
+
+
+def to_gray(image_arr: np.ndarray) -> np.ndarray:
+  if image_arr.ndim == 2:
+    return image_arr
+  if image_arr.shape[2] == 4:
+    return cv2.cvtColor(image_arr, cv2.COLOR_RGBA2GRAY)
+  return cv2.cvtColor(image_arr, cv2.COLOR_RGB2GRAY)
+
+
+def load_template(path: str) -> np.ndarray:
+  """
+  :return: grayscale template with any transparency composited over white
+  """
+  template = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+  if template.ndim == 3 and template.shape[2] == 4:
+    alpha = template[:, :, 3:].astype(np.float32) / 255
+    template = (template[:, :, :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+  if template.ndim == 3:
+    template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+  return template
+
+
+def trim_leads(template: np.ndarray) -> np.ndarray:
+  """
+  :param template: grayscale template with its leads running vertically through the center
+  :return: template without the lead wires above and below the symbol, which would otherwise match any wire
+  """
+  ink = template < INK_THRESHOLD
+  h, w = ink.shape
+  off_center = np.abs(np.arange(w) - w // 2) > 3
+  body_rows = np.flatnonzero((ink & off_center[None, :]).any(axis=1))
+  if len(body_rows) == 0:
+    return template
+  return template[max(body_rows[0] - LEAD_MARGIN, 0):body_rows[-1] + LEAD_MARGIN + 1]
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, max_overlap: float) -> np.ndarray:
+  """
+  :param boxes: (n, 4) x, y, w, h
+  :param scores: (n,)
+  :param max_overlap: boxes overlapping a higher scoring kept box by more than this fraction of the smaller of the
+                      two are dropped
+  :return: indices of kept boxes, highest score first
+  """
+  boxes = boxes.astype(np.float32)
+  x1, y1 = boxes[:, 0], boxes[:, 1]
+  x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+  areas = boxes[:, 2] * boxes[:, 3]
+  # overlap of every pair at once, the greedy pass below only indexes into it
+  iw = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+  ih = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+  intersection = iw * ih
+  overlap = intersection / np.minimum(areas[:, None], areas[None, :])
+
+  order = np.argsort(-scores, kind='stable')
+  suppressed = np.zeros(len(scores), dtype=bool)
+  keep = []
+  for i in order:
+    if suppressed[i]:
+      continue
+    keep.append(i)
+    suppressed |= overlap[i] > max_overlap
+  return np.array(keep, dtype=np.intp)
+
+
+class TemplateComponentDetectionService(BaseComponentDetectionService):
+  """
+  Finds components by matching the symbol templates against the image at several scales and rotations, keeping the
+  best non overlapping matches.
+
+  Much faster than the llm services and good enough for clean textbook circuits, or as a pre-pass whose candidates
+  are given to the llm as hints.
+  """
+  def __init__(
+      self,
+      templates_dir: str = TEMPLATES_DIR,
+      scales: tuple[float, ...] = DEFAULT_SCALES,
+      threshold: float = DEFAULT_THRESHOLD,
+      nms_overlap: float = DEFAULT_NMS_OVERLAP,
+      match_scale: float = DEFAULT_MATCH_SCALE
+  ):
+    """
+    :param templates_dir: directory of <component name>.png templates, positive terminal at the top
+    :param scales: template sizes tried, relative to the size of the template files
+    :param threshold: min normalized correlation of a match
+    :param nms_overlap: max overlap of two kept matches, as a fraction of the smaller one
+    :param match_scale: resolution matching runs at relative to the image
+    """
+    self.threshold = threshold
+    self.nms_overlap = nms_overlap
+    self.match_scale = match_scale
+    self.variants: list[TemplateVariant] = []
+    for filename in sorted(os.listdir(templates_dir)):
+      if not filename.endswith('.png'):
+        continue
+      component_name = ComponentName(filename[:-len('.png')].replace('_', ' '))
+      template = trim_leads(load_template(os.path.join(templates_dir, filename)))
+      for scale in scales:
+        scaled = cv2.resize(template, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ink = self._downscale(ink_map(scaled))
+        # a symbol and its 180 degree rotation have (nearly) the same outline, only 0 and 90 degrees are searched for
+        for k in (0, 1):
+          self.variants.append(TemplateVariant(
+            component_name=component_name,
+            direction=(TEMPLATE_DIRECTION + 90 * k) % 360,
+            # np.rot90 rotates counterclockwise, so the top terminal moves 90 degrees further round with each k
+            ink=np.ascontiguousarray(np.rot90(ink, k)),
+            ink_mass=float(ink.sum()),
+            flipped_ink=None if component_name in NON_POLAR else np.ascontiguousarray(np.rot90(ink, k + 2))
+          ))
+
+  def detect(self, image: CircuitImage | str) -> Detections:
+    """
+    :param image: image of circuit
+    :return: non overlapping matches, highest score first
+    """
+    ink = self._downscale(ink_map(to_gray(CircuitImage.of(image).array)))
+    # ink under every template sized window, from one summed area table shared by all template sizes
+    summed = cv2.integral(ink, sdepth=cv2.CV_64F)
+    boxes, scores, variants = [], [], []
+    for i, variant in enumerate(self.variants):
+      th, tw = variant.ink.shape
+      if th > ink.shape[0] or tw > ink.shape[1]:
+        continue
+      response = cv2.matchTemplate(ink, variant.ink, cv2.TM_CCOEFF_NORMED)
+      window_ink = summed[th:, tw:] - summed[:-th, tw:] - summed[th:, :-tw] + summed[:-th, :-tw]
+      response[window_ink < MIN_INK_RATIO * variant.ink_mass] = 0
+      # local maxima within half a template only, a match is surrounded by slightly worse matches a few pixels off
+      neighbourhood = np.ones((max(th // 2, 1), max(tw // 2, 1)), np.uint8)
+      peaks = (response >= self.threshold) & (response == cv2.dilate(response, neighbourhood))
+      ys, xs = np.nonzero(peaks)
+      boxes.append(np.stack([xs, ys, np.full_like(xs, tw), np.full_like(xs, th)], axis=1))
+      scores.append(response[ys, xs])
+      variants.append(np.full(len(xs), i))
+
+    if not boxes:
+      return Detections(
+        np.empty((0, 4), dtype=np.intp), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.intp), np.empty(0, bool)
+      )
+    boxes, scores, variants = np.concatenate(boxes), np.concatenate(scores), np.concatenate(variants)
+    if len(scores) > MAX_CANDIDATES:
+      best = np.argpartition(-scores, MAX_CANDIDATES)[:MAX_CANDIDATES]
+      boxes, scores, variants = boxes[best], scores[best], variants[best]
+    keep = non_max_suppression(boxes, scores, self.nms_overlap)
+    boxes, scores, variants = boxes[keep], scores[keep], variants[keep]
+    flipped = np.array([self._is_flipped(ink, box, self.variants[v]) for box, v in zip(boxes, variants)], dtype=bool)
+    # back to image coordinates
+    boxes = np.round(boxes / self.match_scale).astype(np.intp)
+    return Detections(boxes, scores, variants, flipped.reshape(-1))
+
+  @staticmethod
+  def _is_flipped(ink: np.ndarray, box: np.ndarray, variant: TemplateVariant) -> bool:
+    """
+    :return: whether the match is better explained by the variant rotated by 180 degrees
+    """
+    if variant.flipped_ink is None:
+      return False
+    x, y, w, h = box
+    window = ink[y:y + h, x:x + w]
+    return cv2.matchTemplate(window, variant.flipped_ink, cv2.TM_CCOEFF_NORMED)[0, 0] > \
+      cv2.matchTemplate(window, variant.ink, cv2.TM_CCOEFF_NORMED)[0, 0]
+
+  def _downscale(self, ink: np.ndarray) -> np.ndarray:
+    if self.match_scale == 1:
+      return ink
+    return cv2.resize(ink, (0, 0), fx=self.match_scale, fy=self.match_scale, interpolation=cv2.INTER_AREA)
+
+  def label_components(self, base64_image: CircuitImage | str) -> CircuitComponents:
+    """
+    :param base64_image: image of circuit
+    :return: components found in the image
+    """
+    return CircuitComponents(components=[
+      Component(**fields) for fields in self._component_fields(self.detect(base64_image))
+    ])
+
+  def candidates(self, base64_image: CircuitImage | str) -> SizedCircuitComponents:
+    """
+    :param base64_image: image of circuit
+    :return: components found in the image with the size of the matched template, e.g. as hints for an llm service
+    """
+    detections = self.detect(base64_image)
+    return SizedCircuitComponents(sized_components=[
+      SizedComponent(**fields, approximate_size=int(max(w, h)))
+      for fields, (_, _, w, h) in zip(self._component_fields(detections), detections.boxes)
+    ])
+
+  def _component_fields(self, detections: Detections) -> list[dict]:
+    counts = {}
+    fields = []
+    # read left to right, top to bottom like the llm services number components
+    order = np.lexsort((detections.boxes[:, 0], detections.boxes[:, 1]))
+    for (x, y, w, h), variant_index, flipped in zip(
+        detections.boxes[order], detections.variants[order], detections.flipped[order]
+    ):
+      variant = self.variants[variant_index]
+      direction = (variant.direction + 180) % 360 if flipped else variant.direction
+      counts[variant.component_name] = counts.get(variant.component_name, 0) + 1
+      fields.append(dict(
+        position=ComponentPosition(x=int(x + w // 2), y=int(y + h // 2)),
+        component_name=variant.component_name,
+        positive_input_direction=direction,
+        id=f"{ID_PREFIXES[variant.component_name]}{counts[variant.component_name]}"
+      ))
+    return fields
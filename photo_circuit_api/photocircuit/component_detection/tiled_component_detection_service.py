@@ -0,0 +1,171 @@
+import asyncio
+import math
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.component_detection.base_component_detection_service import BaseComponentDetectionService
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentPosition
+from photocircuit.utils.async_utils import DEFAULT_CONCURRENCY
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.component_detection import renumber_components
+from photocircuit.utils.instrumentation import stage
+
+DEFAULT_TILE_SIZE = 750
+DEFAULT_OVERLAP = 150
+
+# (x, y, w, h) of a tile in the full image
+type Tile = tuple[int, int, int, int]
+
+
+def tile_starts(length: int, tile_size: int, overlap: int) -> np.ndarray:
+  """
+  :return: start of every tile along one axis, evenly spread so the last tile ends at length and neighbouring tiles
+           overlap by at least overlap pixels
+  """
+  if length <= tile_size:
+    return np.zeros(1, dtype=np.intp)
+  count = math.ceil((length - overlap) / (tile_size - overlap))
+  return np.round(np.linspace(0, length - tile_size, count)).astype(np.intp)
+
+
+def tile_grid(height: int, width: int, tile_size: int, overlap: int) -> list[Tile]:
+  """
+  :return: overlapping tiles covering an image, row by row
+  """
+  ys, xs = tile_starts(height, tile_size, overlap), tile_starts(width, tile_size, overlap)
+  return [
+    (int(x), int(y), min(tile_size, width), min(tile_size, height))
+    for y in ys
+    for x in xs
+  ]
+
+
+def merge_tile_components(
+    tile_components: list[CircuitComponents],
+    tiles: list[Tile],
+    height: int,
+    width: int,
+    edge_margin: float,
+    merge_radius: float
+) -> list[Component]:
+  """
+  Maps components found in each tile into the full image and merges the ones found by more than one tile.
+
+  :param tile_components: components of each tile, in tile coordinates
+  :param tiles: tile each list of components was found in
+  :param height: height of the full image
+  :param width: width of the full image
+  :param edge_margin: components closer than this to a tile edge inside the image are cut off by it, they are left to
+                      the neighbouring tile that sees them whole
+  :param merge_radius: components of the same type from different tiles closer than this are the same component
+  :return: components in full image coordinates
+  """
+  components = [comp for circuit_comps in tile_components for comp in circuit_comps.components]
+  if not components:
+    return []
+  tile_index = np.repeat(np.arange(len(tiles)), [len(circuit_comps.components) for circuit_comps in tile_components])
+  tile_arr = np.array(tiles, dtype=np.float64)[tile_index]
+  local = np.array([(comp.position.x, comp.position.y) for comp in components], dtype=np.float64)
+  positions = local + tile_arr[:, :2]
+  names = np.array([comp.component_name.value for comp in components])
+
+  # distance to each tile edge, edges on the border of the full image cut nothing off
+  x, y, w, h = tile_arr.T
+  edge_distances = np.stack([local[:, 0], local[:, 1], w - local[:, 0], h - local[:, 1]], axis=1)
+  interior_edges = np.stack([x > 0, y > 0, x + w < width, y + h < height], axis=1)
+  keep = ~np.any(interior_edges & (edge_distances < edge_margin), axis=1)
+  components = [comp for comp, kept in zip(components, keep) if kept]
+  positions, names, tile_index = positions[keep], names[keep], tile_index[keep]
+
+  # group duplicates, connected components of the "same type, other tile, close by" graph by label propagation
+  distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=2)
+  same = (names[:, None] == names[None, :]) & (tile_index[:, None] != tile_index[None, :]) & (distances < merge_radius)
+  np.fill_diagonal(same, True)
+  labels = np.arange(len(components))
+  while True:
+    propagated = np.where(same, labels[None, :], len(components)).min(axis=1)
+    if np.array_equal(propagated, labels):
+      break
+    labels = propagated
+
+  merged = []
+  for label in np.unique(labels):
+    members = np.flatnonzero(labels == label)
+    x, y = np.round(positions[members].mean(axis=0)).astype(int)
+    merged.append(components[members[0]].copy(update={'position': ComponentPosition(x=int(x), y=int(y))}))
+  return merged
+
+
+class TiledComponentDetectionService(BaseComponentDetectionService):
+  """
+  Detects components of large schematics by splitting the image into overlapping tiles, labelling every tile
+  concurrently and merging the results back into one set of components.
+
+  Each request sees a tile at full resolution instead of the whole schematic scaled down, and has fewer components to
+  find. Use with images preprocessed to more than the tile size, e.g. ScalingPreprocessingService(fixed_size=1500).
+  """
+  def __init__(
+      self,
+      detection_service: Optional[LlmComponentDetectionService] = None,
+      tile_size: int = DEFAULT_TILE_SIZE,
+      overlap: int = DEFAULT_OVERLAP,
+      concurrency: int = DEFAULT_CONCURRENCY
+  ):
+    """
+    :param detection_service: labels each tile, defaults to LlmComponentDetectionService()
+    :param tile_size: max side length of a tile in pixels
+    :param overlap: min overlap of neighbouring tiles, should be at least twice the size of a component
+    :param concurrency: max number of tiles labelled at once
+    """
+    self.detection_service = detection_service or LlmComponentDetectionService()
+    self.tile_size = tile_size
+    self.overlap = overlap
+    self.concurrency = concurrency
+
+  def label_components(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      bypass_cache: bool = False
+  ) -> CircuitComponents:
+    """
+    :param base64_image: image of circuit
+    :param int_size: spacing of grid drawn over each tile in pixels
+    :param include_grid: draw gridlines over the tiles, otherwise only coordinate labels are drawn
+    :param bypass_cache: always call the llm
+    :return: components found in the image
+    """
+    return asyncio.run(self.alabel_components(base64_image, int_size, include_grid, bypass_cache))
+
+  async def alabel_components(
+      self,
+      base64_image: CircuitImage | str,
+      int_size: int,
+      include_grid: bool = True,
+      bypass_cache: bool = False
+  ) -> CircuitComponents:
+    """
+    async version of label_components, raises the error of the first tile that failed
+    """
+    image = CircuitImage.of(base64_image)
+    height, width = image.shape[:2]
+    tiles = tile_grid(height, width, self.tile_size, self.overlap)
+    if len(tiles) == 1:
+      return await self.detection_service.alabel_components(image, int_size, include_grid, bypass_cache)
+
+    tile_images = [CircuitImage.from_array(image.array[y:y + h, x:x + w].copy()) for x, y, w, h in tiles]
+    tile_components = await self.detection_service.alabel_components_many(
+      tile_images, int_size, include_grid, bypass_cache, self.concurrency
+    )
+    for result in tile_components:
+      if isinstance(result, BaseException):
+        raise result
+
+    with stage('post_process', service=type(self).__name__, tiles=len(tiles)):
+      components = merge_tile_components(
+        tile_components, tiles, height, width, edge_margin=self.overlap / 4, merge_radius=self.overlap / 4
+      )
+      return CircuitComponents(components=renumber_components(components))
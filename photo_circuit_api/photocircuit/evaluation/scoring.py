@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from typing import Iterable
+
+import numpy as np
+
+from photocircuit.component_detection.model import CircuitComponents, Component
+
+DEFAULT_THRESHOLDS = (10, 25, 50, 100)
+
+
+def linear_sum_assignment(cost: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """
+  Optimal one-to-one assignment minimizing total cost (Hungarian algorithm, shortest augmenting path form), with the
+  inner loop over columns vectorized.
+
+  :param cost: (n, m) cost matrix
+  :return: (row indices, column indices) of the min(n, m) assigned pairs, sorted by row
+  """
+  cost = np.asarray(cost, dtype=np.float64)
+  transposed = cost.shape[0] > cost.shape[1]
+  if transposed:
+    cost = cost.T
+  n, m = cost.shape
+  if n == 0:
+    return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+  # 1-based, column 0 is a virtual column holding the row being inserted
+  u = np.zeros(n + 1)
+  v = np.zeros(m + 1)
+  row_of_col = np.zeros(m + 1, dtype=np.intp)
+  way = np.zeros(m + 1, dtype=np.intp)
+  for i in range(1, n + 1):
+    row_of_col[0] = i
+    col = 0
+    min_slack = np.full(m + 1, np.inf)
+    used = np.zeros(m + 1, dtype=bool)
+    while True:
+      used[col] = True
+      row = row_of_col[col]
+      free = ~used
+      free[0] = False
+      slack = cost[row - 1] - u[row] - v[1:]
+      improved = free[1:] & (slack < min_slack[1:])
+      min_slack[1:][improved] = slack[improved]
+      way[1:][improved] = col
+
+      candidates = np.where(free, min_slack, np.inf)
+      next_col = int(np.argmin(candidates))
+      delta = candidates[next_col]
+      u[row_of_col[used]] += delta
+      v[used] -= delta
+      min_slack[free] -= delta
+
+      col = next_col
+      if row_of_col[col] == 0:
+        break
+    # augment along the alternating path
+    while col:
+      prev_col = way[col]
+      row_of_col[col] = row_of_col[prev_col]
+      col = prev_col
+
+  cols = np.flatnonzero(row_of_col[1:])
+  rows = row_of_col[1:][cols] - 1
+  if transposed:
+    rows, cols = cols, rows
+  order = np.argsort(rows)
+  return rows[order], cols[order]
+
+
+@dataclass(frozen=True)
+class DetectionScores:
+  """
+  Scores of one or more (ground truth, prediction) pairs at several distance thresholds. A predicted component is a
+  true positive at a threshold if it is matched one-to-one to a ground truth component of the same class and is within
+  the threshold of it.
+
+  Per pair arrays have one row per scored pair and one column per threshold, the properties aggregate over all pairs.
+  """
+  thresholds: np.ndarray
+  # (pairs, thresholds)
+  true_positives: np.ndarray
+  # (pairs, thresholds) sum of distances of the true positives
+  error_sums: np.ndarray
+  # (pairs,)
+  num_predicted: np.ndarray
+  # (pairs,)
+  num_ground_truth: np.ndarray
+
+  @property
+  def precision(self) -> np.ndarray:
+    return self.true_positives.sum(axis=0) / max(self.num_predicted.sum(), 1)
+
+  @property
+  def recall(self) -> np.ndarray:
+    return self.true_positives.sum(axis=0) / max(self.num_ground_truth.sum(), 1)
+
+  @property
+  def mean_error(self) -> np.ndarray:
+    """
+    :return: mean distance of true positives at each threshold, nan where there are none
+    """
+    true_positives = self.true_positives.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.where(true_positives > 0, self.error_sums.sum(axis=0) / true_positives, np.nan)
+
+  def summary(self) -> str:
+    lines = [f"{'threshold (px)':>15} {'precision':>10} {'recall':>10} {'mean error (px)':>16}"]
+    for threshold, precision, recall, error in zip(self.thresholds, self.precision, self.recall, self.mean_error):
+      lines.append(f"{threshold:>15g} {precision:>10.3f} {recall:>10.3f} {error:>16.2f}")
+    return "\n".join(lines)
+
+
+def _positions_by_class(components: list[Component]) -> dict:
+  positions = {}
+  for comp in components:
+    positions.setdefault(comp.component_name, []).append((comp.position.x, comp.position.y))
+  return {name: np.array(pos, dtype=np.float64) for name, pos in positions.items()}
+
+
+def matched_distances(ground_truth: CircuitComponents, predicted: CircuitComponents) -> np.ndarray:
+  """
+  :return: distances of every optimally matched (ground truth, prediction) pair of the same class
+  """
+  truth_by_class = _positions_by_class(ground_truth.components)
+  predicted_by_class = _positions_by_class(predicted.components)
+  distances = []
+  for name, truth in truth_by_class.items():
+    pred = predicted_by_class.get(name)
+    if pred is None:
+      continue
+    dist = np.linalg.norm(truth[:, None, :] - pred[None, :, :], axis=2)
+    rows, cols = linear_sum_assignment(dist)
+    distances.append(dist[rows, cols])
+  return np.concatenate(distances) if distances else np.empty(0)
+
+
+def score_detections(
+    pairs: Iterable[tuple[CircuitComponents, CircuitComponents]],
+    thresholds: Iterable[float] = DEFAULT_THRESHOLDS
+) -> DetectionScores:
+  """
+  Scores many detections at once
+
+  :param pairs: (ground truth, predicted) components of each image
+  :param thresholds: max distance in pixels for a match to count as a true positive
+  """
+  thresholds = np.asarray(tuple(thresholds), dtype=np.float64)
+  all_distances, pair_index, num_predicted, num_ground_truth = [], [], [], []
+  for i, (ground_truth, predicted) in enumerate(pairs):
+    distances = matched_distances(ground_truth, predicted)
+    all_distances.append(distances)
+    pair_index.append(np.full(len(distances), i))
+    num_predicted.append(len(predicted.components))
+    num_ground_truth.append(len(ground_truth.components))
+
+  num_pairs = len(num_predicted)
+  distances = np.concatenate(all_distances) if all_distances else np.empty(0)
+  pair_index = np.concatenate(pair_index) if pair_index else np.empty(0, dtype=np.intp)
+  # every matched distance against every threshold at once, then summed per pair
+  within = distances[:, None] <= thresholds[None, :]
+  true_positives = np.zeros((num_pairs, len(thresholds)), dtype=np.int64)
+  error_sums = np.zeros((num_pairs, len(thresholds)))
+  np.add.at(true_positives, pair_index, within)
+  np.add.at(error_sums, pair_index, within * distances[:, None])
+  return DetectionScores(
+    thresholds=thresholds,
+    true_positives=true_positives,
+    error_sums=error_sums,
+    num_predicted=np.array(num_predicted, dtype=np.int64),
+    num_ground_truth=np.array(num_ground_truth, dtype=np.int64)
+  )
+
+
+def score_detection(
+    ground_truth: CircuitComponents,
+    predicted: CircuitComponents,
+    thresholds: Iterable[float] = DEFAULT_THRESHOLDS
+) -> DetectionScores:
+  return score_detections([(ground_truth, predicted)], thresholds)
@@ -0,0 +1,205 @@
+import csv
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, fields
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from photocircuit.utils.async_utils import DEFAULT_CONCURRENCY
+
+# metrics of one cell, e.g. {"avg_error": 12.5, "recall": 0.8}
+type CellMetrics = dict[str, float]
+
+
+@dataclass(frozen=True)
+class SweepCell:
+  """
+  One point of a sweep grid, None for a parameter that is not swept
+  """
+  circuit_id: str
+  screen_size: Optional[int] = None
+  step_size: Optional[int] = None
+  include_grid: Optional[bool] = None
+  temperature: Optional[float] = None
+  repeat: int = 0
+
+  def key(self) -> str:
+    return json.dumps(asdict(self), sort_keys=True)
+
+
+PARAMETERS = tuple(field.name for field in fields(SweepCell))
+
+
+def sweep_grid(circuit_ids: Iterable[str], repeats: int = 1, **axes: Iterable) -> list[SweepCell]:
+  """
+  :param circuit_ids: circuits to run every combination of parameters on
+  :param repeats: number of times each combination is run
+  :param axes: values of each swept SweepCell parameter, e.g. screen_size=[500, 600]
+  :return: cartesian product of the parameters
+  """
+  unknown = set(axes) - set(PARAMETERS)
+  if unknown:
+    raise ValueError(f"unknown sweep parameters: {sorted(unknown)}")
+  names = list(axes)
+  cells = []
+  for circuit_id in circuit_ids:
+    for values in itertools.product(*(list(axes[name]) for name in names)):
+      params = {name: _to_builtin(value) for name, value in zip(names, values)}
+      cells.extend(SweepCell(circuit_id=circuit_id, repeat=repeat, **params) for repeat in range(repeats))
+  return cells
+
+
+class SweepRunner:
+  """
+  Runs a function over every cell of a sweep in a thread pool, appending each result to a JSONL checkpoint as soon as
+  it finishes. Cells already in the checkpoint are skipped, so a sweep that crashed or was stopped picks up where it
+  left off when run again with the same checkpoint. Cells that raised are recorded with their error and retried on the
+  next run.
+  """
+  def __init__(self, checkpoint_path: str, max_workers: int = DEFAULT_CONCURRENCY):
+    """
+    :param checkpoint_path: JSONL file results are appended to
+    :param max_workers: max number of cells running at once
+    """
+    self.checkpoint_path = checkpoint_path
+    self.max_workers = max_workers
+    self._lock = threading.Lock()
+
+  def completed(self) -> dict[str, dict]:
+    """
+    :return: cell key -> record of every cell that finished successfully
+    """
+    records = {}
+    if not os.path.isfile(self.checkpoint_path):
+      return records
+    with open(self.checkpoint_path) as f:
+      for line in f:
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          # last line of a run that was killed mid write
+          continue
+        if record.get('status') == 'ok':
+          records[SweepCell(**record['cell']).key()] = record
+    return records
+
+  def run(self, cells: Iterable[SweepCell], evaluate: Callable[[SweepCell], CellMetrics]) -> list[dict]:
+    """
+    :param cells: cells of the sweep
+    :param evaluate: computes the metrics of a cell, called from worker threads
+    :return: records of every cell of the sweep that has succeeded, from this run or an earlier one
+    """
+    cells = list(cells)
+    self._drop_partial_line()
+    done = self.completed()
+    pending = [cell for cell in cells if cell.key() not in done]
+    print(f"sweep: {len(cells) - len(pending)}/{len(cells)} cells already done, running {len(pending)}")
+
+    with ThreadPoolExecutor(self.max_workers) as pool:
+      futures = {pool.submit(self._run_cell, cell, evaluate): cell for cell in pending}
+      for i, future in enumerate(as_completed(futures), start=1):
+        record = future.result()
+        if record['status'] == 'ok':
+          done[futures[future].key()] = record
+        else:
+          print(f"sweep: {futures[future]} failed: {record['error']}")
+        if i % 10 == 0 or i == len(futures):
+          print(f"sweep: {i}/{len(futures)} cells finished")
+
+    return [done[cell.key()] for cell in cells if cell.key() in done]
+
+  def _run_cell(self, cell: SweepCell, evaluate: Callable[[SweepCell], CellMetrics]) -> dict:
+    start = time.perf_counter()
+    try:
+      metrics = {name: _to_builtin(value) for name, value in evaluate(cell).items()}
+      record = {'cell': asdict(cell), 'status': 'ok', 'metrics': metrics}
+    except Exception as e:
+      record = {'cell': asdict(cell), 'status': 'error', 'error': repr(e)}
+    record['seconds'] = time.perf_counter() - start
+    self._append(record)
+    return record
+
+  def _drop_partial_line(self):
+    """
+    Truncates the unterminated last line left by a run killed mid write, records appended after it would end up on
+    the same line and could never be read back
+    """
+    if not os.path.isfile(self.checkpoint_path):
+      return
+    with open(self.checkpoint_path, 'rb+') as f:
+      end = f.seek(0, os.SEEK_END)
+      pos = end
+      while pos > 0:
+        start = max(0, pos - 4096)
+        f.seek(start)
+        newline = f.read(pos - start).rfind(b'\n')
+        if newline != -1:
+          pos = start + newline + 1
+          break
+        pos = start
+      if pos != end:
+        f.truncate(pos)
+
+  def _append(self, record: dict):
+    line = json.dumps(record) + "\n"
+    with self._lock:
+      with open(self.checkpoint_path, 'a') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def aggregate(records: Iterable[dict], by: Iterable[str], metric: str) -> list[dict]:
+  """
+  Summarizes a metric over the repeats / circuits that are not in by.
+
+  :param records: records returned by SweepRunner.run
+  :param by: cell parameters to group by
+  :param metric: name of the metric to summarize
+  :return: one row per group, sorted by the group parameters, with the mean, std, min, max of the finite values of
+           the metric, how many there were and how many were not finite (e.g. a missing component scored as inf)
+  """
+  by = tuple(by)
+  groups: dict[tuple, list[float]] = {}
+  for record in records:
+    group = tuple(record['cell'][name] for name in by)
+    groups.setdefault(group, []).append(record['metrics'][metric])
+
+  rows = []
+  for group in sorted(groups, key=lambda g: tuple((v is None, v) for v in g)):
+    values = np.array(groups[group], dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    row = dict(zip(by, group))
+    row.update({
+      f'{metric}_mean': float(finite.mean()) if len(finite) else math.nan,
+      f'{metric}_std': float(finite.std()) if len(finite) else math.nan,
+      f'{metric}_min': float(finite.min()) if len(finite) else math.nan,
+      f'{metric}_max': float(finite.max()) if len(finite) else math.nan,
+      'count': len(finite),
+      'non_finite': len(values) - len(finite),
+    })
+    rows.append(row)
+  return rows
+
+
+def write_table(rows: list[dict], file_path: str):
+  """
+  writes rows with the same keys to a csv file, replacing it
+  """
+  with open(file_path, 'w', newline='') as f:
+    if not rows:
+      return
+    writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def _to_builtin(value):
+  # numpy scalars from np.arange etc. are not json serializable
+  return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable, Optional
+
+from photocircuit.jobs.job_store import JobStore
+from photocircuit.jobs.model import JobItem, JobProgress, JobResult
+from photocircuit.photocircuit import PhotoCircuit
+from photocircuit.utils.async_utils import DEFAULT_CONCURRENCY
+
+DEFAULT_MAX_ATTEMPTS = 3
+# seconds an idle worker or a poller waits before checking the store again, in case another process changed it
+DEFAULT_POLL_INTERVAL = 1.0
+# results read from the store at once by a result stream
+RESULTS_PAGE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class JobService:
+  """
+  Runs batches of circuit photos through PhotoCircuit in the background: a batch is submitted as a job that is
+  persisted in a JobStore, a pool of workers detects its images, and its progress and results can be polled or streamed
+  while it runs.
+
+  Jobs survive restarts, items that were running when the process stopped are run again once the service starts.
+  Throughput is bounded by the number of workers, each running one detection at a time, and by the llm rate limits.
+  """
+  def __init__(
+      self,
+      photo_circuit: PhotoCircuit,
+      store: JobStore,
+      workers: int = DEFAULT_CONCURRENCY,
+      max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+      poll_interval: float = DEFAULT_POLL_INTERVAL
+  ):
+    """
+    :param photo_circuit: detects the components of every image
+    :param store: persists jobs, their queue of images and their results
+    :param workers: number of images detected at once
+    :param max_attempts: an image that raised is run up to this many times before it is recorded as failed
+    :param poll_interval: seconds between checks of the store by idle workers and result streams
+    """
+    self.photo_circuit = photo_circuit
+    self.store = store
+    self.workers = workers
+    self.max_attempts = max_attempts
+    self.poll_interval = poll_interval
+    self._tasks: list[asyncio.Task] = []
+    # replaced every time the store changes, waited on by idle workers and result streams
+    self._changed: Optional[asyncio.Event] = None
+
+  async def start(self):
+    """
+    Requeues the images a stopped process left running and starts the workers
+    """
+    if self._tasks:
+      return
+    self._changed = asyncio.Event()
+    await asyncio.to_thread(self.store.requeue_running)
+    self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+  async def stop(self):
+    """
+    Cancels the workers, the images they were running are run again on the next start
+    """
+    for task in self._tasks:
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._tasks = []
+
+  async def submit(self, images: Iterable[tuple[str, bytes]]) -> str:
+    """
+    :param images: (name, encoded image file) of every image of the batch, e.g. ('circuit_page_3_circuit_1', png)
+    :return: id of the job
+    """
+    job_id = await asyncio.to_thread(self.store.create_job, images)
+    self._notify()
+    return job_id
+
+  async def progress(self, job_id: str) -> Optional[JobProgress]:
+    """
+    :return: counts of the images of the job by status, None for an unknown job
+    """
+    return await asyncio.to_thread(self.store.progress, job_id)
+
+  async def stream_results(self, job_id: str, after: int = 0) -> AsyncIterator[JobResult]:
+    """
+    Yields the results of the job as its images finish, until every image has finished
+
+    :param after: sequence of the last result already seen, to resume an interrupted stream
+    """
+    while True:
+      changed = self._changed
+      # read before the results: an image's result is stored with its status, so a finished job has none left to read
+      progress = await self.progress(job_id)
+      if progress is None:
+        return
+      results = await asyncio.to_thread(self.store.results, job_id, after, RESULTS_PAGE)
+      for result in results:
+        yield result
+        after = result.sequence
+      if len(results) == RESULTS_PAGE:
+        continue
+      if progress.finished:
+        return
+      await self._wait(changed)
+
+  async def _work(self):
+    while True:
+      changed = self._changed
+      try:
+        items = await asyncio.to_thread(self.store.claim)
+        if not items:
+          await self._wait(changed)
+          continue
+        await self._run(items[0])
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        # e.g. a locked database or a full disk, the worker keeps running so the pool never shrinks. An item whose
+        # result could not be stored stays running until the next start requeues it
+        logger.exception("job worker failed to access the store, retrying in %ss", self.poll_interval)
+        await asyncio.sleep(self.poll_interval)
+
+  async def _run(self, item: JobItem):
+    try:
+      components = await self.photo_circuit.adetect(item.image)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      await asyncio.to_thread(self.store.fail, item, repr(e), item.attempts < self.max_attempts)
+    else:
+      await asyncio.to_thread(self.store.complete, item, components.json())
+    self._notify()
+
+  def _notify(self):
+    if self._changed is not None:
+      self._changed.set()
+      self._changed = asyncio.Event()
+
+  async def _wait(self, changed: Optional[asyncio.Event]):
+    if changed is None:
+      await asyncio.sleep(self.poll_interval)
+      return
+    try:
+      await asyncio.wait_for(changed.wait(), self.poll_interval)
+    except TimeoutError:
+      pass
@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
+
+from photocircuit.jobs.model import JobItem, JobProgress, JobResult, PENDING, RUNNING, DONE, FAILED
+
+DEFAULT_JOBS_PATH = os.path.expanduser('~/.cache/photocircuit/jobs.sqlite')
+
+
+class JobStore:
+  """
+  Persistent queue of batch detection jobs in a sqlite database.
+
+  Every image of a job is a queue item that is pending, running, done or failed. Workers claim pending items oldest
+  first, and each finished item is appended to a results log whose sequence numbers let pollers continue where they
+  left off. The image of an item is dropped once it finishes, so the database only holds images still to be done.
+  A store is used by one process at a time: items left running by a process that stopped are requeued by
+  requeue_running.
+  """
+  def __init__(self, path: str = DEFAULT_JOBS_PATH):
+    self.path = path
+    self._lock = threading.Lock()
+
+    if path != ':memory:':
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    with self._conn:
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        ' id TEXT PRIMARY KEY,'
+        ' created_at REAL NOT NULL,'
+        ' total INTEGER NOT NULL'
+        ')'
+      )
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS items ('
+        ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' job_id TEXT NOT NULL REFERENCES jobs (id),'
+        ' position INTEGER NOT NULL,'
+        ' name TEXT NOT NULL,'
+        ' image BLOB,'
+        ' status TEXT NOT NULL,'
+        ' attempts INTEGER NOT NULL DEFAULT 0,'
+        ' UNIQUE (job_id, position)'
+        ')'
+      )
+      self._conn.execute('CREATE INDEX IF NOT EXISTS items_status ON items (status, seq)')
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS results ('
+        ' sequence INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' job_id TEXT NOT NULL REFERENCES jobs (id),'
+        ' position INTEGER NOT NULL,'
+        ' name TEXT NOT NULL,'
+        ' status TEXT NOT NULL,'
+        ' components TEXT,'
+        ' error TEXT'
+        ')'
+      )
+      self._conn.execute('CREATE INDEX IF NOT EXISTS results_job ON results (job_id, sequence)')
+
+  def create_job(self, images: Iterable[tuple[str, bytes]]) -> str:
+    """
+    :param images: (name, encoded image file) of every image of the batch
+    :return: id of the new job
+    """
+    job_id = uuid.uuid4().hex
+    with self._lock, self._conn:
+      self._conn.execute('INSERT INTO jobs (id, created_at, total) VALUES (?, ?, 0)', (job_id, time.time()))
+      cursor = self._conn.executemany(
+        'INSERT INTO items (job_id, position, name, image, status) VALUES (?, ?, ?, ?, ?)',
+        ((job_id, position, name, image, PENDING) for position, (name, image) in enumerate(images))
+      )
+      self._conn.execute('UPDATE jobs SET total = ? WHERE id = ?', (cursor.rowcount, job_id))
+    return job_id
+
+  def claim(self, limit: int = 1) -> list[JobItem]:
+    """
+    Marks the oldest pending items running
+
+    :return: up to limit claimed items, empty if nothing is pending
+    """
+    with self._lock, self._conn:
+      rows = self._conn.execute(
+        'SELECT seq, job_id, position, name, image, attempts FROM items WHERE status = ? ORDER BY seq LIMIT ?',
+        (PENDING, limit)
+      ).fetchall()
+      self._conn.executemany(
+        'UPDATE items SET status = ?, attempts = attempts + 1 WHERE seq = ?', ((RUNNING, row[0]) for row in rows)
+      )
+    return [
+      JobItem(job_id=job_id, position=position, name=name, image=image, attempts=attempts + 1)
+      for _, job_id, position, name, image, attempts in rows
+    ]
+
+  def complete(self, item: JobItem, components: str):
+    """
+    :param components: json of the CircuitComponents found
+    """
+    self._finish(item, DONE, components, None)
+
+  def fail(self, item: JobItem, error: str, retry: bool):
+    """
+    :param retry: put the item back in the queue, otherwise record it as failed
+    """
+    if not retry:
+      self._finish(item, FAILED, None, error)
+      return
+    with self._lock, self._conn:
+      self._conn.execute(
+        'UPDATE items SET status = ? WHERE job_id = ? AND position = ?', (PENDING, item.job_id, item.position)
+      )
+
+  def requeue_running(self) -> int:
+    """
+    Puts items left running by a process that stopped back in the queue
+
+    :return: number of items requeued
+    """
+    with self._lock, self._conn:
+      return self._conn.execute('UPDATE items SET status = ? WHERE status = ?', (PENDING, RUNNING)).rowcount
+
+  def progress(self, job_id: str) -> Optional[JobProgress]:
+    """
+    :return: counts of the items of the job by status, None for an unknown job
+    """
+    with self._lock:
+      job = self._conn.execute('SELECT created_at, total FROM jobs WHERE id = ?', (job_id,)).fetchone()
+      if job is None:
+        return None
+      counts = dict(self._conn.execute(
+        'SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status', (job_id,)
+      ).fetchall())
+    created_at, total = job
+    return JobProgress(
+      job_id=job_id,
+      created_at=created_at,
+      total=total,
+      pending=counts.get(PENDING, 0),
+      running=counts.get(RUNNING, 0),
+      done=counts.get(DONE, 0),
+      failed=counts.get(FAILED, 0)
+    )
+
+  def results(self, job_id: str, after: int = 0, limit: int = 100) -> list[JobResult]:
+    """
+    :param after: sequence of the last result already seen, 0 for the first results
+    :return: up to limit results of the job that finished after it, in the order they finished
+    """
+    with self._lock:
+      rows = self._conn.execute(
+        'SELECT sequence, position, name, status, components, error FROM results'
+        ' WHERE job_id = ? AND sequence > ? ORDER BY sequence LIMIT ?',
+        (job_id, after, limit)
+      ).fetchall()
+    return [JobResult(*row) for row in rows]
+
+  def _finish(self, item: JobItem, status: str, components: Optional[str], error: Optional[str]):
+    with self._lock, self._conn:
+      self._conn.execute(
+        'UPDATE items SET status = ?, image = NULL WHERE job_id = ? AND position = ?',
+        (status, item.job_id, item.position)
+      )
+      self._conn.execute(
+        'INSERT INTO results (job_id, position, name, status, components, error) VALUES (?, ?, ?, ?, ?, ?)',
+        (item.job_id, item.position, item.name, status, components, error)
+      )
+
+  def close(self):
+    self._conn.close()
@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from typing import Optional
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+@dataclass(frozen=True)
+class JobItem:
+  """
+  One image of a job, as claimed by a worker
+  """
+  job_id: str
+  # position of the image in the submitted batch
+  position: int
+  name: str
+  image: bytes
+  # attempts so far, including the current one
+  attempts: int
+
+
+@dataclass(frozen=True)
+class JobResult:
+  """
+  Outcome of one image of a job
+  """
+  # increases in the order images finish, pass the last one seen to JobStore.results to continue after it
+  sequence: int
+  position: int
+  name: str
+  status: str
+  # json of the CircuitComponents found, None if the image failed
+  components: Optional[str]
+  error: Optional[str]
+
+
+@dataclass(frozen=True)
+class JobProgress:
+  job_id: str
+  created_at: float
+  total: int
+  pending: int
+  running: int
+  done: int
+  failed: int
+
+  @property
+  def finished(self) -> bool:
+    return self.done + self.failed == self.total
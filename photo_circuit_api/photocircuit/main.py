@@ -0,0 +1,288 @@
+"""
+HTTP api detecting the components of photos of circuits.
+
+  POST /detect   body: the photo as an image file, or a multipart form with the photo in its image field
+                 200: {"components": [...]} with positions in pixels of the photo
+                 400: not an image, 413: over the max upload size, 502: the llm request failed
+                 429: too many requests already waiting, 503: none of the work slots freed up in time, both with a
+                 Retry-After header
+  GET  /healthz  admission and coalescing counters
+  GET  /metrics  pipeline stage metrics in prometheus text format
+
+With --jobs-db, batches of photos are also run in the background by a pool of workers:
+
+  POST /jobs                     body: a multipart form with one file field per photo
+                                 202: {"job_id": ..., "total": number of photos}
+  GET  /jobs/{job_id}            200: counts of the job's photos by status, 404: unknown job
+  GET  /jobs/{job_id}/results    ?after=sequence of the last result already seen
+                                 200: newline delimited json, one result per photo streamed as it finishes, until the
+                                 whole job has finished
+
+Jobs are stored in sqlite and resume after a restart.
+
+Concurrent uploads of the same file share one detection, and only admitted requests use a work slot, so a burst of
+identical uploads costs one llm request.
+
+run from photo_circuit_api/ with: python -m photocircuit.main --port 8000
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import math
+from functools import lru_cache
+from typing import Optional
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from photocircuit.component_detection.detection_cache import DetectionCache, DEFAULT_CACHE_PATH
+from photocircuit.component_detection.model import CircuitComponents
+from photocircuit.jobs.job_service import JobService
+from photocircuit.jobs.job_store import JobStore, DEFAULT_JOBS_PATH
+from photocircuit.photocircuit import PhotoCircuit, DEFAULT_GRID_SPACING
+from photocircuit.utils.async_utils import AdmissionController, AdmissionRejected, SingleFlight, DEFAULT_CONCURRENCY, \
+  DEFAULT_MAX_QUEUE, DEFAULT_QUEUE_TIMEOUT
+from photocircuit.utils.cache import digest
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.http_client import pooled_async_client, DEFAULT_MAX_CONNECTIONS
+from photocircuit.utils.instrumentation import INSTRUMENTATION, PrometheusSink
+from photocircuit.utils.lazy_import import preload
+
+DEFAULT_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# channels of the decoded uploads preprocessing handles: gray, rgb and rgba
+SUPPORTED_CHANNELS = (1, 3, 4)
+# imported lazily by the modules of the first request, loaded in the background once the server is listening instead
+PRELOADED_MODULES = ('cv2', 'PIL.Image', 'PIL.PngImagePlugin', 'PIL.JpegImagePlugin')
+
+PHOTO_CIRCUIT = web.AppKey('photo_circuit', PhotoCircuit)
+ADMISSION = web.AppKey('admission', AdmissionController)
+SINGLE_FLIGHT = web.AppKey('single_flight', SingleFlight[CircuitComponents])
+METRICS = web.AppKey('metrics', PrometheusSink)
+JOB_SERVICE = web.AppKey('job_service', JobService)
+MAX_UPLOAD_BYTES = web.AppKey('max_upload_bytes', int)
+
+
+@lru_cache(maxsize=None)
+def upstream_errors() -> tuple[type[Exception], ...]:
+  """
+  :return: errors of the llm request, answered with 502
+  """
+  # only evaluated once a detection raised, by then the llm client is imported
+  import openai
+  from langchain_core.exceptions import OutputParserException
+  return openai.APIError, OutputParserException
+
+
+async def read_upload(request: web.Request) -> bytes:
+  """
+  :return: the uploaded image file
+  """
+  if not request.content_type.startswith('multipart/'):
+    return await request.read()
+  form = await request.post()
+  field = form.get('image')
+  if not isinstance(field, web.FileField):
+    raise web.HTTPBadRequest(text="multipart upload needs an image file field")
+  return field.file.read()
+
+
+def decode_upload(data: bytes) -> CircuitImage:
+  """
+  :return: image with its pixels decoded, from_bytes only reads the header, so a truncated file would otherwise only
+           fail once it is detected, holding an admission slot
+  """
+  image = CircuitImage.from_bytes(data)
+  image.array
+  return image
+
+
+async def detect(request: web.Request) -> web.Response:
+  data = await read_upload(request)
+  try:
+    image = await asyncio.to_thread(decode_upload, data)
+  except (OSError, ValueError):
+    raise web.HTTPBadRequest(text="body is not an image")
+  channels = 1 if image.array.ndim == 2 else image.shape[2]
+  if channels not in SUPPORTED_CHANNELS:
+    raise web.HTTPBadRequest(text=f"images with {channels} channels are not supported, upload gray, rgb or rgba images")
+
+  async def run() -> CircuitComponents:
+    async with request.app[ADMISSION].admit():
+      return await request.app[PHOTO_CIRCUIT].adetect(image)
+
+  try:
+    components, coalesced = await request.app[SINGLE_FLIGHT].do(digest(data), run)
+  except AdmissionRejected as e:
+    return web.json_response(
+      {'error': str(e)}, status=e.status, headers={'Retry-After': str(math.ceil(e.retry_after))}
+    )
+  except upstream_errors() as e:
+    return web.json_response({'error': f"detection failed: {type(e).__name__}"}, status=502)
+  return web.json_response(text=components.json(), headers={'X-Coalesced': str(coalesced).lower()})
+
+
+async def healthz(request: web.Request) -> web.Response:
+  admission = request.app[ADMISSION]
+  single_flight = request.app[SINGLE_FLIGHT]
+  return web.json_response({
+    'status': 'ok',
+    'in_flight': admission.in_flight,
+    'waiting': admission.waiting,
+    'rejected': admission.rejected,
+    'coalescing': single_flight.in_flight,
+    'coalesced': single_flight.coalesced,
+  })
+
+
+async def metrics(request: web.Request) -> web.Response:
+  return web.Response(text=request.app[METRICS].exposition(), content_type='text/plain', charset='utf-8',
+                      headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def submit_job(request: web.Request) -> web.Response:
+  if not request.content_type.startswith('multipart/'):
+    raise web.HTTPBadRequest(text="jobs are uploaded as a multipart form with one file field per photo")
+  images = []
+  # client_max_size only bounds every part on its own, the batch is bounded by its total size
+  max_upload_bytes, total_bytes = request.app[MAX_UPLOAD_BYTES], 0
+  reader = await request.multipart()
+  while (part := await reader.next()) is not None:
+    if part.filename is None:
+      continue
+    image = bytes(await part.read())
+    total_bytes += len(image)
+    if total_bytes > max_upload_bytes:
+      raise web.HTTPRequestEntityTooLarge(max_size=max_upload_bytes, actual_size=total_bytes)
+    images.append((part.filename, image))
+  if not images:
+    raise web.HTTPBadRequest(text="job has no photos")
+  job_id = await request.app[JOB_SERVICE].submit(images)
+  return web.json_response({'job_id': job_id, 'total': len(images)}, status=202)
+
+
+async def job_progress(request: web.Request) -> web.Response:
+  progress = await request.app[JOB_SERVICE].progress(request.match_info['job_id'])
+  if progress is None:
+    raise web.HTTPNotFound(text="unknown job")
+  return web.json_response({**dataclasses.asdict(progress), 'finished': progress.finished})
+
+
+async def job_results(request: web.Request) -> web.StreamResponse:
+  job_id = request.match_info['job_id']
+  job_service = request.app[JOB_SERVICE]
+  try:
+    after = int(request.query.get('after', 0))
+  except ValueError:
+    raise web.HTTPBadRequest(text="after is the sequence number of a result")
+  if await job_service.progress(job_id) is None:
+    raise web.HTTPNotFound(text="unknown job")
+
+  response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+  await response.prepare(request)
+  async for result in job_service.stream_results(job_id, after):
+    line = dataclasses.asdict(result)
+    line['components'] = json.loads(result.components) if result.components is not None else None
+    await response.write(json.dumps(line).encode() + b'\n')
+  await response.write_eof()
+  return response
+
+
+async def instrumentation_ctx(app: web.Application):
+  INSTRUMENTATION.add_sink(app[METRICS])
+  yield
+  INSTRUMENTATION.remove_sink(app[METRICS])
+
+
+async def job_service_ctx(app: web.Application):
+  await app[JOB_SERVICE].start()
+  yield
+  await app[JOB_SERVICE].stop()
+
+
+def create_app(
+    photo_circuit: PhotoCircuit,
+    admission: Optional[AdmissionController] = None,
+    max_upload_bytes: int = DEFAULT_MAX_UPLOAD_BYTES,
+    job_service: Optional[JobService] = None
+) -> web.Application:
+  """
+  :param photo_circuit: detects the components of every admitted upload
+  :param admission: bounds the detections running and waiting at once, defaults to AdmissionController()
+  :param max_upload_bytes: larger uploads are answered with 413, for jobs the limit applies to the sum of the photos
+  :param job_service: runs batches submitted to /jobs, which is only served when given
+  """
+  app = web.Application(client_max_size=max_upload_bytes)
+  app[MAX_UPLOAD_BYTES] = max_upload_bytes
+  app[PHOTO_CIRCUIT] = photo_circuit
+  app[ADMISSION] = admission or AdmissionController()
+  app[SINGLE_FLIGHT] = SingleFlight()
+  app[METRICS] = PrometheusSink()
+  app.cleanup_ctx.append(instrumentation_ctx)
+  app.router.add_post('/detect', detect)
+  app.router.add_get('/healthz', healthz)
+  app.router.add_get('/metrics', metrics)
+  if job_service is not None:
+    app[JOB_SERVICE] = job_service
+    app.cleanup_ctx.append(job_service_ctx)
+    app.router.add_post('/jobs', submit_job)
+    app.router.add_get('/jobs/{job_id}', job_progress)
+    app.router.add_get('/jobs/{job_id}/results', job_results)
+  return app
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--service', choices=('llm', 'multistage'), default='llm',
+                      help="multistage refines every component from crops with a second llm request")
+  parser.add_argument('--int-size', type=int, default=DEFAULT_GRID_SPACING, help="grid spacing in pixels")
+  parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="sqlite cache of llm responses")
+  parser.add_argument('--no-cache', action='store_true')
+  parser.add_argument('--max-in-flight', type=int, default=DEFAULT_CONCURRENCY, help="detections running at once")
+  parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE, help="detections waiting for a slot")
+  parser.add_argument('--queue-timeout', type=float, default=DEFAULT_QUEUE_TIMEOUT,
+                      help="seconds a detection waits for a slot")
+  parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                      help="pooled keep-alive connections to the llm api")
+  parser.add_argument('--max-upload-bytes', type=int, default=DEFAULT_MAX_UPLOAD_BYTES)
+  parser.add_argument('--jobs-db', nargs='?', const=DEFAULT_JOBS_PATH,
+                      help=f"serve /jobs, storing them in this sqlite database (default {DEFAULT_JOBS_PATH})")
+  parser.add_argument('--job-workers', type=int, default=DEFAULT_CONCURRENCY, help="job photos detected at once")
+  args = parser.parse_args()
+  load_dotenv()
+
+  http_async_client = pooled_async_client(args.max_connections)
+  cache = None if args.no_cache else DetectionCache(args.cache)
+  if args.service == 'multistage':
+    from photocircuit.component_detection.multistage_llm_component_detection_service import \
+      MultistageLlmComponentDetectionService as service_class
+  else:
+    from photocircuit.component_detection.llm_component_detection_service import \
+      LlmComponentDetectionService as service_class
+  photo_circuit = PhotoCircuit(service_class(cache=cache, http_async_client=http_async_client), int_size=args.int_size)
+  admission = AdmissionController(args.max_in_flight, args.max_queue, args.queue_timeout)
+
+  job_service = JobService(photo_circuit, JobStore(args.jobs_db), args.job_workers) if args.jobs_db else None
+
+  app = create_app(photo_circuit, admission, args.max_upload_bytes, job_service)
+
+  async def close_clients(_: web.Application):
+    from photocircuit.component_detection import llm_registry
+    await http_async_client.aclose()
+    llm_registry.release(http_async_client)
+    if job_service is not None:
+      job_service.store.close()
+
+  async def preload_modules(_: web.Application):
+    # not awaited, requests are served while it runs
+    asyncio.get_running_loop().run_in_executor(None, preload, *PRELOADED_MODULES)
+
+  app.on_startup.append(preload_modules)
+  app.on_cleanup.append(close_clients)
+  web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,9 +1,78 @@
-from component_detection.base_component_detection_service import BaseComponentDetectionService
+import asyncio
+from typing import Optional, TYPE_CHECKING
+
+from photocircuit.component_detection.model import CircuitComponents
+from photocircuit.preprocessing.base_preprocessing_service import BasePreprocessingService
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.instrumentation import stage
+
+if TYPE_CHECKING:
+  from photocircuit.component_detection.base_component_detection_service import BaseComponentDetectionService
+  from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+  from photocircuit.component_detection.multistage_llm_component_detection_service import \
+    MultistageLlmComponentDetectionService
+
+# spacing of the grid drawn over preprocessed images, in pixels
+DEFAULT_GRID_SPACING = 75
+
+type DetectionService = (
+  BaseComponentDetectionService | LlmComponentDetectionService | MultistageLlmComponentDetectionService
+)
+
+
+def scale_components(components: CircuitComponents, factor: float) -> CircuitComponents:
+  """
+  :return: components with their positions multiplied by factor, e.g. to map them from a scaled image back to the photo
+  """
+  if factor == 1:
+    return components
+  return CircuitComponents(components=[
+    comp.copy(update={'position': comp.position.copy(update={
+      'x': round(comp.position.x * factor), 'y': round(comp.position.y * factor)
+    })})
+    for comp in components.components
+  ])
 
 
 class PhotoCircuit:
+  """
+  Detects the components of photos of circuits: each photo is preprocessed, labelled by the detection service, and
+  the components are returned in the coordinates of the photo.
+  """
   def __init__(
       self,
-      component_detection_service: BaseComponentDetectionService
+      component_detection_service: DetectionService,
+      preprocessing_service: Optional[BasePreprocessingService] = None,
+      int_size: int = DEFAULT_GRID_SPACING
   ):
-    pass
+    """
+    :param component_detection_service: labels preprocessed images, services with alabel_components are given the grid
+                                        spacing, others are run in a worker thread
+    :param preprocessing_service: defaults to ScalingPreprocessingService()
+    :param int_size: spacing of the grid drawn over preprocessed images in pixels
+    """
+    self.component_detection_service = component_detection_service
+    self.preprocessing_service = preprocessing_service or ScalingPreprocessingService()
+    self.int_size = int_size
+
+  def detect(self, image: CircuitImage | bytes | str) -> CircuitComponents:
+    """
+    :param image: photo of a circuit, as a CircuitImage, encoded image file or base64 png
+    :return: components found in the photo, positions in pixels of the photo
+    """
+    return asyncio.run(self.adetect(image))
+
+  async def adetect(self, image: CircuitImage | bytes | str) -> CircuitComponents:
+    """
+    async version of detect
+    """
+    image = CircuitImage.from_bytes(image) if isinstance(image, bytes) else CircuitImage.of(image)
+    preprocessed = await asyncio.to_thread(self.preprocessing_service.preprocess, image)
+    service = self.component_detection_service
+    if hasattr(service, 'alabel_components'):
+      components = await service.alabel_components(preprocessed, self.int_size)
+    else:
+      components = await asyncio.to_thread(service.label_components, preprocessed)
+    with stage('post_process', service=type(self).__name__):
+      return scale_components(components, max(image.shape[:2]) / max(preprocessed.shape[:2]))
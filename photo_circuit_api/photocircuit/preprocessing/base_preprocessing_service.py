@@ -1,10 +1,26 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Iterable, Iterator, Optional
 
 import numpy as np
 
+from photocircuit.preprocessing.scratch_buffers import ScratchBuffers
+from photocircuit.preprocessing.shared_memory_pool import preprocess_many
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.instrumentation import stage
+
 
 class BasePreprocessingService(ABC):
+  # Requirements used by CompositePreprocessingService to fuse a chain of steps. None means the step works on any
+  # number of channels / any dtype and keeps them unchanged.
+  # channels preprocess_image_core needs its input to have
+  input_channels: Optional[int] = None
+  # dtype preprocess_image_core needs its input to have
+  input_dtype: Optional[type] = None
+  # channels preprocess_image_core returns
+  core_output_channels: Optional[int] = None
+  # channels preprocess_image returns, after expanding the result of preprocess_image_core
+  output_channels: Optional[int] = None
+  
   @abstractmethod
   def preprocess_image(self, image_arr: np.array) -> np.array:
     """
@@ -14,4 +30,42 @@ class BasePreprocessingService(ABC):
     :return: image after preprocessing
     """
     
+  def fingerprint(self) -> str:
+    """
+    :return: stable description of this step and every setting that changes its output, used in cache keys
+    """
+    return type(self).__qualname__
+    
+  def preprocess_image_core(self, image_arr: np.array, scratch: Optional[ScratchBuffers] = None) -> np.array:
+    """
+    The step without any colour conversion of its input or output, used when running fused in a composite chain
+    
+    :param image_arr: image with input_channels channels and input_dtype dtype
+    :param scratch: buffers the result may be written into, the result is only valid until the next call when given
+    :return: image with core_output_channels channels
+    """
+    return self.preprocess_image(image_arr)
     
+  def preprocess(self, image: CircuitImage) -> CircuitImage:
+    """
+    :param image: raw circuit image from user
+    :return: image after preprocessing, not encoded until an encoding is requested
+    """
+    with stage('preprocess', service=type(self).__name__):
+      return CircuitImage.from_array(self.preprocess_image(image.array))
+    
+  def preprocess_many(
+      self,
+      images: Iterable[np.array],
+      max_workers: Optional[int] = None,
+      ordered: bool = True
+  ) -> Iterator[tuple[int, np.array]]:
+    """
+    Preprocesses images in parallel worker processes, images are handed to and from the workers in shared memory
+    
+    :param images: raw circuit images, consumed lazily
+    :param max_workers: number of worker processes, defaults to the number of cpus
+    :param ordered: yield results in input order, otherwise as each one finishes
+    :return: iterator of (index of input image, image after preprocessing)
+    """
+    return preprocess_many(self, images, max_workers, ordered)
@@ -0,0 +1,122 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.preprocessing.base_preprocessing_service import BasePreprocessingService
+from photocircuit.utils.cache import TieredCacheStats, array_digest, digest
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.instrumentation import stage
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/photocircuit/preprocessed')
+
+
+class CachingPreprocessingService(BasePreprocessingService):
+  """
+  Memoizes another preprocessing service, keyed by the digest of the raw image and the fingerprint of the service.
+  
+  Results are kept in an in-memory LRU, and if cache_dir is given also as .npy files that are memory mapped when read
+  back, so they survive restarts and are shared between processes. Returned arrays are read only, as they are shared
+  between every caller that preprocesses the same image.
+  """
+  def __init__(
+      self,
+      service: BasePreprocessingService,
+      max_entries: int = DEFAULT_MAX_ENTRIES,
+      cache_dir: Optional[str] = None
+  ):
+    """
+    :param service: service whose results are cached
+    :param max_entries: max number of results kept in memory
+    :param cache_dir: directory of the on-disk tier, None to only cache in memory
+    """
+    self.service = service
+    self.max_entries = max_entries
+    self.cache_dir = cache_dir
+    self.stats = TieredCacheStats()
+    self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+    self._lock = threading.Lock()
+    if cache_dir is not None:
+      os.makedirs(cache_dir, exist_ok=True)
+  
+  def __getstate__(self):
+    # worker processes get their own empty memory tier, they still share the disk tier
+    state = self.__dict__.copy()
+    del state['_lock']
+    state['_memory'] = OrderedDict()
+    return state
+  
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+  
+  def fingerprint(self) -> str:
+    # caching never changes the output
+    return self.service.fingerprint()
+  
+  def preprocess_image(self, image_arr: np.array) -> np.array:
+    return self._get_or_compute(array_digest(image_arr), image_arr)
+  
+  def preprocess(self, image: CircuitImage) -> CircuitImage:
+    # the digest of a CircuitImage is cached on it, so repeated lookups don't hash the pixels again
+    with stage('preprocess', service=type(self).__name__):
+      return CircuitImage.from_array(self._get_or_compute(image.digest(), image.array))
+  
+  def _get_or_compute(self, image_digest: str, image_arr: np.ndarray) -> np.ndarray:
+    key = digest(image_digest, self.fingerprint())
+    result = self._get(key)
+    if result is None:
+      result = self.service.preprocess_image(image_arr)
+      result.setflags(write=False)
+      self._put(key, result)
+    return result
+  
+  def _get(self, key: str) -> Optional[np.ndarray]:
+    with self._lock:
+      result = self._memory.get(key)
+      if result is not None:
+        self._memory.move_to_end(key)
+        self.stats.hits += 1
+        return result
+    
+    path = self._path(key)
+    if path is not None and os.path.exists(path):
+      result = np.load(path, mmap_mode='r')
+      with self._lock:
+        self.stats.hits += 1
+        self.stats.disk_hits += 1
+        self._remember(key, result)
+      return result
+    
+    with self._lock:
+      self.stats.misses += 1
+    return None
+  
+  def _put(self, key: str, result: np.ndarray):
+    with self._lock:
+      self._remember(key, result)
+    path = self._path(key)
+    if path is not None:
+      # write under a unique name then rename, so concurrent readers never see a partial file
+      tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+      with open(tmp_path, 'wb') as f:
+        np.save(f, result)
+      os.replace(tmp_path, path)
+  
+  def _remember(self, key: str, result: np.ndarray):
+    self._memory[key] = result
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.max_entries:
+      self._memory.popitem(last=False)
+      self.stats.evictions += 1
+  
+  def _path(self, key: str) -> Optional[str]:
+    return os.path.join(self.cache_dir, f"{key}.npy") if self.cache_dir is not None else None
+  
+  def clear(self):
+    with self._lock:
+      self._memory.clear()
@@ -1,16 +1,122 @@
+from typing import Callable, Optional
+
 import numpy as np
 
 from photocircuit.preprocessing.base_preprocessing_service import BasePreprocessingService
+from photocircuit.preprocessing.scratch_buffers import ScratchBuffers
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+
+type PlanOp = Callable[[np.ndarray], np.ndarray]
+
+
+def num_channels(image_arr: np.ndarray) -> int:
+  return 1 if image_arr.ndim == 2 else image_arr.shape[2]
 
 
 class CompositePreprocessingService(BasePreprocessingService):
+  """
+  Runs a chain of preprocessing steps as one fused plan.
+
+  Using the channel / dtype requirements the steps declare, colour conversions are only done where a step actually
+  needs them, e.g. a step that expands its grayscale result to RGB followed by a step that only needs grayscale runs
+  without the round trip. Intermediate results are written into scratch buffers reused across calls with the same
+  image shape. The output is identical to running each step's preprocess_image in turn.
+  """
   def __init__(self, *chain: BasePreprocessingService):
     self.chain = chain
-    
+    # as a step of another chain, a composite needs nothing from its input and has the channels of its last step
+    # that changes channels
+    self.output_channels = self.core_output_channels = next(
+      (step.output_channels for step in reversed(chain) if step.output_channels is not None), None
+    )
+    self.scratch = ScratchBuffers()
+    self._plans: dict[tuple[int, np.dtype], list[PlanOp]] = {}
+
+  def fingerprint(self) -> str:
+    return f"{type(self).__qualname__}({', '.join(step.fingerprint() for step in self.chain)})"
+
   def preprocess_image(self, image_arr: np.array) -> np.array:
+    cur: np.array = image_arr
+    for op in self.plan(num_channels(image_arr), image_arr.dtype):
+      cur = op(cur)
+    return cur
+
+  def __getstate__(self):
+    # plans hold closures, rebuild them in the process the chain is sent to
+    state = self.__dict__.copy()
+    state['_plans'] = {}
+    return state
+
+  def preprocess_image_unfused(self, image_arr: np.array) -> np.array:
+    """
+    runs every step on its own, only useful as a reference for the fused plan
+    """
     cur: np.array = image_arr
     for step in self.chain:
       cur = step.preprocess_image(cur)
     return cur
-    
-  
\ No newline at end of file
+
+  def plan(self, channels: int, dtype: np.dtype) -> list[PlanOp]:
+    """
+    :param channels: number of channels of the input image
+    :param dtype: dtype of the input image
+    :return: cached list of operations running the chain for inputs with this layout
+    """
+    key = (channels, np.dtype(dtype))
+    if key not in self._plans:
+      self._plans[key] = self._build_plan(channels, np.dtype(dtype))
+    return self._plans[key]
+
+  def _build_plan(self, channels: int, dtype: np.dtype) -> list[PlanOp]:
+    ops: list[PlanOp] = []
+    # channels of the array actually flowing through the plan, vs the channels running the steps unfused would have
+    actual_channels = logical_channels = channels
+    for i, step in enumerate(self.chain):
+      if step.input_dtype is not None and dtype != step.input_dtype:
+        ops.append(lambda arr, to=step.input_dtype: arr.astype(to))
+        dtype = np.dtype(step.input_dtype)
+      if step.input_channels is not None and step.input_channels != actual_channels:
+        ops.append(self._convert_op(actual_channels, step.input_channels, ('input', i)))
+        actual_channels = step.input_channels
+
+      # the last step writes into a scratch buffer only if a conversion copies its result out afterward
+      is_last = i == len(self.chain) - 1
+      output_converted = (step.core_output_channels or actual_channels) != (step.output_channels or logical_channels)
+      scratch = None if is_last and not output_converted else self.scratch
+      ops.append(lambda arr, step=step, scratch=scratch: step.preprocess_image_core(arr, scratch))
+
+      if step.core_output_channels is not None:
+        actual_channels = step.core_output_channels
+      if step.output_channels is not None:
+        logical_channels = step.output_channels
+      elif step.input_channels is not None:
+        logical_channels = actual_channels
+
+    if actual_channels != logical_channels:
+      ops.append(self._convert_op(actual_channels, logical_channels, None))
+    elif not self.chain:
+      ops.append(np.copy)
+    return ops
+
+  def _convert_op(self, from_channels: int, to_channels: int, scratch_key) -> PlanOp:
+    """
+    :param scratch_key: key of the scratch buffer to convert into, None to allocate the result
+    """
+    if from_channels == 1:
+      code = cv2.COLOR_GRAY2RGBA if to_channels == 4 else cv2.COLOR_GRAY2RGB
+    elif to_channels == 1:
+      code = cv2.COLOR_RGBA2GRAY if from_channels == 4 else cv2.COLOR_RGB2GRAY
+    else:
+      code = cv2.COLOR_RGBA2RGB if from_channels == 4 else cv2.COLOR_RGB2RGBA
+
+    def convert(arr: np.ndarray) -> np.ndarray:
+      arr = arr.reshape(arr.shape[:2]) if from_channels == 1 else arr
+      dst = None
+      if scratch_key is not None:
+        shape = arr.shape[:2] if to_channels == 1 else arr.shape[:2] + (to_channels,)
+        dst = self.scratch.get((id(self), scratch_key), shape, arr.dtype)
+      return cv2.cvtColor(arr, code, dst=dst)
+
+    return convert
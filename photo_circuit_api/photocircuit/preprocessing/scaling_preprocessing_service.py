@@ -1,20 +1,43 @@
-import cv2
+from typing import Optional
+
 import numpy as np
 
 from photocircuit.preprocessing.base_preprocessing_service import BasePreprocessingService
+from photocircuit.preprocessing.scratch_buffers import ScratchBuffers
 from photocircuit.utils.common import scale_image
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
 
 FIXED_SIZE = 750
 
 
 class ScalingPreprocessingService(BasePreprocessingService):
+  def __init__(self, fixed_size: int = FIXED_SIZE):
+    """
+    :param fixed_size: length of the longest side of scaled images, raise it for large schematics detected in tiles
+    """
+    self.fixed_size = fixed_size
+  
+  def fingerprint(self) -> str:
+    return f"{type(self).__qualname__}(fixed_size={self.fixed_size})"
+  
   def preprocess_image(self, image_arr: np.array) -> np.array:
+    return self.preprocess_image_core(image_arr)
+  
+  def preprocess_image_core(self, image_arr: np.array, scratch: Optional[ScratchBuffers] = None) -> np.array:
     max_side_len = max(image_arr.shape)
-    # scale_factor = (FIXED_SIZE * (1 + max_side_len // FIXED_SIZE)) / max_side_len
-    scale_factor = FIXED_SIZE / max_side_len
+    # scale_factor = (self.fixed_size * (1 + max_side_len // self.fixed_size)) / max_side_len
+    scale_factor = self.fixed_size / max_side_len
+    dst = None
+    if scratch is not None:
+      # same rounding opencv uses to size the output from fx / fy, so the buffer is written into, not replaced
+      out_shape = (round(image_arr.shape[0] * scale_factor), round(image_arr.shape[1] * scale_factor))
+      dst = scratch.get((id(self), 'scaled'), out_shape + image_arr.shape[2:], image_arr.dtype)
     scaled_circuit_img_arr = cv2.resize(
       image_arr,
       (0, 0),
+      dst=dst,
       fx=scale_factor,
       fy=scale_factor,
       interpolation=cv2.INTER_LINEAR
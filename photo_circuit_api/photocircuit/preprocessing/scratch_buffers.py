@@ -0,0 +1,41 @@
+import threading
+from typing import Hashable
+
+import numpy as np
+
+
+class ScratchBuffers:
+  """
+  Arrays reused between calls for intermediate results with the same shape, one set per thread so concurrent calls
+  never share a buffer. Only one array is kept per key, so images of ever new sizes do not pile up buffers.
+  """
+  def __init__(self):
+    self._local = threading.local()
+    
+  def get(self, key: Hashable, shape: tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+    """
+    :param key: identifies the intermediate result, e.g. (step, name)
+    :return: uninitialized array of shape / dtype, the same array every call with the same key until it is asked for
+             with another shape or dtype, which replaces it
+    """
+    buffers = self._local.__dict__.setdefault('buffers', {})
+    buffer = buffers.get(key)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+      buffer = buffers[key] = np.empty(shape, dtype=dtype)
+    return buffer
+  
+  def __len__(self) -> int:
+    """
+    :return: number of buffers kept by the calling thread
+    """
+    return len(self._local.__dict__.get('buffers', {}))
+  
+  def clear(self):
+    self._local.__dict__.pop('buffers', None)
+  
+  def __getstate__(self):
+    # buffers are per process, never ship them to another one
+    return {}
+  
+  def __setstate__(self, state):
+    self._local = threading.local()
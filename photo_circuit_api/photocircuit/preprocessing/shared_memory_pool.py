@@ -0,0 +1,123 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator, TYPE_CHECKING
+
+import numpy as np
+
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+
+if TYPE_CHECKING:
+  from photocircuit.preprocessing.base_preprocessing_service import BasePreprocessingService
+
+# (shared memory block name, shape, dtype) of an image handed between processes
+type SharedImage = tuple[str, tuple[int, ...], str]
+
+# service used by every task of a worker process, sent once when the worker starts instead of with every task
+_worker_service: 'BasePreprocessingService | None' = None
+
+
+def _init_worker(service: 'BasePreprocessingService'):
+  global _worker_service
+  _worker_service = service
+  # parallelism comes from the worker processes, opencv's own thread pool in each of them would oversubscribe cpus
+  cv2.setNumThreads(1)
+
+
+def _to_shared(image_arr: np.ndarray) -> tuple[shared_memory.SharedMemory, SharedImage]:
+  shm = shared_memory.SharedMemory(create=True, size=max(image_arr.nbytes, 1))
+  np.ndarray(image_arr.shape, image_arr.dtype, buffer=shm.buf)[...] = image_arr
+  return shm, (shm.name, image_arr.shape, image_arr.dtype.str)
+
+
+def _preprocess_shared(image: SharedImage) -> SharedImage:
+  """
+  runs in a worker process, the result is left in a new shared memory block for the parent to copy out and unlink
+  """
+  name, shape, dtype = image
+  in_shm = shared_memory.SharedMemory(name=name)
+  try:
+    image_arr = np.ndarray(shape, dtype, buffer=in_shm.buf)
+    result = _worker_service.preprocess_image(image_arr)
+    del image_arr
+  finally:
+    in_shm.close()
+  out_shm, shared_result = _to_shared(np.ascontiguousarray(result))
+  out_shm.close()
+  return shared_result
+
+
+def _from_shared(image: SharedImage) -> np.ndarray:
+  name, shape, dtype = image
+  shm = shared_memory.SharedMemory(name=name)
+  try:
+    return np.ndarray(shape, dtype, buffer=shm.buf).copy()
+  finally:
+    shm.close()
+    shm.unlink()
+
+
+def preprocess_many(
+    service: 'BasePreprocessingService',
+    images: Iterable[np.ndarray],
+    max_workers: int | None = None,
+    ordered: bool = True
+) -> Iterator[tuple[int, np.ndarray]]:
+  """
+  Preprocesses images in a pool of worker processes, images are passed to and from the workers through shared memory.
+
+  Inputs are consumed lazily, at most 2 * max_workers images are in shared memory at once.
+
+  :param service: preprocessing service, pickled once per worker
+  :param images: raw circuit images
+  :param max_workers: number of worker processes, defaults to the number of cpus
+  :param ordered: yield results in input order, otherwise as soon as each one is done
+  :return: iterator of (index of input image, preprocessed image)
+  """
+  max_workers = max_workers or os.cpu_count() or 1
+  max_in_flight = 2 * max_workers
+  images = iter(images)
+  # index -> (future, shared memory block of input)
+  in_flight: dict[int, tuple[Future, shared_memory.SharedMemory]] = {}
+  order = deque()
+
+  def release(index: int) -> Future:
+    future, in_shm = in_flight.pop(index)
+    in_shm.close()
+    in_shm.unlink()
+    return future
+
+  with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(service,)) as pool:
+    try:
+      next_index = 0
+      exhausted = False
+      while True:
+        while not exhausted and len(in_flight) < max_in_flight:
+          image_arr = next(images, None)
+          if image_arr is None:
+            exhausted = True
+            break
+          in_shm, shared_image = _to_shared(np.ascontiguousarray(image_arr))
+          in_flight[next_index] = (pool.submit(_preprocess_shared, shared_image), in_shm)
+          order.append(next_index)
+          next_index += 1
+        if not in_flight:
+          return
+
+        if ordered:
+          index = order.popleft()
+          in_flight[index][0].result()
+        else:
+          done, _ = wait([future for future, _ in in_flight.values()], return_when=FIRST_COMPLETED)
+          index = next(i for i, (future, _) in in_flight.items() if future in done)
+          order.remove(index)
+        yield index, _from_shared(release(index).result())
+    finally:
+      # consumer stopped early or a worker failed, free every block that is still allocated
+      for index in list(in_flight):
+        future = release(index)
+        if not future.cancel() and future.exception() is None:
+          _from_shared(future.result())
@@ -1,32 +1,53 @@
-import cv2
+from typing import Optional
+
 import numpy as np
 
 from photocircuit.preprocessing.base_preprocessing_service import BasePreprocessingService
+from photocircuit.preprocessing.scratch_buffers import ScratchBuffers
 from photocircuit.utils.common import scale_image
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
 
 
 LINE_THICKNESS = 4
 
 
 class ThicknessPreprocessingService(BasePreprocessingService):
+  input_channels = 1
+  input_dtype = np.uint8
+  core_output_channels = 1
+  output_channels = 3
+  
+  def __init__(self):
+    self.kernel = np.ones((LINE_THICKNESS, LINE_THICKNESS), np.uint8)
+  
+  def fingerprint(self) -> str:
+    return f"{type(self).__qualname__}(line_thickness={self.kernel.shape[0]})"
+  
   def preprocess_image(self, image_arr: np.array) -> np.array:
     # Check the number of channels in the image
     if len(image_arr.shape) == 2 or image_arr.shape[2] == 1:  # Grayscale image
-      gray_image = image_arr
+      gray_image = image_arr.reshape(image_arr.shape[:2])
     else:  # RGB image
       gray_image = cv2.cvtColor(image_arr, cv2.COLOR_RGB2GRAY)
     
-    # Apply threshold to get binary image
-    _, binary_image = cv2.threshold(gray_image, 128, 255, cv2.THRESH_BINARY)
-    
-    # Find edges using Canny
-    edges = cv2.Canny(binary_image, 50, 150)
-    
-    # Dilate the edges to make lines thicker
-    kernel = np.ones((LINE_THICKNESS, LINE_THICKNESS), np.uint8)
-    thickened_image = cv2.dilate(edges, kernel, iterations=1)
+    thickened_image = self.preprocess_image_core(gray_image)
     
     # Convert the thickened image back to a 3-channel image
     thickened_image = cv2.cvtColor(thickened_image, cv2.COLOR_GRAY2RGB)
     
     return thickened_image
+  
+  def preprocess_image_core(self, image_arr: np.array, scratch: Optional[ScratchBuffers] = None) -> np.array:
+    def buffer(name: str) -> Optional[np.ndarray]:
+      return scratch.get((id(self), name), image_arr.shape) if scratch is not None else None
+    
+    # Apply threshold to get binary image
+    _, binary_image = cv2.threshold(image_arr, 128, 255, cv2.THRESH_BINARY, dst=buffer('binary'))
+    
+    # Find edges using Canny
+    edges = cv2.Canny(binary_image, 50, 150, edges=buffer('edges'))
+    
+    # Dilate the edges to make lines thicker
+    return cv2.dilate(edges, self.kernel, dst=buffer('thickened'), iterations=1)
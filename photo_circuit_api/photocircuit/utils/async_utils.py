@@ -0,0 +1,143 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Generic, Hashable, Iterable, TypeVar
+
+T = TypeVar('T')
+
+DEFAULT_CONCURRENCY = 8
+# requests waiting for a slot of an AdmissionController, and seconds each of them waits
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_QUEUE_TIMEOUT = 10.0
+
+
+async def gather_limited(
+    tasks: Iterable[Callable[[], Awaitable[T]]],
+    concurrency: int = DEFAULT_CONCURRENCY
+) -> list[T | BaseException]:
+  """
+  Runs tasks with at most `concurrency` of them in flight at once.
+  
+  :param tasks: functions creating the awaitable to run, called only once a slot is free
+  :param concurrency: max number of tasks running at the same time
+  :return: results in the same order as tasks, a task that raised has its exception in place of the result
+  """
+  semaphore = asyncio.Semaphore(concurrency)
+  
+  async def run(task: Callable[[], Awaitable[T]]) -> T:
+    async with semaphore:
+      return await task()
+  
+  return await asyncio.gather(*(run(task) for task in tasks), return_exceptions=True)
+
+
+class AdmissionRejected(Exception):
+  """
+  A request turned away by AdmissionController, status is the http status to answer it with
+  """
+  status = 503
+  
+  def __init__(self, message: str, retry_after: float):
+    super().__init__(message)
+    # seconds the client should wait before retrying
+    self.retry_after = retry_after
+
+
+class QueueFull(AdmissionRejected):
+  status = 429
+
+
+class QueueTimeout(AdmissionRejected):
+  status = 503
+
+
+class AdmissionController:
+  """
+  Bounds the work in flight: at most max_in_flight requests run at once and at most max_queue wait for a slot. A
+  request arriving at a full queue is rejected straight away, and one that waits longer than queue_timeout gives up,
+  so bursts are shed instead of piling up latency for everyone.
+  """
+  def __init__(self, max_in_flight: int = DEFAULT_CONCURRENCY, max_queue: int = DEFAULT_MAX_QUEUE,
+               queue_timeout: float = DEFAULT_QUEUE_TIMEOUT, retry_after: float = 1.0):
+    """
+    :param max_in_flight: max number of admitted requests running at once
+    :param max_queue: max number of requests waiting for a slot
+    :param queue_timeout: max seconds a request waits for a slot
+    :param retry_after: seconds rejected clients are told to wait before retrying
+    """
+    self.max_in_flight = max_in_flight
+    self.max_queue = max_queue
+    self.queue_timeout = queue_timeout
+    self.retry_after = retry_after
+    self.in_flight = 0
+    self.waiting = 0
+    self.rejected = 0
+    self._semaphore = asyncio.Semaphore(max_in_flight)
+  
+  @asynccontextmanager
+  async def admit(self) -> AsyncIterator[None]:
+    """
+    Holds a slot for the body of the async with statement
+    
+    :raises QueueFull: if max_queue requests are already waiting
+    :raises QueueTimeout: if no slot freed up within queue_timeout
+    """
+    if self._semaphore.locked():
+      if self.waiting >= self.max_queue:
+        self.rejected += 1
+        raise QueueFull(f"{self.waiting} requests already waiting", self.retry_after)
+      self.waiting += 1
+      try:
+        await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+      except TimeoutError:
+        self.rejected += 1
+        raise QueueTimeout(f"no slot free within {self.queue_timeout}s", self.retry_after) from None
+      finally:
+        self.waiting -= 1
+    else:
+      await self._semaphore.acquire()
+    
+    self.in_flight += 1
+    try:
+      yield
+    finally:
+      self.in_flight -= 1
+      self._semaphore.release()
+
+
+class SingleFlight(Generic[T]):
+  """
+  Coalesces concurrent calls with the same key into one: the first call runs, and every call made while it is in flight
+  shares its result or exception instead of running again. Nothing is kept once the call finishes.
+  """
+  def __init__(self):
+    self._in_flight: dict[Hashable, asyncio.Task] = {}
+    # calls that shared the result of one already in flight
+    self.coalesced = 0
+  
+  @property
+  def in_flight(self) -> int:
+    return len(self._in_flight)
+  
+  async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+    """
+    :param key: identifies calls that would give the same result, e.g. a digest of the input
+    :param fn: creates the awaitable to run, only called if no call with key is in flight
+    :return: (result, whether it was shared from a call already in flight). Cancelling one caller does not cancel the
+             call the others are waiting on.
+    """
+    task = self._in_flight.get(key)
+    shared = task is not None
+    if shared:
+      self.coalesced += 1
+    else:
+      task = asyncio.ensure_future(fn())
+      self._in_flight[key] = task
+      task.add_done_callback(lambda done: self._forget(key, done))
+    return await asyncio.shield(task), shared
+  
+  def _forget(self, key: Hashable, task: asyncio.Task):
+    if self._in_flight.get(key) is task:
+      del self._in_flight[key]
+    if not task.cancelled():
+      # mark the exception as retrieved, every caller may have given up on it already
+      task.exception()
@@ -0,0 +1,44 @@
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class CacheStats:
+  hits: int = 0
+  misses: int = 0
+  evictions: int = 0
+  
+  @property
+  def hit_rate(self) -> float:
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class TieredCacheStats(CacheStats):
+  # hits served from disk, included in hits
+  disk_hits: int = 0
+
+
+def digest(*parts: str | bytes) -> str:
+  """
+  :param parts: values identifying a cache entry
+  :return: sha256 hex digest of all parts, parts are length prefixed so ("ab", "c") and ("a", "bc") differ
+  """
+  h = hashlib.sha256()
+  for part in parts:
+    data = part.encode('utf-8') if isinstance(part, str) else part
+    h.update(len(data).to_bytes(8, 'little'))
+    h.update(data)
+  return h.hexdigest()
+
+
+def array_digest(array: np.ndarray) -> str:
+  """
+  :return: sha256 hex digest of the pixels, shape and dtype of array
+  """
+  h = hashlib.sha256(str((array.shape, array.dtype.str)).encode('utf-8'))
+  h.update(np.ascontiguousarray(array).data)
+  return h.hexdigest()
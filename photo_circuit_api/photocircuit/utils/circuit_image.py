@@ -0,0 +1,116 @@
+import base64
+import io
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.utils.cache import array_digest
+from photocircuit.utils.lazy_import import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+DEFAULT_FORMAT = 'PNG'
+
+
+class CircuitImage:
+  """
+  Image of a circuit that is decoded at most once, with every encoding of it computed at most once.
+
+  Construct from whatever representation is at hand (encoded bytes, base64 or a numpy array), the other
+  representations are derived lazily and cached. The decoded array is read only, since cached encodings would go stale
+  if it was modified in place.
+  """
+  def __init__(self, array: Optional[np.ndarray] = None, encoded: Optional[bytes] = None, fmt: Optional[str] = None):
+    """
+    prefer from_array / from_bytes / from_base64
+
+    :param array: decoded image
+    :param encoded: encoded image file
+    :param fmt: PIL format name of encoded, detected from the file when not given
+    """
+    if array is None and encoded is None:
+      raise ValueError("CircuitImage needs either an array or encoded image")
+    self._array = None
+    self._encodings: dict[str, bytes] = {}
+    self._base64: dict[str, str] = {}
+    self._digest: Optional[str] = None
+    if array is not None:
+      self._set_array(array)
+    if encoded is not None:
+      self._encodings[(fmt or self._detect_format(encoded)).upper()] = encoded
+
+  @classmethod
+  def from_array(cls, array: np.ndarray) -> 'CircuitImage':
+    return cls(array=array)
+
+  @classmethod
+  def from_bytes(cls, encoded: bytes, fmt: Optional[str] = None) -> 'CircuitImage':
+    return cls(encoded=encoded, fmt=fmt)
+
+  @classmethod
+  def from_base64(cls, base64_str: str, fmt: Optional[str] = None) -> 'CircuitImage':
+    image = cls(encoded=base64.b64decode(base64_str), fmt=fmt)
+    fmt, = image._encodings.keys()
+    image._base64[fmt] = base64_str
+    return image
+
+  @classmethod
+  def of(cls, image: 'CircuitImage | str') -> 'CircuitImage':
+    """
+    :param image: CircuitImage, or base64 png as used throughout the older apis
+    """
+    return image if isinstance(image, CircuitImage) else cls.from_base64(image)
+
+  @property
+  def array(self) -> np.ndarray:
+    if self._array is None:
+      encoded = next(iter(self._encodings.values()))
+      self._set_array(np.array(Image.open(io.BytesIO(encoded))))
+    return self._array
+
+  @property
+  def shape(self) -> tuple[int, ...]:
+    return self.array.shape
+
+  def encode(self, fmt: str = DEFAULT_FORMAT) -> bytes:
+    """
+    :param fmt: PIL format name
+    :return: image encoded in fmt, only compressed the first time it is requested
+    """
+    fmt = fmt.upper()
+    if fmt not in self._encodings:
+      buffer = io.BytesIO()
+      self.to_pil().save(buffer, format=fmt)
+      self._encodings[fmt] = buffer.getvalue()
+    return self._encodings[fmt]
+
+  def base64(self, fmt: str = DEFAULT_FORMAT) -> str:
+    fmt = fmt.upper()
+    if fmt not in self._base64:
+      self._base64[fmt] = base64.b64encode(self.encode(fmt)).decode('utf-8')
+    return self._base64[fmt]
+
+  def to_pil(self) -> 'Image.Image':
+    """
+    :return: PIL image sharing memory with the decoded array where possible, copy it before drawing on it
+    """
+    return Image.fromarray(self.array)
+
+  def digest(self) -> str:
+    """
+    :return: sha256 of the decoded pixels and their shape, equal for the same image in any lossless encoding
+    """
+    if self._digest is None:
+      self._digest = array_digest(self.array)
+    return self._digest
+
+  def _set_array(self, array: np.ndarray):
+    array = array.astype(np.uint8, copy=False)
+    if array.flags.writeable:
+      array = array.view()
+      array.setflags(write=False)
+    self._array = array
+
+  @staticmethod
+  def _detect_format(encoded: bytes) -> str:
+    return Image.open(io.BytesIO(encoded)).format
@@ -1,9 +1,12 @@
 import base64
 import io
 
-import cv2
 import numpy as np
-from PIL import Image
+
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+Image = lazy_import('PIL.Image')
 
 
 def base64_to_numpy(base64_str: str) -> np.ndarray:
@@ -1,6 +1,18 @@
 from typing import Tuple
 
-from photocircuit.component_detection.model import ComponentName, CircuitComponents
+from photocircuit.component_detection.model import ComponentName, CircuitComponents, Component
+
+# prefix of component ids, e.g. R1, C2
+ID_PREFIXES = {
+  ComponentName.RESISTOR: 'R',
+  ComponentName.CAPACITOR: 'C',
+  ComponentName.INDUCTOR: 'L',
+  ComponentName.VOLTAGE_SOURCE: 'V',
+  ComponentName.CURRENT_SOURCE: 'I',
+  ComponentName.DEPENDANT_VOLTAGE_SOURCE: 'E',
+  ComponentName.DEPENDANT_CURRENT_SOURCE: 'G',
+  ComponentName.UNKNOWN: 'U',
+}
 
 
 def comp_counts(components: CircuitComponents) -> dict[ComponentName, int]:
@@ -12,6 +24,18 @@ def comp_counts(components: CircuitComponents) -> dict[ComponentName, int]:
   return comp_counts_map
 
 
+def renumber_components(components: list[Component]) -> list[Component]:
+  """
+  :return: copies of components with ids numbered per component type, in reading order (top to bottom, left to right)
+  """
+  counts = {}
+  renumbered = []
+  for comp in sorted(components, key=lambda c: (c.position.y, c.position.x)):
+    counts[comp.component_name] = counts.get(comp.component_name, 0) + 1
+    renumbered.append(comp.copy(update={'id': f"{ID_PREFIXES[comp.component_name]}{counts[comp.component_name]}"}))
+  return renumbered
+
+
 def summary(components: CircuitComponents):
   comp_count_summary = [
     f"{comp_name}: {comp_count}"
@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from photocircuit.utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+
+GRID_COLOR = (128, 128, 128)
+TICK_COLOR = (0, 0, 0)
+LABEL_COLOR = (0, 0, 0)
+BACKGROUND_COLOR = (255, 255, 255)
+
+# cv2.FONT_HERSHEY_SIMPLEX, by value so opencv is only imported once a grid is rendered
+LABEL_FONT = 0
+LABEL_FONT_SCALE = 0.4
+LABEL_FONT_THICKNESS = 1
+TICK_LENGTH = 4
+LABEL_PADDING = 3
+
+
+@dataclass(frozen=True)
+class GridLayout:
+  """
+  Everything about a grid overlay that only depends on the image shape and step size.
+
+  canvas is the rendered margins (ticks and coordinate labels) with a blank hole where the image goes, top/left is the
+  offset of the image inside the canvas, and xs/ys are the pixel columns/rows of the gridlines in image coordinates.
+  """
+  canvas: np.ndarray
+  top: int
+  left: int
+  xs: np.ndarray
+  ys: np.ndarray
+
+
+@lru_cache(maxsize=None)
+def label_glyph(text: str) -> np.ndarray:
+  """
+  Renders text once as a boolean mask, so labels can be stamped onto canvases with a single indexing operation
+
+  :param text: label text
+  :return: (h, w) boolean mask of the text
+  """
+  (text_w, text_h), baseline = cv2.getTextSize(text, LABEL_FONT, LABEL_FONT_SCALE, LABEL_FONT_THICKNESS)
+  glyph = np.zeros((text_h + baseline, text_w), dtype=np.uint8)
+  cv2.putText(glyph, text, (0, text_h), LABEL_FONT, LABEL_FONT_SCALE, 255, LABEL_FONT_THICKNESS, cv2.LINE_AA)
+  mask = glyph > 96
+  mask.setflags(write=False)
+  return mask
+
+
+def _stamp(canvas: np.ndarray, mask: np.ndarray, top: int, left: int, color: tuple[int, int, int]):
+  h, w = mask.shape
+  canvas[top:top + h, left:left + w][mask] = color
+
+
+@lru_cache(maxsize=64)
+def grid_layout(height: int, width: int, step_size: int) -> GridLayout:
+  """
+  Builds the canvas for an image of the given size, x labels are drawn below the image and y labels to the left of it,
+  matching the layout of the matplotlib axes previously used for the grid.
+
+  :param height: height of image in pixels
+  :param width: width of image in pixels
+  :param step_size: spacing between gridlines in pixels
+  :return: cached layout, arrays in it are read only
+  """
+  xs = np.arange(0, width, step_size)
+  ys = np.arange(0, height, step_size)
+  x_glyphs = [label_glyph(str(x)) for x in xs]
+  y_glyphs = [label_glyph(str(y)) for y in ys]
+
+  max_y_label_w = max(g.shape[1] for g in y_glyphs)
+  max_y_label_h = max(g.shape[0] for g in y_glyphs)
+  max_x_label_w = max(g.shape[1] for g in x_glyphs)
+  max_x_label_h = max(g.shape[0] for g in x_glyphs)
+
+  top = max_y_label_h // 2 + LABEL_PADDING
+  left = max_y_label_w + TICK_LENGTH + 2 * LABEL_PADDING
+  bottom = max_x_label_h + TICK_LENGTH + 2 * LABEL_PADDING
+  right = max_x_label_w // 2 + LABEL_PADDING
+
+  canvas = np.empty((top + height + bottom, left + width + right, 3), dtype=np.uint8)
+  canvas[:] = BACKGROUND_COLOR
+
+  # ticks
+  canvas[top + height:top + height + TICK_LENGTH, left + xs] = TICK_COLOR
+  canvas[top + ys, left - TICK_LENGTH:left] = TICK_COLOR
+
+  # labels, centered on their tick
+  label_top = top + height + TICK_LENGTH + LABEL_PADDING
+  for x, glyph in zip(xs, x_glyphs):
+    _stamp(canvas, glyph, label_top, left + x - glyph.shape[1] // 2, LABEL_COLOR)
+  for y, glyph in zip(ys, y_glyphs):
+    _stamp(canvas, glyph, top + y - glyph.shape[0] // 2, left - TICK_LENGTH - LABEL_PADDING - glyph.shape[1], LABEL_COLOR)
+
+  for arr in (canvas, xs, ys):
+    arr.setflags(write=False)
+  return GridLayout(canvas=canvas, top=top, left=left, xs=xs, ys=ys)
+
+
+def to_rgb(image_arr: np.ndarray) -> np.ndarray:
+  """
+  :param image_arr: grayscale, RGB or RGBA image
+  :return: RGB uint8 image, RGBA images are composited over a white background
+  """
+  if image_arr.ndim == 2 or image_arr.shape[2] == 1:
+    return cv2.cvtColor(image_arr.reshape(image_arr.shape[:2]).astype(np.uint8), cv2.COLOR_GRAY2RGB)
+  if image_arr.shape[2] == 4:
+    alpha = image_arr[:, :, 3:4].astype(np.float32) / 255
+    rgb = image_arr[:, :, :3].astype(np.float32) * alpha + 255 * (1 - alpha)
+    return rgb.astype(np.uint8)
+  return image_arr.astype(np.uint8, copy=False)
+
+
+def render_grid(image_arr: np.ndarray, step_size: int, include_grid: bool = True) -> np.ndarray:
+  """
+  Draws gridlines and coordinate labels onto a copy of the image. The image is not resampled, so the label for a
+  gridline is the exact pixel coordinate of that gridline in the input image.
+
+  :param image_arr: grayscale, RGB or RGBA image
+  :param step_size: spacing between gridlines in pixels
+  :param include_grid: if false only the ticks and labels in the margins are drawn
+  :return: RGB image of the canvas with the grid overlay
+  """
+  height, width = image_arr.shape[:2]
+  layout = grid_layout(height, width, step_size)
+
+  canvas = layout.canvas.copy()
+  image_region = canvas[layout.top:layout.top + height, layout.left:layout.left + width]
+  image_region[:] = to_rgb(image_arr)
+  if include_grid:
+    image_region[:, layout.xs] = GRID_COLOR
+    image_region[layout.ys, :] = GRID_COLOR
+  return canvas
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from typing import AsyncGenerator
+
+import httpx
+
+DEFAULT_MAX_CONNECTIONS = 64
+# seconds an idle connection is kept open for the next request, httpx closes them after 5 by default
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+
+def connection_limits(max_connections: int, keepalive_expiry: float) -> httpx.Limits:
+  return httpx.Limits(
+    max_connections=max_connections,
+    max_keepalive_connections=max_connections,
+    keepalive_expiry=keepalive_expiry
+  )
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+  """
+  Keeps a separate connection pool for every event loop, so one async client can be shared by code running in
+  different loops, e.g. the sync wrappers of the services that each call asyncio.run. A connection opened in a loop
+  that has since closed cannot be reused, httpx fails such requests with 'Event loop is closed'.
+
+  The pool of a loop is closed along with its async generators, which asyncio.run does before closing its loop. A loop
+  closed without loop.shutdown_asyncgens() keeps its pool open until close is called.
+  """
+  def __init__(self, limits: httpx.Limits):
+    self.limits = limits
+    self._lock = threading.Lock()
+    self._transports: dict[asyncio.AbstractEventLoop, tuple[httpx.AsyncHTTPTransport, AsyncGenerator]] = {}
+
+  async def _transport(self) -> httpx.AsyncHTTPTransport:
+    loop = asyncio.get_running_loop()
+    with self._lock:
+      if loop in self._transports:
+        return self._transports[loop][0]
+      transport = httpx.AsyncHTTPTransport(limits=self.limits)
+      closer = self._close_with_loop(loop, transport)
+      self._transports[loop] = transport, closer
+    # registers the generator with the loop, it runs up to its yield without suspending
+    await anext(closer)
+    return transport
+
+  async def _close_with_loop(self, loop: asyncio.AbstractEventLoop, transport: httpx.AsyncHTTPTransport):
+    try:
+      yield
+    finally:
+      with self._lock:
+        if self._transports.get(loop, (None,))[0] is transport:
+          del self._transports[loop]
+      await transport.aclose()
+
+  async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+    transport = await self._transport()
+    return await transport.handle_async_request(request)
+
+  async def aclose(self):
+    """
+    Closes the pool of the running loop
+    """
+    with self._lock:
+      entry = self._transports.get(asyncio.get_running_loop())
+    if entry is not None:
+      await entry[1].aclose()
+
+  def close(self):
+    """
+    Closes the pools of every loop from sync code: the pool of a loop that is not running is closed by running the loop,
+    the pool of a running loop by a task scheduled on it. Pools of loops closed without shutting down their async
+    generators cannot be closed anymore and are kept.
+    """
+    with self._lock:
+      entries = [(loop, closer) for loop, (_, closer) in self._transports.items() if not loop.is_closed()]
+    for loop, closer in entries:
+      if loop.is_running():
+        asyncio.run_coroutine_threadsafe(closer.aclose(), loop)
+      else:
+        loop.run_until_complete(closer.aclose())
+
+
+def pooled_client(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY
+) -> httpx.Client:
+  """
+  sync version of pooled_async_client
+  """
+  from openai import DefaultHttpxClient
+  return DefaultHttpxClient(limits=connection_limits(max_connections, keepalive_expiry))
+
+
+def pooled_async_client(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY
+) -> httpx.AsyncClient:
+  """
+  Share one client between every llm service of a server, so requests reuse warm keep-alive connections instead of
+  each service opening its own. Close it with aclose on shutdown.
+
+  :param max_connections: max number of connections open at once per event loop, also the number kept alive while idle
+  :param keepalive_expiry: seconds an idle connection is kept open
+  :return: async http client with openai's default timeouts, safe to use from any event loop, see LoopLocalTransport
+  """
+  from openai import DefaultAsyncHttpxClient
+  return DefaultAsyncHttpxClient(transport=LoopLocalTransport(connection_limits(max_connections, keepalive_expiry)))
+
+
+def close_pools(client: httpx.AsyncClient):
+  """
+  Closes the connections of a client of pooled_async_client from sync code, see LoopLocalTransport.close
+  """
+  # httpx has no public accessor for the transport a client was created with
+  transport = client._transport
+  if isinstance(transport, LoopLocalTransport):
+    transport.close()
@@ -0,0 +1,156 @@
+import base64
+import io
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.lazy_import import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+DEFAULT_MAX_BYTES = 512 * 1024
+DEFAULT_LOSSY_FORMATS = ('WEBP', 'JPEG')
+DEFAULT_QUALITIES = (90, 80, 70, 55, 40, 25)
+
+MIME_TYPES = {
+  'PNG': 'image/png',
+  'WEBP': 'image/webp',
+  'JPEG': 'image/jpeg',
+}
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+  data: bytes
+  format: str
+  # PNG: bits per pixel, None for lossy formats
+  bits: Optional[int]
+  # lossy formats: quality setting, None for PNG
+  quality: Optional[int]
+  encode_seconds: float
+  within_budget: bool
+
+  @property
+  def mime_type(self) -> str:
+    return MIME_TYPES[self.format]
+
+  @property
+  def base64(self) -> str:
+    return base64.b64encode(self.data).decode('utf-8')
+
+  @property
+  def data_url(self) -> str:
+    return f"data:{self.mime_type};base64,{self.base64}"
+
+  def describe(self) -> str:
+    settings = f"{self.bits}-bit" if self.bits is not None else f"quality={self.quality}"
+    return (
+      f"{self.format} {settings}, {len(self.data)} bytes"
+      f"{'' if self.within_budget else ' (over budget)'}, encoded in {self.encode_seconds * 1000:.1f}ms"
+    )
+
+
+class ImageEncoder:
+  """
+  Encodes images for llm payloads, choosing the format and settings so the payload fits in max_bytes.
+
+  Lossless PNG is always tried first with the smallest pixel format that represents the image exactly (1-bit for
+  black and white line art, a 2/4/8-bit palette for images with few colours, grayscale when all channels are equal).
+  Only when that is over budget are the lossy formats tried, from highest to lowest quality.
+  """
+  def __init__(
+      self,
+      max_bytes: int = DEFAULT_MAX_BYTES,
+      lossy_formats: tuple[str, ...] = DEFAULT_LOSSY_FORMATS,
+      qualities: tuple[int, ...] = DEFAULT_QUALITIES
+  ):
+    """
+    :param max_bytes: budget for the encoded image, before base64
+    :param lossy_formats: PIL formats to fall back to in order of preference
+    :param qualities: quality settings tried for each lossy format, highest first
+    """
+    self.max_bytes = max_bytes
+    self.lossy_formats = lossy_formats
+    self.qualities = qualities
+
+  def encode(self, image: CircuitImage | np.ndarray) -> EncodedImage:
+    """
+    :param image: image to encode
+    :return: smallest lossless encoding if it fits the budget, otherwise the highest quality lossy encoding that
+             does, otherwise the smallest encoding tried
+    """
+    start = time.perf_counter()
+    array = image.array if isinstance(image, CircuitImage) else image
+    pil_image, bits = self.lossless_image(array)
+    candidate = (self._save(pil_image, 'PNG', optimize=bits <= 4), 'PNG', bits, None)
+    best = candidate
+
+    if len(candidate[0]) > self.max_bytes:
+      lossy_source = pil_image.convert('L' if pil_image.mode in ('1', 'L') else 'RGB')
+      for fmt in self.lossy_formats:
+        for quality in self.qualities:
+          data = self._save(lossy_source, fmt, quality=quality)
+          if len(data) < len(best[0]):
+            best = (data, fmt, None, quality)
+          if len(data) <= self.max_bytes:
+            break
+        if len(best[0]) <= self.max_bytes:
+          break
+
+    data, fmt, bits, quality = best
+    return EncodedImage(
+      data=data,
+      format=fmt,
+      bits=bits,
+      quality=quality,
+      encode_seconds=time.perf_counter() - start,
+      within_budget=len(data) <= self.max_bytes
+    )
+
+  @staticmethod
+  def lossless_image(array: np.ndarray) -> tuple['Image.Image', int]:
+    """
+    :param array: grayscale, RGB or RGBA image
+    :return: PIL image in the smallest mode that represents array exactly, and its bits per pixel
+    """
+    if array.ndim == 3 and array.shape[2] == 4 and np.all(array[:, :, 3] == 255):
+      array = array[:, :, :3]
+    if array.ndim == 3 and array.shape[2] == 3 and np.array_equal(array[:, :, 0], array[:, :, 1]) \
+        and np.array_equal(array[:, :, 1], array[:, :, 2]):
+      array = array[:, :, 0]
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+
+    if array.ndim == 2:
+      levels = np.flatnonzero(np.bincount(array.ravel(), minlength=256))
+      if len(levels) <= 2 and set(levels.tolist()) <= {0, 255}:
+        return Image.fromarray(array).convert('1', dither=Image.Dither.NONE), 1
+      if len(levels) > 16:
+        return Image.fromarray(array), 8
+      colors = np.stack([levels] * 3, axis=1)
+      indices = np.searchsorted(levels, array)
+    elif array.shape[2] == 3:
+      packed = (array[:, :, 0].astype(np.uint32) << 16) | (array[:, :, 1].astype(np.uint32) << 8) | array[:, :, 2]
+      packed_colors, indices = np.unique(packed.ravel(), return_inverse=True)
+      if len(packed_colors) > 256:
+        return Image.fromarray(array), 24
+      colors = np.stack([(packed_colors >> 16) & 255, (packed_colors >> 8) & 255, packed_colors & 255], axis=1)
+      indices = indices.reshape(array.shape[:2])
+    else:
+      return Image.fromarray(array), 32
+
+    palette_image = Image.fromarray(indices.astype(np.uint8), mode='P')
+    palette_image.putpalette(colors.astype(np.uint8).ravel().tolist())
+    bits = next(b for b in (1, 2, 4, 8) if len(colors) <= 2 ** b)
+    palette_image.info['bits'] = bits
+    return palette_image, bits
+
+  @staticmethod
+  def _save(pil_image: 'Image.Image', fmt: str, **params) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'PNG' and pil_image.mode == 'P':
+      params['bits'] = pil_image.info['bits']
+    pil_image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
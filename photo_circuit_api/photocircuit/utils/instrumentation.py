@@ -0,0 +1,362 @@
+import json
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, Optional, TextIO
+
+import numpy as np
+
+# stages of the detection pipeline, in the order a request goes through them
+STAGES = ('decode', 'preprocess', 'grid_render', 'encode', 'cache_lookup', 'llm_request', 'parse', 'post_process')
+
+# upper bounds in seconds of the prometheus histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# numeric attributes the sinks sum per stage
+COUNTED_ATTRIBUTES = ('payload_bytes', 'prompt_tokens', 'completion_tokens')
+
+
+@dataclass(frozen=True)
+class StageEvent:
+  stage: str
+  # wall clock time the stage started at
+  started_at: float
+  seconds: float
+  # e.g. service, payload_bytes, prompt_tokens, completion_tokens, cache_hit, error
+  attributes: dict[str, Any]
+
+  def to_dict(self) -> dict:
+    return {'stage': self.stage, 'started_at': self.started_at, 'seconds': self.seconds, **self.attributes}
+
+
+class InstrumentationSink(ABC):
+  @abstractmethod
+  def record(self, event: StageEvent):
+    """
+    Called from whichever thread finished the stage, implementations must be thread safe
+    """
+
+
+# attributes of the innermost open stage, see annotate
+_current_attributes: ContextVar[Optional[dict]] = ContextVar('current_stage_attributes', default=None)
+
+
+class Instrumentation:
+  """
+  Times the stages of the detection pipeline and hands every timing to the registered sinks. Without any sinks a
+  stage costs about a microsecond, so the pipeline is always instrumented.
+  """
+  def __init__(self, sinks: Iterable[InstrumentationSink] = ()):
+    self.sinks: tuple[InstrumentationSink, ...] = tuple(sinks)
+    self._lock = threading.Lock()
+
+  def add_sink(self, sink: InstrumentationSink) -> InstrumentationSink:
+    """
+    :return: sink, so it can be created and added in one line
+    """
+    with self._lock:
+      self.sinks = (*self.sinks, sink)
+    return sink
+
+  def remove_sink(self, sink: InstrumentationSink):
+    with self._lock:
+      self.sinks = tuple(s for s in self.sinks if s is not sink)
+
+  @contextmanager
+  def stage(self, name: str, **attributes) -> Iterator[dict]:
+    """
+    Times the body of the with statement as stage name. The stage is recorded with an error attribute if the body
+    raises.
+
+    :param attributes: attributes known when the stage starts, e.g. service
+    :return: the attributes, add to it anything learned during the stage, e.g. token usage
+    """
+    if not self.sinks:
+      yield attributes
+      return
+    token = _current_attributes.set(attributes)
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+      yield attributes
+    except BaseException as e:
+      attributes['error'] = type(e).__name__
+      raise
+    finally:
+      seconds = time.perf_counter() - start
+      _current_attributes.reset(token)
+      self.emit(StageEvent(name, started_at, seconds, attributes))
+
+  def record(self, name: str, seconds: float, **attributes):
+    """
+    Records a stage timed by the caller, for stages that do not fit in one with statement, e.g. a streamed response
+    parsed chunk by chunk
+    """
+    if self.sinks:
+      self.emit(StageEvent(name, time.time() - seconds, seconds, attributes))
+
+  def emit(self, event: StageEvent):
+    for sink in self.sinks:
+      sink.record(event)
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+def stage(name: str, **attributes):
+  """
+  Times a stage with the process wide instrumentation, see Instrumentation.stage
+  """
+  return INSTRUMENTATION.stage(name, **attributes)
+
+
+def record_stage(name: str, seconds: float, **attributes):
+  """
+  Records a stage timed by the caller with the process wide instrumentation, see Instrumentation.record
+  """
+  INSTRUMENTATION.record(name, seconds, **attributes)
+
+
+def annotate(**attributes):
+  """
+  Adds attributes to the innermost open stage, for code that does not own the stage, e.g. an output parser reporting
+  salvaged items. Does nothing outside a stage.
+  """
+  current = _current_attributes.get()
+  if current is not None:
+    current.update(attributes)
+
+
+@dataclass(frozen=True)
+class StageSummary:
+  stage: str
+  count: int
+  mean: float
+  p50: float
+  p95: float
+  p99: float
+  total: float
+  # sums of COUNTED_ATTRIBUTES
+  counters: dict[str, float]
+  # None if the stage never looks up a cache
+  cache_hit_rate: Optional[float]
+  errors: int
+
+
+class HistogramSink(InstrumentationSink):
+  """
+  Keeps every stage duration in memory, for percentiles of a benchmark or load test run
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._seconds: dict[str, list[float]] = defaultdict(list)
+    self._counters: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    self._cache_lookups: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+    self._errors: dict[str, int] = defaultdict(int)
+
+  def record(self, event: StageEvent):
+    with self._lock:
+      self._seconds[event.stage].append(event.seconds)
+      for name in COUNTED_ATTRIBUTES:
+        value = event.attributes.get(name)
+        if value is not None:
+          self._counters[event.stage][name] += value
+      if 'cache_hit' in event.attributes:
+        lookups = self._cache_lookups[event.stage]
+        lookups[0] += bool(event.attributes['cache_hit'])
+        lookups[1] += 1
+      if 'error' in event.attributes:
+        self._errors[event.stage] += 1
+
+  def stages(self) -> list[str]:
+    """
+    :return: stages recorded so far, pipeline stages in pipeline order first
+    """
+    with self._lock:
+      recorded = list(self._seconds)
+    return [name for name in STAGES if name in recorded] + sorted(name for name in recorded if name not in STAGES)
+
+  def durations(self, name: str) -> np.ndarray:
+    """
+    :return: seconds of every recorded run of stage name, in recording order
+    """
+    with self._lock:
+      return np.array(self._seconds.get(name, []))
+
+  def percentile(self, name: str, q: float) -> float:
+    """
+    :param q: percentile between 0 and 100
+    :return: seconds, nan if the stage was never recorded
+    """
+    durations = self.durations(name)
+    return float(np.percentile(durations, q)) if len(durations) else math.nan
+
+  def summary(self, name: str) -> StageSummary:
+    durations = self.durations(name)
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99]) if len(durations) else (math.nan,) * 3
+    with self._lock:
+      counters = dict(self._counters.get(name, {}))
+      hits, lookups = self._cache_lookups.get(name, (0, 0))
+      errors = self._errors.get(name, 0)
+    return StageSummary(
+      stage=name,
+      count=len(durations),
+      mean=float(durations.mean()) if len(durations) else math.nan,
+      p50=float(p50),
+      p95=float(p95),
+      p99=float(p99),
+      total=float(durations.sum()),
+      counters=counters,
+      cache_hit_rate=hits / lookups if lookups else None,
+      errors=errors
+    )
+
+  def dominant_stage(self, q: float = 95) -> Optional[str]:
+    """
+    :return: stage with the highest q-th percentile duration, None if nothing was recorded
+    """
+    return max(self.stages(), key=lambda name: self.percentile(name, q), default=None)
+
+  def format_summary(self) -> str:
+    """
+    :return: table of the percentiles, counters and cache hit rate of every stage
+    """
+    lines = [f"{'stage':<14}{'n':>6}{'mean':>11}{'p50':>11}{'p95':>11}{'p99':>11}{'total':>10}  other"]
+    for name in self.stages():
+      s = self.summary(name)
+      other = [f"{counter}={value:.0f}" for counter, value in s.counters.items()]
+      if s.cache_hit_rate is not None:
+        other.append(f"cache_hit_rate={s.cache_hit_rate:.0%}")
+      if s.errors:
+        other.append(f"errors={s.errors}")
+      lines.append(
+        f"{name:<14}{s.count:>6}{s.mean * 1000:>9.2f}ms{s.p50 * 1000:>9.2f}ms{s.p95 * 1000:>9.2f}ms"
+        f"{s.p99 * 1000:>9.2f}ms{s.total:>9.2f}s  {' '.join(other)}"
+      )
+    return "\n".join(lines)
+
+  def reset(self):
+    with self._lock:
+      self._seconds.clear()
+      self._counters.clear()
+      self._cache_lookups.clear()
+      self._errors.clear()
+
+
+class JsonLinesSink(InstrumentationSink):
+  """
+  Appends every stage event to a file as one json object per line
+  """
+  def __init__(self, path: Optional[str] = None, file: Optional[TextIO] = None):
+    """
+    :param path: file to append to, opened by the sink and closed by close
+    :param file: already open text file to write to instead, left open by close
+    """
+    if (path is None) == (file is None):
+      raise ValueError("JsonLinesSink needs exactly one of path or file")
+    self._owns_file = file is None
+    self.file = open(path, 'a', encoding='utf-8') if file is None else file
+    self._lock = threading.Lock()
+
+  def record(self, event: StageEvent):
+    line = json.dumps(event.to_dict(), default=str)
+    with self._lock:
+      self.file.write(line + "\n")
+      self.file.flush()
+
+  def close(self):
+    if self._owns_file:
+      self.file.close()
+
+
+def _escape_label(value: Any) -> str:
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels: Any) -> str:
+  return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+class PrometheusSink(InstrumentationSink):
+  """
+  Aggregates stage events into prometheus metrics, labelled by stage and service, served as text exposition format by
+  exposition
+  """
+  def __init__(self, namespace: str = 'photocircuit', buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+    """
+    :param namespace: prefix of every metric name
+    :param buckets: upper bounds in seconds of the duration histogram buckets, ascending
+    """
+    self.namespace = namespace
+    self.buckets = tuple(sorted(buckets))
+    self._lock = threading.Lock()
+    # (stage, service) -> (count per bucket, +Inf last, sum of seconds)
+    self._histograms: dict[tuple[str, str], tuple[list[int], list[float]]] = {}
+    # (metric, stage, service, extra label value) -> value
+    self._counters: dict[tuple[str, str, str, str], float] = defaultdict(float)
+
+  def record(self, event: StageEvent):
+    key = (event.stage, str(event.attributes.get('service', '')))
+    bucket = int(np.searchsorted(self.buckets, event.seconds))
+    with self._lock:
+      counts, total = self._histograms.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+      counts[bucket] += 1
+      total[0] += event.seconds
+      if event.attributes.get('payload_bytes') is not None:
+        self._counters[('payload_bytes_total', *key, '')] += event.attributes['payload_bytes']
+      for kind in ('prompt', 'completion'):
+        if event.attributes.get(f'{kind}_tokens') is not None:
+          self._counters[('llm_tokens_total', *key, kind)] += event.attributes[f'{kind}_tokens']
+      if 'cache_hit' in event.attributes:
+        self._counters[('cache_lookups_total', *key, 'hit' if event.attributes['cache_hit'] else 'miss')] += 1
+      if 'error' in event.attributes:
+        self._counters[('stage_errors_total', *key, '')] += 1
+
+  def exposition(self) -> str:
+    """
+    :return: every metric in prometheus text exposition format 0.0.4
+    """
+    with self._lock:
+      histograms = {key: (list(counts), total[0]) for key, (counts, total) in self._histograms.items()}
+      counters = dict(self._counters)
+
+    duration = f"{self.namespace}_stage_duration_seconds"
+    lines = [f"# HELP {duration} Duration of detection pipeline stages.", f"# TYPE {duration} histogram"]
+    for (stage_name, service), (counts, total) in sorted(histograms.items()):
+      cumulative = 0
+      for bound, count in zip((*self.buckets, math.inf), counts):
+        cumulative += count
+        le = '+Inf' if bound == math.inf else repr(float(bound))
+        lines.append(f"{duration}_bucket{_labels(stage=stage_name, service=service, le=le)} {cumulative}")
+      lines.append(f"{duration}_sum{_labels(stage=stage_name, service=service)} {total!r}")
+      lines.append(f"{duration}_count{_labels(stage=stage_name, service=service)} {cumulative}")
+
+    descriptions = {
+      'payload_bytes_total': ('Bytes of encoded images sent to the llm.', None),
+      'llm_tokens_total': ('Tokens used by llm requests.', 'kind'),
+      'cache_lookups_total': ('Llm response cache lookups.', 'result'),
+      'stage_errors_total': ('Stages that raised an error.', None),
+    }
+    for metric, (description, extra_label) in descriptions.items():
+      name = f"{self.namespace}_{metric}"
+      lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+      for (counter, stage_name, service, extra), value in sorted(counters.items()):
+        if counter == metric:
+          labels = {'stage': stage_name, 'service': service, **({extra_label: extra} if extra_label else {})}
+          lines.append(f"{name}{_labels(**labels)} {value!r}")
+    return "\n".join(lines) + "\n"
+
+  def write(self, path: str):
+    """
+    Writes the exposition to path atomically, e.g. for node_exporter's textfile collector
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+      f.write(self.exposition())
+    os.replace(tmp_path, path)
@@ -0,0 +1,49 @@
+import importlib
+import sys
+import threading
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+  """
+  Stand-in for a module that imports it on first attribute access, after which the attributes of the module are copied
+  onto the stand-in so later lookups cost the same as on the module itself.
+  """
+  def __init__(self, name: str):
+    super().__init__(name)
+    self._lazy_lock = threading.Lock()
+    self._lazy_module = None
+
+  def __getattr__(self, attr: str):
+    # only called for attributes not copied over yet, i.e. before the first import
+    with self._lazy_lock:
+      if self._lazy_module is None:
+        self._lazy_module = importlib.import_module(self.__name__)
+        self.__dict__.update(self._lazy_module.__dict__)
+    return getattr(self._lazy_module, attr)
+
+  def __repr__(self) -> str:
+    state = 'imported' if self._lazy_module is not None else 'not imported yet'
+    return f"<lazy module {self.__name__!r}, {state}>"
+
+
+def lazy_import(name: str) -> ModuleType:
+  """
+  Defers importing a heavy dependency until the code path that uses it runs, e.g. `cv2 = lazy_import('cv2')` at the
+  top of a module that only needs opencv inside its functions. Attributes of the module must not be used at import time
+  of the importing module, including in annotations, which should be strings instead.
+
+  :param name: absolute name of the module, e.g. 'PIL.Image'
+  :return: the module if it is imported already, otherwise a stand-in importing it on first use
+  """
+  module = sys.modules.get(name)
+  return module if module is not None else LazyModule(name)
+
+
+def preload(*names: str):
+  """
+  Imports modules deferred with lazy_import ahead of their first use, e.g. in the background once a server is
+  listening so its first request does not pay for them
+  """
+  for name in names:
+    importlib.import_module(name)
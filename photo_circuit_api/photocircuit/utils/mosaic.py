@@ -0,0 +1,92 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.utils.grid_renderer import label_glyph
+
+DEFAULT_CELL_SIZE = 96
+DEFAULT_CELL_PADDING = 6
+# crops are this much larger than the approximate size of a component, so the wires leaving it show its orientation
+DEFAULT_CROP_MARGIN = 1.3
+BACKGROUND = 255
+FRAME = 160
+LABEL = 0
+
+
+def crop_squares(image: np.ndarray, centers: np.ndarray, sizes: np.ndarray, cell_size: int) -> np.ndarray:
+  """
+  Crops a square around every center and resamples each to cell_size x cell_size, all in one gather.
+
+  :param image: (h, w) or (h, w, c) image
+  :param centers: (n, 2) x, y of the centers of the squares
+  :param sizes: (n,) side length of each square in pixels
+  :param cell_size: side length of each crop after resampling
+  :return: (n, cell_size, cell_size) or (n, cell_size, cell_size, c) crops, white outside the image
+  """
+  centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+  sizes = np.maximum(np.asarray(sizes, dtype=np.float64).reshape(-1), 1)
+  # nearest neighbour sample points of every crop, relative to its center
+  offsets = (np.arange(cell_size) + 0.5) / cell_size - 0.5
+  xs = np.floor(centers[:, 0, None] + offsets[None, :] * sizes[:, None]).astype(np.intp)
+  ys = np.floor(centers[:, 1, None] + offsets[None, :] * sizes[:, None]).astype(np.intp)
+
+  height, width = image.shape[:2]
+  crops = image[np.clip(ys, 0, height - 1)[:, :, None], np.clip(xs, 0, width - 1)[:, None, :]]
+  outside = ((ys < 0) | (ys >= height))[:, :, None] | ((xs < 0) | (xs >= width))[:, None, :]
+  crops[outside] = BACKGROUND
+  return crops
+
+
+def tile_mosaic(
+    crops: np.ndarray,
+    labels: list[str],
+    columns: Optional[int] = None,
+    padding: int = DEFAULT_CELL_PADDING
+) -> np.ndarray:
+  """
+  Lays crops out row by row in a grid of framed cells, each crop under its label.
+
+  :param crops: (n, h, w) or (n, h, w, c) equally sized crops
+  :param labels: text written above each crop
+  :param columns: cells per row, defaults to a roughly square mosaic
+  :param padding: space around each crop and its label in pixels
+  :return: mosaic image
+  """
+  n, crop_h, crop_w = crops.shape[:3]
+  channels = crops.shape[3:]
+  columns = columns or math.ceil(math.sqrt(n))
+  rows = math.ceil(n / columns)
+  glyphs = [label_glyph(label) for label in labels]
+  label_h = max(glyph.shape[0] for glyph in glyphs) + padding
+  cell_h, cell_w = label_h + crop_h + 2 * padding, crop_w + 2 * padding
+
+  cells = np.full((rows * columns, cell_h, cell_w) + channels, BACKGROUND, dtype=np.uint8)
+  cells[:n, label_h + padding:label_h + padding + crop_h, padding:padding + crop_w] = crops
+  cells[:, [0, -1]] = FRAME
+  cells[:, :, [0, -1]] = FRAME
+  for cell, glyph in zip(cells, glyphs):
+    h, w = glyph.shape
+    cell[padding:padding + h, padding:padding + w][glyph] = LABEL
+
+  return cells.reshape((rows, columns, cell_h, cell_w) + channels) \
+    .swapaxes(1, 2) \
+    .reshape((rows * cell_h, columns * cell_w) + channels)
+
+
+def component_mosaic(
+    image: np.ndarray,
+    centers: np.ndarray,
+    sizes: np.ndarray,
+    labels: list[str],
+    cell_size: int = DEFAULT_CELL_SIZE,
+    crop_margin: float = DEFAULT_CROP_MARGIN
+) -> np.ndarray:
+  """
+  :param image: image the components are in
+  :param centers: (n, 2) x, y of each component
+  :param sizes: (n,) approximate size of each component
+  :param labels: text written above each component's crop
+  :return: mosaic of every component cropped from image, see tile_mosaic
+  """
+  return tile_mosaic(crop_squares(image, centers, np.asarray(sizes) * crop_margin, cell_size), labels)
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class PackedBin:
+  # indices of the rectangles packed into this bin
+  indices: list[int]
+  # (len(indices), 2) x, y of the top left corner of each rectangle
+  offsets: np.ndarray
+  width: int
+  height: int
+
+
+@dataclass
+class _Shelf:
+  bin: int
+  y: int
+  height: int
+  used_width: int
+
+
+def shelf_pack(sizes: np.ndarray, max_width: int, max_height: int, gap: int = 0) -> list[PackedBin]:
+  """
+  Packs rectangles into as few max_width x max_height bins as first fit decreasing height shelf packing manages.
+
+  Rectangles are placed tallest first, left to right on horizontal shelves. Each rectangle goes on the first shelf of
+  any bin with room for it, otherwise on a new shelf under the last one of the first bin with room for that, otherwise
+  in a new bin. A rectangle larger than a bin gets a bin of its own, sized to fit it.
+
+  :param sizes: (n, 2) width, height of each rectangle
+  :param max_width: width of a bin
+  :param max_height: height of a bin
+  :param gap: space left between neighbouring rectangles
+  :return: bins in the order they were opened, each trimmed to the extent of its rectangles
+  """
+  sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+  # tallest first, widest first among equally tall ones
+  order = np.lexsort((-sizes[:, 0], -sizes[:, 1]))
+  shelves: list[_Shelf] = []
+  bin_heights: list[int] = []
+  placements: list[list[tuple[int, int, int]]] = []
+
+  for index in order.tolist():
+    w, h = sizes[index].tolist()
+    if w > max_width or h > max_height:
+      bin_heights.append(max_height)
+      placements.append([(index, 0, 0)])
+      continue
+
+    shelf = next(
+      (s for s in shelves if s.height >= h and s.used_width + gap + w <= max_width),
+      None
+    )
+    if shelf is None:
+      bin_index = next((b for b, used in enumerate(bin_heights) if used + gap + h <= max_height), None)
+      if bin_index is None:
+        bin_heights.append(-gap)
+        placements.append([])
+        bin_index = len(bin_heights) - 1
+      shelf = _Shelf(bin=bin_index, y=bin_heights[bin_index] + gap, height=h, used_width=-gap)
+      shelves.append(shelf)
+      bin_heights[bin_index] = shelf.y + h
+
+    x = shelf.used_width + gap
+    placements[shelf.bin].append((index, x, shelf.y))
+    shelf.used_width = x + w
+
+  bins = []
+  for placed in placements:
+    indices = [index for index, _, _ in placed]
+    offsets = np.array([(x, y) for _, x, y in placed], dtype=np.int64)
+    extents = offsets + sizes[indices]
+    bins.append(PackedBin(
+      indices=indices,
+      offsets=offsets,
+      width=int(extents[:, 0].max()),
+      height=int(extents[:, 1].max())
+    ))
+  return bins
@@ -0,0 +1,69 @@
+"""
+Compares the native grid renderer against the matplotlib implementation it replaced.
+
+run from photo_circuit_api/ with: python -m test.benchmark.grid_renderer
+"""
+import base64
+from io import BytesIO
+
+import cv2
+import matplotlib
+import numpy as np
+from PIL import Image
+from matplotlib import pyplot as plt
+
+from photocircuit.utils.prompt_utils import generate_image_with_grid_base64
+from test.benchmark.utils import load_raw_circuit_images, time_calls, format_timings
+
+matplotlib.use('Agg')
+
+STEP_SIZE = 50
+REPEATS = 3
+
+
+def matplotlib_image_with_grid_base64(input_base64: str, step_size: int, include_grid: bool = True) -> str:
+  """
+  Original matplotlib based implementation of generate_image_with_grid_base64, kept only as the benchmark baseline.
+  The original called cvtColor(RGB2BGR) unconditionally, which fails on the grayscale test images, so those are
+  expanded to 3 channels first.
+  """
+  image_data = base64.b64decode(input_base64)
+  image = Image.open(BytesIO(image_data))
+  image_array = np.array(image)
+  if image_array.ndim == 2:
+    image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2BGR)
+  else:
+    image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+  fig, ax = plt.subplots()
+  ax.imshow(image_array)
+  ax.set_xticks(np.arange(0, image_array.shape[1], step_size))
+  ax.set_yticks(np.arange(0, image_array.shape[0], step_size))
+  if include_grid:
+    ax.grid(which='both', color='gray', linestyle='-', linewidth=0.5)
+  ax.set_xticklabels(np.arange(0, image_array.shape[1], step_size))
+  ax.set_yticklabels(np.arange(0, image_array.shape[0], step_size))
+  buf = BytesIO()
+  plt.savefig(buf, format='png')
+  plt.close(fig)
+  buf.seek(0)
+  return base64.b64encode(buf.read()).decode('utf-8')
+
+
+def main():
+  raw_images = load_raw_circuit_images()
+  inputs = [(img, STEP_SIZE) for img in raw_images.values()]
+  print(f"benchmarking grid rendering on {len(inputs)} images from test_data/circuits_raw")
+  
+  # warm up font / layout caches so steady state is measured
+  generate_image_with_grid_base64(*inputs[0])
+  matplotlib_image_with_grid_base64(*inputs[0])
+  
+  native = time_calls(generate_image_with_grid_base64, inputs, REPEATS)
+  legacy = time_calls(matplotlib_image_with_grid_base64, inputs, REPEATS)
+  print(format_timings("native (cv2/numpy)", native))
+  print(format_timings("matplotlib", legacy))
+  print(f"speedup: {legacy.mean() / native.mean():.1f}x")
+
+
+if __name__ == '__main__':
+  main()
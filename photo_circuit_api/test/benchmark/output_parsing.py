@@ -0,0 +1,72 @@
+"""
+Parse time per llm response of langchain's YamlOutputParser against FastOutputParser, and how many responses each
+recovers from output cut off by max_tokens.
+
+Responses are built from the labelled components of every test circuit, so their sizes match real responses.
+
+run from photo_circuit_api/ with: python -m test.benchmark.output_parsing
+"""
+import json
+
+import yaml
+from langchain.output_parsers import YamlOutputParser
+from langchain_core.exceptions import OutputParserException
+
+from photocircuit.component_detection.fast_output_parser import FastOutputParser
+from photocircuit.component_detection.model import SizedCircuitComponents
+from test.benchmark.utils import time_calls, format_timings
+from test.stub_llm.server import load_synthetic_circuits
+
+REPEATS = 20
+# fraction of each response kept when simulating truncated output
+TRUNCATED_FRACTION = 0.7
+
+
+def responses() -> tuple[list[str], list[str]]:
+  """
+  :return: (yaml responses as the yaml prompt asks for them, the same responses as json)
+  """
+  outputs = [
+    {'sized_components': [dict(comp, positive_input_direction_reasoning="the plus sign is above") for comp in circuit]}
+    for circuit in load_synthetic_circuits()
+  ]
+  return (
+    [f"```yaml\n{yaml.safe_dump(output, sort_keys=False)}```" for output in outputs],
+    [json.dumps(output) for output in outputs]
+  )
+
+
+def recovered(parser, texts: list[str]) -> int:
+  count = 0
+  for text in texts:
+    try:
+      parser.parse(text)
+      count += 1
+    except OutputParserException:
+      pass
+  return count
+
+
+def main():
+  yaml_texts, json_texts = responses()
+  yaml_parser = YamlOutputParser(pydantic_object=SizedCircuitComponents)
+  fast_parser = FastOutputParser(pydantic_object=SizedCircuitComponents)
+  print(f"{len(json_texts)} responses, mean {sum(map(len, json_texts)) / len(json_texts):.0f} characters of json")
+
+  for name, parser, texts in [
+    ('YamlOutputParser yaml', yaml_parser, yaml_texts),
+    ('FastOutputParser json', fast_parser, json_texts),
+    ('FastOutputParser yaml', fast_parser, yaml_texts),
+  ]:
+    print(format_timings(name, time_calls(parser.parse, [(text,) for text in texts], REPEATS)))
+
+  truncated_yaml = [text[:int(len(text) * TRUNCATED_FRACTION)] for text in yaml_texts]
+  truncated_json = [text[:int(len(text) * TRUNCATED_FRACTION)] for text in json_texts]
+  print(f"\nresponses cut off at {TRUNCATED_FRACTION:.0%}:")
+  print(f"YamlOutputParser yaml recovered {recovered(yaml_parser, truncated_yaml)}/{len(truncated_yaml)}")
+  print(f"FastOutputParser json recovered {recovered(fast_parser, truncated_json)}/{len(truncated_json)}")
+  print(format_timings('FastOutputParser salvage', time_calls(fast_parser.parse, [(t,) for t in truncated_json], 5)))
+
+
+if __name__ == '__main__':
+  main()
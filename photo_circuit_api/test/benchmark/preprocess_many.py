@@ -0,0 +1,47 @@
+"""
+Throughput of preprocess_many with an increasing number of worker processes.
+
+The test circuits are small crops, so they are upscaled to roughly the size of a scanned page first.
+
+run from photo_circuit_api/ with: python -m test.benchmark.preprocess_many
+"""
+import os
+import time
+
+import cv2
+
+from photocircuit.preprocessing.composite_preprocessing_service import CompositePreprocessingService
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.preprocessing.thickness_preprocessing_service import ThicknessPreprocessingService
+from photocircuit.utils.circuit_image import CircuitImage
+from test.benchmark.utils import load_raw_circuit_images
+
+PAGE_SCALE = 5
+
+
+def main():
+  pages = [
+    cv2.resize(CircuitImage.from_base64(img).array, (0, 0), fx=PAGE_SCALE, fy=PAGE_SCALE)
+    for img in load_raw_circuit_images().values()
+  ]
+  service = CompositePreprocessingService(ThicknessPreprocessingService(), ScalingPreprocessingService())
+  print(f"preprocessing {len(pages)} pages of ~{pages[0].shape[1]}x{pages[0].shape[0]}px on {os.cpu_count()} cpus")
+  
+  start = time.perf_counter()
+  for page in pages:
+    service.preprocess_image(page)
+  serial = time.perf_counter() - start
+  print(f"serial:     {len(pages) / serial:7.1f} images/s")
+  
+  workers = 1
+  while workers <= (os.cpu_count() or 1):
+    start = time.perf_counter()
+    for _ in service.preprocess_many(pages, max_workers=workers, ordered=False):
+      pass
+    elapsed = time.perf_counter() - start
+    print(f"{workers:2d} workers: {len(pages) / elapsed:7.1f} images/s ({serial / elapsed:.2f}x serial)")
+    workers *= 2
+
+
+if __name__ == '__main__':
+  main()
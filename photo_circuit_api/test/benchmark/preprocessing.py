@@ -0,0 +1,59 @@
+"""
+Compares fused execution of CompositePreprocessingService chains against running each step on its own.
+
+run from photo_circuit_api/ with: python -m test.benchmark.preprocessing
+"""
+import tracemalloc
+
+import numpy as np
+
+from photocircuit.preprocessing.composite_preprocessing_service import CompositePreprocessingService
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.preprocessing.thickness_preprocessing_service import ThicknessPreprocessingService
+from photocircuit.utils.circuit_image import CircuitImage
+from test.benchmark.utils import load_raw_circuit_images, time_calls, format_timings
+
+REPEATS = 3
+
+
+def peak_memory(fn, inputs) -> int:
+  """
+  :return: max bytes allocated above the baseline during any single call
+  """
+  peak = 0
+  for args in inputs:
+    tracemalloc.start()
+    fn(*args)
+    peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+  return peak
+
+
+def main():
+  images = [(CircuitImage.from_base64(img).array,) for img in load_raw_circuit_images().values()]
+  rgb_images = [(np.stack([img] * 3, axis=2),) for img, in images]
+  chains = {
+    'scaling -> thickness': CompositePreprocessingService(ScalingPreprocessingService(), ThicknessPreprocessingService()),
+    'thickness -> scaling': CompositePreprocessingService(ThicknessPreprocessingService(), ScalingPreprocessingService()),
+    'thickness -> scaling -> thickness': CompositePreprocessingService(
+      ThicknessPreprocessingService(), ScalingPreprocessingService(), ThicknessPreprocessingService()
+    ),
+  }
+  for input_name, inputs in (('grayscale', images), ('rgb', rgb_images)):
+    print(f"# {len(inputs)} {input_name} images from test_data/circuits_raw")
+    for name, chain in chains.items():
+      # warm up, the first fused call also builds the plan and allocates scratch buffers
+      time_calls(chain.preprocess_image_unfused, inputs)
+      time_calls(chain.preprocess_image, inputs)
+      unfused = time_calls(chain.preprocess_image_unfused, inputs, REPEATS)
+      fused = time_calls(chain.preprocess_image, inputs, REPEATS)
+      unfused_peak = peak_memory(chain.preprocess_image_unfused, inputs)
+      fused_peak = peak_memory(chain.preprocess_image, inputs)
+      print(name)
+      print("  " + format_timings("unfused", unfused) + f" peak={unfused_peak / 2 ** 20:6.2f}MiB")
+      print("  " + format_timings("fused", fused) + f" peak={fused_peak / 2 ** 20:6.2f}MiB")
+      print(f"  speedup: {unfused.mean() / fused.mean():.2f}x, peak memory: {fused_peak / unfused_peak:.2f}x")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,88 @@
+"""
+Html report of a large detection run.
+
+Every synthetic circuit shares its test image with the other circuits of the same raw image and gets a result image
+of its own, like a real run. Memory is traced while the report is written and sampled every tenth of the run, it
+should stay flat however many circuits are rendered. The report and its images go to a temporary directory unless
+--output is given.
+
+run from photo_circuit_api/ with: python -m test.benchmark.report --circuits 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Iterator
+
+import numpy as np
+
+from photocircuit.utils.circuit_image import CircuitImage
+from test.benchmark.utils import load_raw_circuit_images
+from test.report.model import CircuitResult
+from test.report.report import generate_report, ASSETS_DIR_NAME
+
+
+def synthetic_results(count: int, samples: list[tuple[int, int]]) -> Iterator[CircuitResult]:
+  """
+  :param samples: receives (circuits produced, traced bytes) every tenth of the run
+  """
+  test_images = [CircuitImage.from_base64(image) for image in load_raw_circuit_images().values()]
+  # decoded up front, so the samples only show what the report holds on to
+  for image in test_images:
+    image.array
+  oriented_img = CircuitImage.from_array(np.full((120, 160, 3), 255, dtype=np.uint8))
+  for i in range(count):
+    if i % max(1, count // 10) == 0:
+      samples.append((i, tracemalloc.get_traced_memory()[0]))
+    test_image = test_images[i % len(test_images)]
+    result = test_image.array.copy()
+    height, width = result.shape[:2]
+    # a mark no other circuit has, so every result image is stored
+    result[i % height, :(i // height) % width + 1] = 0
+    yield CircuitResult(
+      circuit_id=f'circuit-{i:05d}',
+      test_image=test_image,
+      result_image=CircuitImage.from_array(result),
+      oriented_img=oriented_img,
+      avg_error=f'{i % 100 / 10:.2f}'
+    )
+
+
+def directory_size(path: str) -> tuple[int, int]:
+  """
+  :return: number of files and their total size in bytes under path
+  """
+  files, size = 0, 0
+  for root, _, names in os.walk(path):
+    files += len(names)
+    size += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+  return files, size
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--circuits', type=int, default=10000)
+  parser.add_argument('--output', help='report file, defaults to a temporary directory that is removed afterwards')
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    path = args.output or os.path.join(tmp_dir, 'report.html')
+    samples = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    stats = generate_report(synthetic_results(args.circuits, samples), path=path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    files, assets_size = directory_size(os.path.join(os.path.dirname(path), ASSETS_DIR_NAME))
+    print(f"{stats.circuits} circuits in {elapsed:.1f}s, {elapsed / stats.circuits * 1000:.2f}ms per circuit")
+    print(f"report {os.path.getsize(path) / 2 ** 20:.1f}MB, {files} image files {assets_size / 2 ** 20:.1f}MB")
+    print(f"peak traced memory {peak / 2 ** 20:.1f}MB")
+    for circuits, traced in samples:
+      print(f"  after {circuits:>6} circuits {traced / 2 ** 20:8.2f}MB")
+
+
+if __name__ == '__main__':
+  main()
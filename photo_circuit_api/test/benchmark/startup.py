@@ -0,0 +1,155 @@
+"""
+Cold start of the photocircuit package and of its http server.
+
+Import time of every entry point is measured with python -X importtime in a fresh interpreter, along with the heavy
+dependencies importing it pulls in. Time to first request launches the server against the stub llm server and measures
+from starting the process until the first /detect upload is answered, which is what an autoscaled worker pays before
+it is useful.
+
+run from photo_circuit_api/ with: python -m test.benchmark.startup --budget 6
+"""
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+
+import numpy as np
+
+from test.benchmark.utils import load_raw_circuit_images
+from test.stub_llm.server import StubLlmServer
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENTRY_POINTS = (
+  'photocircuit.photocircuit',
+  'photocircuit.main',
+  'photocircuit.jobs.job_service',
+  'photocircuit.preprocessing.scaling_preprocessing_service',
+  'photocircuit.component_detection.llm_component_detection_service',
+)
+# heavy dependencies that are only imported by the code paths using them, never by importing an entry point
+DEFERRED_MODULES = ('langchain', 'langchain_openai', 'openai', 'cv2', 'PIL', 'matplotlib', 'pandas')
+# seconds from launching the server until its first detection is answered, see test/test_startup.py
+DEFAULT_BUDGET_SECONDS = 6.0
+
+
+@dataclass(frozen=True)
+class ImportTime:
+  module: str
+  self_seconds: float
+  cumulative_seconds: float
+  # 0 for the module imported directly, 1 for the modules it imports, ...
+  depth: int
+
+
+def import_times(module: str) -> list[ImportTime]:
+  """
+  :return: every module imported by importing module in a fresh interpreter, in the order -X importtime reports them
+  """
+  completed = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+    cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+  )
+  times = []
+  for line in completed.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    times.append(ImportTime(
+      module=name.strip(),
+      self_seconds=int(self_us) / 1e6,
+      cumulative_seconds=int(cumulative_us) / 1e6,
+      depth=(len(name) - len(name.lstrip()) - 1) // 2
+    ))
+  return times
+
+
+def total_seconds(times: list[ImportTime]) -> float:
+  return sum(entry.cumulative_seconds for entry in times if entry.depth == 0)
+
+
+def deferred_imports(times: list[ImportTime]) -> list[str]:
+  """
+  :return: DEFERRED_MODULES imported in times
+  """
+  imported = {entry.module.split('.')[0] for entry in times}
+  return [name for name in DEFERRED_MODULES if name in imported]
+
+
+def free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+
+def time_to_first_request(service: str = 'llm', timeout: float = 60) -> float:
+  """
+  Launches the server with no llm response cache against a stub llm server
+
+  :param service: --service of the server
+  :return: seconds from launching the server until its first /detect upload is answered
+  """
+  upload = base64.b64decode(next(iter(load_raw_circuit_images().values())))
+  port = free_port()
+  with StubLlmServer() as stub:
+    env = {**os.environ, 'OPENAI_BASE_URL': stub.base_url, 'OPENAI_API_KEY': 'stub'}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+      [sys.executable, '-m', 'photocircuit.main', '--port', str(port), '--service', service, '--no-cache'],
+      cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+      while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+          raise RuntimeError(f"server exited with {server.returncode} before answering")
+        try:
+          with urllib.request.urlopen(f"http://127.0.0.1:{port}/detect", data=upload, timeout=timeout) as response:
+            response.read()
+          return time.perf_counter() - start
+        except urllib.error.URLError as e:
+          if isinstance(e, urllib.error.HTTPError):
+            raise
+          time.sleep(0.01)
+      raise TimeoutError(f"server did not answer within {timeout}s")
+    finally:
+      server.terminate()
+      server.wait()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--top', type=int, default=10, help="slowest imports listed for photocircuit.main")
+  parser.add_argument('--service', choices=('llm', 'multistage'), default='llm')
+  parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_SECONDS,
+                      help="exit with status 1 if the median time to first request is over this many seconds")
+  args = parser.parse_args()
+
+  for module in ENTRY_POINTS:
+    totals = []
+    for _ in range(args.repeats):
+      times = import_times(module)
+      totals.append(total_seconds(times))
+    deferred = ', '.join(deferred_imports(times)) or '-'
+    print(f"import {module:<66} median={np.median(totals) * 1000:7.1f}ms  heavy: {deferred}")
+
+  print("\nslowest imports of photocircuit.main")
+  times = [entry for entry in import_times('photocircuit.main') if entry.depth <= 2]
+  for entry in sorted(times, key=lambda entry: entry.cumulative_seconds, reverse=True)[:args.top]:
+    print(f"  {entry.cumulative_seconds * 1000:7.1f}ms  {'  ' * entry.depth}{entry.module}")
+
+  first_requests = np.array([time_to_first_request(args.service) for _ in range(args.repeats)])
+  median = np.median(first_requests)
+  print(f"\ntime to first request: median={median:.2f}s max={first_requests.max():.2f}s budget={args.budget:.2f}s")
+  if median > args.budget:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,34 @@
+"""
+Accuracy and latency of the template matching detector on the labelled test circuits.
+
+run from photo_circuit_api/ with: python -m test.benchmark.template_detection
+"""
+from photocircuit.component_detection.template_component_detection_service import TemplateComponentDetectionService
+from photocircuit.evaluation.scoring import score_detections
+from test.benchmark.utils import time_calls, format_timings
+from test.test_utils import load_circuit_images_with_components
+
+THRESHOLDS = (0.65, 0.7, 0.75, 0.8)
+
+
+def main():
+  raw_images, circuits_components = load_circuit_images_with_components()
+  circuit_ids = sorted(set(raw_images) & set(circuits_components))
+  # decode up front so only detection is timed
+  images = [raw_images[circuit_id] for circuit_id in circuit_ids]
+  for image in images:
+    image.array
+  
+  for threshold in THRESHOLDS:
+    service = TemplateComponentDetectionService(threshold=threshold)
+    print(f"\n## threshold={threshold} ({len(service.variants)} template variants)")
+    print(format_timings('label_components', time_calls(service.label_components, [(img,) for img in images], 3)))
+    scores = score_detections(
+      [(circuits_components[circuit_id], service.label_components(img)) for circuit_id, img in zip(circuit_ids, images)]
+    )
+    print(scores.summary())
+    print(f"predicted {scores.num_predicted.sum()} components, labelled {scores.num_ground_truth.sum()}")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,40 @@
+import base64
+import os
+import time
+from typing import Callable, Iterable
+
+import numpy as np
+
+
+def load_raw_circuit_images() -> dict[str, str]:
+  """
+  :return: dict of circuit_id to base64 png for every image in test_data/circuits_raw
+  """
+  images_path = os.path.dirname(os.path.abspath(__file__)) + "/../test_data/circuits_raw"
+  raw_images = {}
+  for filename in sorted(os.listdir(images_path)):
+    if filename.endswith(".png"):
+      with open(os.path.join(images_path, filename), "rb") as image_file:
+        raw_images[filename.split('.')[0]] = base64.b64encode(image_file.read()).decode('utf-8')
+  return raw_images
+
+
+def time_calls(fn: Callable, inputs: Iterable, repeats: int = 1) -> np.ndarray:
+  """
+  :return: wall time in seconds of every call of fn, one entry per input per repeat
+  """
+  timings = []
+  for _ in range(repeats):
+    for args in inputs:
+      start = time.perf_counter()
+      fn(*args)
+      timings.append(time.perf_counter() - start)
+  return np.array(timings)
+
+
+def format_timings(name: str, timings: np.ndarray) -> str:
+  p50, p95 = np.percentile(timings, [50, 95]) * 1000
+  return (
+    f"{name:<24} n={len(timings):<5} mean={timings.mean() * 1000:8.2f}ms "
+    f"p50={p50:8.2f}ms p95={p95:8.2f}ms total={timings.sum():7.2f}s"
+  )
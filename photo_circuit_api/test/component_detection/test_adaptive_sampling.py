@@ -0,0 +1,84 @@
+import asyncio
+import os
+import unittest
+from typing import Awaitable, Callable
+from unittest import mock
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from photocircuit.component_detection.adaptive_sampling import AdaptiveSampler
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentName, ComponentPosition
+from photocircuit.utils.circuit_image import CircuitImage
+from test.component_detection.utils import sample
+
+
+def drawer(samples: list) -> tuple[Callable[[int], Awaitable[list]], list[int]]:
+  """
+  :return: draw function returning the given samples in order, and the sizes of the batches it was asked for
+  """
+  remaining = iter(samples)
+  batches = []
+
+  async def draw(num_samples: int) -> list:
+    batches.append(num_samples)
+    return [next(remaining) for _ in range(num_samples)]
+
+  return draw, batches
+
+
+class AdaptiveSamplerTest(unittest.TestCase):
+  def test_agreeing_samples_stop_after_min_samples(self):
+    draw, batches = drawer([sample((ComponentName.RESISTOR, 100, 100), (ComponentName.CAPACITOR, 300, 50))] * 9)
+    result = asyncio.run(AdaptiveSampler().asample(draw, 50))
+    self.assertEqual(batches, [3])
+    self.assertEqual((result.calls, result.failed, result.converged), (3, 0, True))
+    self.assertEqual([comp.votes for comp in result.consensus.sized_components], [3, 3])
+
+  def test_disagreeing_samples_run_to_max_samples(self):
+    # the resistor drifts further right with every sample, so its median keeps moving
+    samples = [sample((ComponentName.RESISTOR, 100 + 8 * i, 100), size=100) for i in range(9)]
+    draw, batches = drawer(samples)
+    result = asyncio.run(AdaptiveSampler(max_samples=8).asample(draw, 50))
+    self.assertEqual(sum(batches), 8)
+    self.assertEqual(batches[0], 3)
+    self.assertEqual((result.calls, result.converged), (8, False))
+
+  def test_failed_samples_count_as_calls(self):
+    error = ValueError("unparseable output")
+    comps = CircuitComponents(components=[
+      Component(
+        position=ComponentPosition(x=10, y=10), component_name=ComponentName.INDUCTOR, positive_input_direction=0, id="L1"
+      )
+    ])
+    draw, _ = drawer([error, comps, comps, comps, comps])
+    result = asyncio.run(AdaptiveSampler().asample(draw, 50))
+    self.assertEqual((result.calls, result.failed, result.converged), (5, 1, True))
+    # components without a size are merged at the grid spacing
+    self.assertEqual([comp.approximate_size for comp in result.consensus.sized_components], [50])
+
+    draw, _ = drawer([error] * 9)
+    with self.assertRaises(ValueError):
+      asyncio.run(AdaptiveSampler().asample(draw, 50))
+
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_service_prepares_image_once(self):
+    service = LlmComponentDetectionService()
+    comps = CircuitComponents(components=[
+      Component(
+        position=ComponentPosition(x=50, y=50), component_name=ComponentName.RESISTOR, positive_input_direction=0, id="R1"
+      )
+    ])
+    service.output_llm = mock.Mock()
+    service.output_llm.ainvoke = mock.AsyncMock(return_value=AIMessage(content=comps.json()))
+    image = CircuitImage.from_array(np.full((100, 100), 255, dtype=np.uint8))
+    with mock.patch.object(service, '_prepare', wraps=service._prepare) as prepare:
+      result = service.label_components_adaptive(image, 50)
+    prepare.assert_called_once()
+    self.assertEqual(service.output_llm.ainvoke.await_count, 3)
+    self.assertEqual(result.calls, 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
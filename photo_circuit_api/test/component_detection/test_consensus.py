@@ -0,0 +1,71 @@
+import asyncio
+import os
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from photocircuit.component_detection.consensus import consensus_merge
+from photocircuit.component_detection.model import ComponentName
+from photocircuit.component_detection.multistage_llm_component_detection_service import \
+  MultistageLlmComponentDetectionService
+from photocircuit.utils.circuit_image import CircuitImage
+from test.component_detection.utils import sample
+
+
+class ConsensusMergeTest(unittest.TestCase):
+  def test_keeps_components_most_samples_agree_on(self):
+    samples = [
+      sample((ComponentName.RESISTOR, 100, 100), (ComponentName.RESISTOR, 130, 100), (ComponentName.CAPACITOR, 300, 50)),
+      sample((ComponentName.RESISTOR, 104, 98), (ComponentName.RESISTOR, 128, 103), direction=90),
+      # the capacitor is only seen by one sample, the inductor is a hallucination
+      sample((ComponentName.RESISTOR, 98, 101), (ComponentName.RESISTOR, 133, 99), (ComponentName.INDUCTOR, 10, 10)),
+    ]
+    consensus = consensus_merge(samples)
+    self.assertEqual(consensus.samples, 3)
+    found = sorted((comp.position.x, comp.votes) for comp in consensus.sized_components)
+    # two resistors 30px apart stay two components, each sample votes for each of them once
+    self.assertEqual(found, [(100, 3), (130, 3)])
+    self.assertEqual([comp.positive_input_direction for comp in consensus.sized_components], [0, 0])
+    self.assertEqual(sorted(comp.id for comp in consensus.sized_components), ['R1', 'R2'])
+    
+    self.assertEqual(len(consensus_merge(samples, min_votes=1).sized_components), 4)
+  
+  def test_merge_scales_with_samples_and_components(self):
+    rng = np.random.default_rng(0)
+    truth = [(ComponentName.RESISTOR, int(x), int(y)) for x, y in rng.integers(0, 4000, (100, 2))]
+    samples = [
+      sample(*((name, x + int(rng.integers(-5, 5)), y + int(rng.integers(-5, 5))) for name, x, y in truth))
+      for _ in range(20)
+    ]
+    start = time.perf_counter()
+    consensus = consensus_merge(samples)
+    self.assertLess(time.perf_counter() - start, 2)
+    self.assertEqual(len(consensus.sized_components), len({(x, y) for _, x, y in truth}))
+
+
+class ConsensusSamplingTest(unittest.TestCase):
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_samples_are_concurrent_and_image_prepared_once(self):
+    service = MultistageLlmComponentDetectionService()
+    
+    async def slow_sample(messages):
+      await asyncio.sleep(0.2)
+      return AIMessage(content=sample((ComponentName.RESISTOR, 50, 50)).json())
+    
+    service.output_llm = mock.Mock()
+    service.output_llm.ainvoke = mock.AsyncMock(side_effect=slow_sample)
+    image = CircuitImage.from_array(np.full((100, 100), 255, dtype=np.uint8))
+    with mock.patch.object(service, '_prepare', wraps=service._prepare) as prepare:
+      start = time.perf_counter()
+      consensus = service.get_consensus_components(image, 50, samples=5)
+      self.assertLess(time.perf_counter() - start, 0.2 * 5 / 2)
+    prepare.assert_called_once()
+    self.assertEqual(service.output_llm.ainvoke.await_count, 5)
+    self.assertEqual([comp.votes for comp in consensus.sized_components], [5])
+
+
+if __name__ == '__main__':
+  unittest.main()
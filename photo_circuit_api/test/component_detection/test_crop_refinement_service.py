@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from photocircuit.component_detection.model import (
+  ComponentName, ComponentPosition, RefinedCircuitComponents, RefinedComponent, SizedCircuitComponents, SizedComponent
+)
+from photocircuit.component_detection.multistage_llm_component_detection_service import \
+  MultistageLlmComponentDetectionService
+from photocircuit.utils.circuit_image import CircuitImage
+
+
+class CropRefinementTest(unittest.TestCase):
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_twenty_components_take_two_requests(self):
+    service = MultistageLlmComponentDetectionService()
+    positioned = SizedCircuitComponents(sized_components=[
+      SizedComponent(
+        position=ComponentPosition(x=50 + 100 * (i % 5), y=50 + 100 * (i // 5)),
+        component_name=ComponentName.RESISTOR,
+        positive_input_direction=0,
+        id=f"R{i + 1}",
+        approximate_size=60
+      )
+      for i in range(20)
+    ])
+    # the second look finds the first crop is a capacitor pointing up, and skips the last crop
+    refined = RefinedCircuitComponents(refined_components=[
+      RefinedComponent(crop=1, component_name=ComponentName.CAPACITOR, positive_input_direction=90)
+    ] + [
+      RefinedComponent(crop=crop, component_name=ComponentName.RESISTOR, positive_input_direction=0)
+      for crop in range(2, 20)
+    ])
+    service.output_llm = mock.Mock()
+    service.output_llm.invoke = mock.Mock(return_value=AIMessage(content=positioned.json()))
+    service.crop_refinement_service.output_llm = mock.Mock()
+    service.crop_refinement_service.output_llm.invoke = mock.Mock(return_value=AIMessage(content=refined.json()))
+
+    image = CircuitImage.from_array(np.full((400, 500), 255, dtype=np.uint8))
+    components = service.label_components(image, 50).components
+
+    service.output_llm.invoke.assert_called_once()
+    service.crop_refinement_service.output_llm.invoke.assert_called_once()
+    messages = service.crop_refinement_service.output_llm.invoke.call_args.args[0]
+    self.assertIn('crop: 20', messages[1].content[1]['text'])
+    self.assertEqual(len(components), 20)
+    capacitor, = [comp for comp in components if comp.component_name == ComponentName.CAPACITOR]
+    self.assertEqual((capacitor.id, capacitor.position.x, capacitor.position.y), ('C1', 50, 50))
+    self.assertEqual(capacitor.positive_input_direction, 90)
+    self.assertEqual(sorted(comp.id for comp in components if comp.id.startswith('R')),
+                     sorted(f"R{i}" for i in range(1, 20)))
+
+
+if __name__ == '__main__':
+  unittest.main()
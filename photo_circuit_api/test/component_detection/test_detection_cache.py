@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from langchain_core.messages import AIMessage
+
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentPosition, ComponentName
+
+
+def make_components() -> CircuitComponents:
+  return CircuitComponents(components=[
+    Component(
+      position=ComponentPosition(x=10, y=20),
+      component_name=ComponentName.RESISTOR,
+      positive_input_direction=0,
+      id="R1"
+    )
+  ])
+
+
+class DetectionCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.cache_path = os.path.join(self.tmp_dir.name, 'detections.sqlite')
+  
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+  
+  def test_persists_between_instances(self):
+    key = DetectionCache.make_key('img', 'system', 'format', 'gpt-4o', 0, 50)
+    cache = DetectionCache(self.cache_path)
+    self.assertIsNone(cache.get(key))
+    cache.put(key, 'value')
+    cache.close()
+    
+    cache = DetectionCache(self.cache_path)
+    self.assertEqual(cache.get(key), 'value')
+    self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 0))
+  
+  def test_key_depends_on_all_inputs(self):
+    base = ('img', 'system', 'format', 'gpt-4o', 0, 50)
+    keys = {DetectionCache.make_key(*base)}
+    for i, changed in enumerate(('img2', 'system2', 'format2', 'gpt-4o-mini', 0.5, 100)):
+      args = list(base)
+      args[i] = changed
+      keys.add(DetectionCache.make_key(*args))
+    self.assertEqual(len(keys), 7)
+  
+  def test_evicts_least_recently_used_over_max_bytes(self):
+    cache = DetectionCache(self.cache_path, max_bytes=10)
+    cache.put('a', '12345')
+    cache.put('b', '12345')
+    cache.get('a')
+    cache.put('c', '12345')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('a'), '12345')
+    self.assertEqual(cache.stats.evictions, 1)
+  
+  def test_expired_entries_are_not_returned(self):
+    cache = DetectionCache(self.cache_path, max_age_seconds=60)
+    with mock.patch('time.time', return_value=time.time() - 120):
+      cache.put('a', 'old')
+    self.assertIsNone(cache.get('a'))
+  
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_service_only_calls_llm_once(self):
+    service = LlmComponentDetectionService(cache=DetectionCache(self.cache_path))
+    service.output_llm = mock.Mock()
+    service.output_llm.invoke.return_value = AIMessage(content=make_components().json())
+    image = 'iVBORw0KGgoAAAANSUhEUgAAAAIAAAACCAAAAABX3VL4AAAADklEQVR4nGNg+M/wnwEABgAB/4/x/JoAAAAASUVORK5CYII='
+    
+    first = service.label_components(image, 1)
+    second = service.label_components(image, 1)
+    self.assertEqual(first, second)
+    service.label_components(image, 1, bypass_cache=True)
+    self.assertEqual(service.output_llm.invoke.call_count, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import json
+import unittest
+
+import yaml
+from langchain_core.exceptions import OutputParserException
+
+from photocircuit.component_detection.fast_output_parser import FastOutputParser, parse_structured_output
+from photocircuit.component_detection.model import CircuitComponents, ComponentName, SizedCircuitComponents
+
+
+def component(i: int, name: str = 'resistor') -> dict:
+  return {
+    'position': {'x': 10 * i, 'y': 20 * i},
+    'component_name': name,
+    'positive_input_direction': 90,
+    'id': f"R{i}",
+    'approximate_size': 40,
+  }
+
+
+class FastOutputParserTest(unittest.TestCase):
+  def setUp(self):
+    self.output = {'sized_components': [component(i) for i in range(1, 6)]}
+    self.parser = FastOutputParser(pydantic_object=SizedCircuitComponents)
+
+  def test_matches_pydantic_validation(self):
+    expected = SizedCircuitComponents.parse_obj(self.output)
+    self.assertEqual(self.parser.parse(json.dumps(self.output)), expected)
+    # models ignoring json mode still answer in yaml
+    self.assertEqual(self.parser.parse(f"```yaml\n{yaml.safe_dump(self.output)}```"), expected)
+    # loosely typed values are coerced like pydantic does
+    self.output['sized_components'][0]['position'] = {'x': '10', 'y': 20.0}
+    self.output['sized_components'][0]['component_name'] = 'Resistor'
+    self.assertEqual(self.parser.parse(json.dumps(self.output)), expected)
+
+  def test_invalid_components_are_dropped(self):
+    self.output['sized_components'][1]['component_name'] = 'transistor'
+    del self.output['sized_components'][2]['position']
+    parsed, dropped = parse_structured_output(json.dumps(self.output), SizedCircuitComponents)
+    self.assertEqual([comp.id for comp in parsed.sized_components], ['R1', 'R4', 'R5'])
+    self.assertEqual(dropped, 2)
+
+  def test_truncated_output_is_salvaged(self):
+    text = json.dumps(self.output)
+    cut = text.index('"R4"') + 2
+    parsed, _ = parse_structured_output(text[:cut], SizedCircuitComponents)
+    self.assertEqual([comp.id for comp in parsed.sized_components], ['R1', 'R2', 'R3'])
+    self.assertEqual(parsed.sized_components[0].component_name, ComponentName.RESISTOR)
+
+    text = f"```yaml\n{yaml.safe_dump(self.output, sort_keys=False)}```"
+    cut = text.index('R4') - 8
+    parsed = self.parser.parse(text[:cut])
+    self.assertEqual([comp.id for comp in parsed.sized_components], ['R1', 'R2', 'R3'])
+
+  def test_unrecoverable_output_raises(self):
+    with self.assertRaises(OutputParserException):
+      FastOutputParser(pydantic_object=CircuitComponents).parse("I could not find any components in the image")
+    with self.assertRaises(OutputParserException):
+      self.parser.parse(json.dumps({'components': []}))
+
+
+if __name__ == '__main__':
+  unittest.main()
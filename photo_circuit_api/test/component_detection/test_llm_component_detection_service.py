@@ -1,45 +1,60 @@
-import base64
+import asyncio
+import time
 import unittest
-from io import BytesIO
+from typing import Iterator
 
 import numpy as np
-from PIL import Image
 from dotenv import load_dotenv
 
+from photocircuit.component_detection.detection_cache import DetectionCache
 from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
 from photocircuit.component_detection.model import CircuitComponents, Component, ComponentPosition
+from photocircuit.component_detection.tiled_component_detection_service import TiledComponentDetectionService
+from photocircuit.evaluation.scoring import score_detections, score_detection
+from photocircuit.evaluation.sweep import SweepCell, SweepRunner, sweep_grid, aggregate, write_table
+from photocircuit.preprocessing.caching_preprocessing_service import CachingPreprocessingService
 from photocircuit.preprocessing.composite_preprocessing_service import CompositePreprocessingService
 from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
-from photocircuit.utils.common import base64_to_numpy, numpy_to_base64, scale_image
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.common import scale_image
 from photocircuit.utils.component_detection import components_diff
-from test.component_detection.utils import dump_array_to_csv
 from test.report.model import CircuitResult
 from test.report.report import generate_report
-from test.report.utils import get_generated_circuit, get_base64_png, get_image_from_base64, merge_images_vertically
-from test.test_utils import load_circuit_images_with_components, add_labels_to_image, rank_component_detection_err
+from test.report.utils import get_generated_circuit, get_circuit_image, get_image_from_base64, merge_images_vertically
+from test.constants import LARGE_CIRCUIT_ID
+from test.test_utils import load_circuit_images_with_components, add_labels_to_image, rank_component_detection_err, \
+  preprocessing_cache_dir
+
+# shared by every test so each raw image is only preprocessed once, see preprocessing_cache_dir to share it across runs
+PREPROCESSING_SERVICE = CachingPreprocessingService(
+  CompositePreprocessingService(
+    ScalingPreprocessingService()
+  ),
+  cache_dir=preprocessing_cache_dir()
+)
 
 
 class LlmComponentDetectionServiceTest(unittest.TestCase):
   def setUp(self):
     load_dotenv()
     
-    self.llm_component_detection_service = LlmComponentDetectionService()
-    self.preprocessing_service = CompositePreprocessingService(
-      ScalingPreprocessingService()
-    )
+    # responses of earlier runs are not reused, every test run asks the llm again
+    cache = DetectionCache(':memory:')
+    self.addCleanup(cache.close)
+    self.llm_component_detection_service = LlmComponentDetectionService(cache=cache)
+    self.preprocessing_service = PREPROCESSING_SERVICE
     self.raw_images, self.circuits_components = load_circuit_images_with_components()
     
     # Preprocessing
     # TODO: move to separate file once more tests are made
     self.preprocessed_images, self.preprocessed_circuits_comps = {}, {}
     for circuit_id in self.raw_images.keys():
-      raw_circuit_arr = base64_to_numpy(self.raw_images[circuit_id])
-      preprocessed_circuit_arr = self.preprocessing_service.preprocess_image(raw_circuit_arr)
-      preprocessed_circuit_img = numpy_to_base64(preprocessed_circuit_arr)
+      raw_circuit_img = self.raw_images[circuit_id]
+      preprocessed_circuit_img = self.preprocessing_service.preprocess(raw_circuit_img)
       self.preprocessed_images[circuit_id] = preprocessed_circuit_img
       
       raw_circuit_comps = self.circuits_components[circuit_id]
-      scale_factor = max(*preprocessed_circuit_arr.shape) / max(*raw_circuit_arr.shape)
+      scale_factor = max(*preprocessed_circuit_img.shape) / max(*raw_circuit_img.shape)
       self.preprocessed_circuits_comps[circuit_id] = CircuitComponents(components=[
         Component(
           position=ComponentPosition(
@@ -74,40 +89,91 @@ class LlmComponentDetectionServiceTest(unittest.TestCase):
   
   # Function to test addition function
   def test_detection(self):
-    circuit_ids = set(self.circuits_components.keys()).intersection(set(self.raw_images.keys()))
+    circuit_ids = sorted(set(self.circuits_components.keys()).intersection(set(self.raw_images.keys())))
+    circuit_imgs = [self.preprocessed_images[circuit_id] for circuit_id in circuit_ids]
+    int_sizes = [
+      50 if max(*circuit_img.shape) <= 500 else 100
+      for circuit_img in circuit_imgs
+    ]
+    all_circuit_comps_generated = asyncio.run(
+      self.llm_component_detection_service.alabel_components_many(circuit_imgs, int_sizes)
+    )
     
-    results: list[CircuitResult] = []
-    for circuit_id in circuit_ids:
-      circuit_comps = self.preprocessed_circuits_comps[circuit_id]
-      circuit_img = self.preprocessed_images[circuit_id]
-      
-      circuit_img_arr = base64_to_numpy(circuit_img)
-      max_len = max(*circuit_img_arr.shape)
-      int_size = 50 if max_len <= 500 else 100
-      circuit_comps_generated = self.llm_component_detection_service.label_components(circuit_img, int_size)
-      generated_labeled = add_labels_to_image(
-        base64_image=circuit_img,
-        circuit_components=circuit_comps_generated
-      )
-      generated_orientation_img = get_base64_png(get_generated_circuit(circuit_comps_generated))
-
-      avg_error = rank_component_detection_err(
-        ground_truth_comps=circuit_comps,
-        predicted_comps=circuit_comps_generated
-      )
-      
-      results.append(
-        CircuitResult(
+    scored_pairs = []
+    
+    def results() -> Iterator[CircuitResult]:
+      # rendered into the report one at a time, so the labeled images of earlier circuits can be freed
+      labeled = zip(circuit_ids, circuit_imgs, all_circuit_comps_generated)
+      for circuit_id, circuit_img, circuit_comps_generated in labeled:
+        if isinstance(circuit_comps_generated, BaseException):
+          print(f"failed to label {circuit_id}: {circuit_comps_generated!r}")
+          continue
+        circuit_comps = self.preprocessed_circuits_comps[circuit_id]
+        scored_pairs.append((circuit_comps, circuit_comps_generated))
+        generated_labeled = add_labels_to_image(
+          base64_image=circuit_img,
+          circuit_components=circuit_comps_generated
+        )
+        generated_orientation_img = get_circuit_image(get_generated_circuit(circuit_comps_generated))
+  
+        avg_error = rank_component_detection_err(
+          ground_truth_comps=circuit_comps,
+          predicted_comps=circuit_comps_generated
+        )
+        
+        yield CircuitResult(
           circuit_id=circuit_id,
           test_image=circuit_img,
           result_image=generated_labeled,
           oriented_img=generated_orientation_img,
           avg_error="{:.2f}".format(avg_error)
         )
-      )
     
-    generate_report(circuit_results=results)
+    generate_report(circuit_results=results())
+    print(score_detections(scored_pairs).summary())
+    
+  def test_tiled_detection(self):
+    test_circuit_id = LARGE_CIRCUIT_ID
+    raw_circuit_img = self.raw_images[test_circuit_id]
+    tiled_service = TiledComponentDetectionService(self.llm_component_detection_service)
+    large_img = ScalingPreprocessingService(fixed_size=2 * tiled_service.tile_size).preprocess(raw_circuit_img)
+    
+    for name, circuit_img, detect in [
+      ('one call', self.preprocessed_images[test_circuit_id], self.llm_component_detection_service.label_components),
+      ('tiled', large_img, tiled_service.label_components),
+    ]:
+      start = time.perf_counter()
+      circuit_comps_generated = detect(circuit_img, 50, bypass_cache=True)
+      elapsed = time.perf_counter() - start
+      scale_factor = max(*circuit_img.shape) / max(*raw_circuit_img.shape)
+      circuit_comps = CircuitComponents(components=[
+        comp.copy(update={'position': ComponentPosition(
+          x=comp.position.x * scale_factor,
+          y=comp.position.y * scale_factor
+        )})
+        for comp in self.circuits_components[test_circuit_id].components
+      ])
+      print(f"{name}: {elapsed:.2f}s, {max(*circuit_img.shape)}px")
+      print(score_detection(circuit_comps, circuit_comps_generated, thresholds=(10, 25, 50)).summary())
+  
+  def test_packed_detection(self):
+    circuit_ids = sorted(set(self.circuits_components.keys()).intersection(set(self.raw_images.keys())))
+    images = [self.preprocessed_images[circuit_id] for circuit_id in circuit_ids]
+    ground_truth = [self.preprocessed_circuits_comps[circuit_id] for circuit_id in circuit_ids]
     
+    for name, detect in [
+      ('one request per circuit', lambda imgs, int_size, bypass_cache: asyncio.run(
+        self.llm_component_detection_service.alabel_components_many(imgs, int_size, bypass_cache=bypass_cache)
+      )),
+      ('packed', self.llm_component_detection_service.label_components_packed),
+    ]:
+      start = time.perf_counter()
+      results = detect(images, 50, bypass_cache=True)
+      elapsed = time.perf_counter() - start
+      scored_pairs = [(gt, result) for gt, result in zip(ground_truth, results) if isinstance(result, CircuitComponents)]
+      print(f"{name}: {len(circuit_ids) / elapsed * 60:.1f} circuits/min, {len(circuit_ids) - len(scored_pairs)} failed")
+      print(score_detections(scored_pairs).summary())
+  
   def test_image_size(self):
     # Medium
     test_circuit_id = "circuit_page_2_circuit_3"
@@ -116,91 +182,94 @@ class LlmComponentDetectionServiceTest(unittest.TestCase):
     # test_circuit_id = "circuit_page_2_circuit_4"
     
     circuit_comps = self.circuits_components[test_circuit_id]
-    circuit_img = self.raw_images[test_circuit_id]
+    image_array = self.raw_images[test_circuit_id].array
+    max_len = max(image_array.shape)
     
     screen_sizes = np.arange(500, 1000, 100).astype(np.int32)
     intv_sizes = np.arange(5, 105, 5).astype(np.int32)
     # screen_sizes = np.arange(500, 600, 100).astype(np.int32)
     # intv_sizes = np.arange(5, 10, 5).astype(np.int32)
     
-    # Convert image to a NumPy array
-    image_data = base64.b64decode(circuit_img)
-    image = Image.open(BytesIO(image_data))
-    image_array = np.array(image)
-    
-    max_len = max(image_array.shape)
-    res = []
-    includes_grid = False
-    for i, screen_size in enumerate(screen_sizes):
+    # scaled once per screen size, shared by every cell with that size
+    scaled = {}
+    for screen_size in screen_sizes.tolist():
       scale_factor = screen_size / max_len
-      circuit_comps_scaled = CircuitComponents(components=[
-        Component(
-          position=ComponentPosition(
-            x=comp.position.x * scale_factor,
-            y=comp.position.y * scale_factor
-          ),
-          component_name=comp.component_name,
-          positive_input_direction=0
-        )
-        for comp in circuit_comps.components
-      ])
-      scaled_circuit_img_arr = scale_image(
-        image=image_array,
-        screen_size=screen_size
+      scaled[screen_size] = (
+        CircuitImage.from_array(scale_image(image=image_array, screen_size=screen_size)),
+        CircuitComponents(components=[
+          Component(
+            position=ComponentPosition(
+              x=comp.position.x * scale_factor,
+              y=comp.position.y * scale_factor
+            ),
+            component_name=comp.component_name,
+            positive_input_direction=0
+          )
+          for comp in circuit_comps.components
+        ])
       )
-      scaled_circuit_img = numpy_to_base64(scaled_circuit_img_arr)
-      for j, intv_size in enumerate(intv_sizes):
-        print(scaled_circuit_img)
-        circuit_comps_generated = self.llm_component_detection_service.label_components(
-          scaled_circuit_img,
-          intv_size,
-          includes_grid
-        )
-        
-        avg_error = rank_component_detection_err(
-          ground_truth_comps=circuit_comps_scaled,
-          predicted_comps=circuit_comps_generated
-        )
-        
-        diff_msg, matches = components_diff(
-          expected=circuit_comps_scaled,
-          actual=circuit_comps_generated
-        )
-        if not matches:
-          print("# Diff #")
-          print(diff_msg)
-        
-        res.append(
-          ["true" if includes_grid else "false", test_circuit_id, max_len, screen_sizes[i], intv_sizes[j], avg_error]
-        )
-  
-    print(res)
-    header = ["Includes Grid", "Circuit Id", "Original Size(px)", "Screen Size (px)", "Interval Size (px)", "Average Error (px)"]
-    dump_array_to_csv(res, 'screen_sizes_intv_spacing.csv', header=header)
+    
+    def evaluate(cell: SweepCell) -> dict[str, float]:
+      scaled_circuit_img, circuit_comps_scaled = scaled[cell.screen_size]
+      circuit_comps_generated = self.llm_component_detection_service.label_components(
+        scaled_circuit_img,
+        cell.step_size,
+        cell.include_grid
+      )
+      diff_msg, matches = components_diff(
+        expected=circuit_comps_scaled,
+        actual=circuit_comps_generated
+      )
+      if not matches:
+        print("# Diff #")
+        print(diff_msg)
+      return detection_metrics(circuit_comps_scaled, circuit_comps_generated)
+    
+    cells = sweep_grid(
+      [test_circuit_id],
+      screen_size=screen_sizes,
+      step_size=intv_sizes,
+      include_grid=[False]
+    )
+    records = SweepRunner('screen_sizes_intv_spacing.jsonl').run(cells, evaluate)
+    write_table(
+      aggregate(records, by=('include_grid', 'circuit_id', 'screen_size', 'step_size'), metric='avg_error'),
+      'screen_sizes_intv_spacing.csv'
+    )
     
   def test_model_temperature(self):
     test_circuit_id = "circuit_page_2_circuit_4"
     circuit_comps = self.preprocessed_circuits_comps[test_circuit_id]
     circuit_img = self.preprocessed_images[test_circuit_id]
-    circuit_img_arr = base64_to_numpy(circuit_img)
-    max_len = max(*circuit_img_arr.shape)
+    max_len = max(*circuit_img.shape)
     int_size = 50 if max_len <= 500 else 100
     temps = np.arange(0.075, 1, 0.1)
-    for _ in range(7):
-      res = []
-      for temp in temps:
-        llm_component_detection_service = LlmComponentDetectionService(temp)
-        circuit_comps_generated = llm_component_detection_service.label_components(circuit_img,
-                                                                                        int_size)
-        avg_error = rank_component_detection_err(
-          ground_truth_comps=circuit_comps,
-          predicted_comps=circuit_comps_generated
-        )
-        print(f'avg_error: {avg_error}')
-        
-        res.append([test_circuit_id, temp, avg_error])
-      header = ["Circuit Id", "Temperature", "Average Error (px)"]
-      dump_array_to_csv(res, 'temp_errors.csv', header=header)
+    service = LlmComponentDetectionService()
+    
+    def evaluate(cell: SweepCell) -> dict[str, float]:
+      circuit_comps_generated = service.label_components(
+        circuit_img,
+        cell.step_size,
+        bypass_cache=True,
+        temperature=cell.temperature
+      )
+      return detection_metrics(circuit_comps, circuit_comps_generated)
+    
+    cells = sweep_grid([test_circuit_id], repeats=7, step_size=[int_size], temperature=temps)
+    records = SweepRunner('temp_errors.jsonl').run(cells, evaluate)
+    write_table(aggregate(records, by=('circuit_id', 'temperature'), metric='avg_error'), 'temp_errors.csv')
+
+
+def detection_metrics(circuit_comps: CircuitComponents, circuit_comps_generated: CircuitComponents) -> dict[str, float]:
+  scores = score_detection(circuit_comps, circuit_comps_generated, thresholds=(25,))
+  return {
+    'avg_error': rank_component_detection_err(
+      ground_truth_comps=circuit_comps,
+      predicted_comps=circuit_comps_generated
+    ),
+    'precision': scores.precision[0],
+    'recall': scores.recall[0],
+  }
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+import httpx
+
+from photocircuit.component_detection import llm_registry
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.multistage_llm_component_detection_service import \
+  MultistageLlmComponentDetectionService
+from photocircuit.utils.circuit_image import CircuitImage
+from test.benchmark.utils import load_raw_circuit_images
+from test.stub_llm.server import StubLlmServer
+
+
+class LlmRegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.env = mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'stub'})
+    self.env.start()
+    self.addCleanup(self.env.stop)
+    # closes the keep-alive connections to the stub servers
+    self.addCleanup(llm_registry.clear)
+
+  def test_services_share_clients_and_prompt_assets(self):
+    service = LlmComponentDetectionService()
+    hot = LlmComponentDetectionService(temperature=0.8)
+    multistage = MultistageLlmComponentDetectionService()
+
+    llms = {id(s.llm) for s in (service, hot, hot.packed_service, multistage, multistage.crop_refinement_service)}
+    self.assertEqual(len(llms), 1)
+    self.assertIs(service.parser, hot.parser)
+    self.assertIs(multistage.parser, MultistageLlmComponentDetectionService().parser)
+    self.assertIs(service.system_prompt, hot.system_prompt)
+    self.assertIs(service.llm.http_client, llm_registry.shared_client())
+    self.assertIs(service.llm.http_async_client, llm_registry.shared_async_client())
+
+    # temperatures are bound per service and per call
+    self.assertEqual(service.output_llm.kwargs['temperature'], 0)
+    self.assertEqual(hot.output_llm.kwargs['temperature'], 0.8)
+    self.assertIs(hot._output_llm(None), hot.output_llm)
+    self.assertEqual(hot._output_llm(0.3).kwargs, {**hot.output_llm.kwargs, 'temperature': 0.3})
+
+  def test_endpoint_changes_get_their_own_model(self):
+    service = LlmComponentDetectionService()
+    with mock.patch.dict(os.environ, {'OPENAI_BASE_URL': 'http://127.0.0.1:1/v1'}):
+      moved = LlmComponentDetectionService()
+    self.assertIsNot(service.llm, moved.llm)
+    self.assertEqual(str(moved.llm.client._client.base_url), 'http://127.0.0.1:1/v1/')
+
+  def test_per_call_temperature_against_stub(self):
+    image = CircuitImage.from_base64(next(iter(load_raw_circuit_images().values())))
+    cache = DetectionCache(':memory:')
+    self.addCleanup(cache.close)
+    with StubLlmServer() as server, mock.patch.dict(os.environ, {'OPENAI_BASE_URL': server.base_url}):
+      service = LlmComponentDetectionService(cache=cache)
+      service.label_components(image, 50, temperature=0.5)
+      service.label_components(image, 50, temperature=0.5)
+      self.assertEqual(server.status_counts[200], 1)
+      # every temperature is cached separately
+      service.label_components(image, 50)
+      self.assertEqual(server.status_counts[200], 2)
+
+      # the shared async client pools connections per event loop, so it survives one asyncio.run after another
+      for _ in range(3):
+        asyncio.run(service.alabel_components(image, 50, bypass_cache=True, temperature=0.7))
+      self.assertEqual(dict(server.status_counts), {200: 5})
+      # and closes the pool of every loop along with the loop
+      self.assertEqual(llm_registry.shared_async_client()._transport._transports, {})
+
+  def test_clear_closes_shared_clients(self):
+    image = CircuitImage.from_base64(next(iter(load_raw_circuit_images().values())))
+    loop = asyncio.new_event_loop()
+    self.addCleanup(loop.close)
+    with StubLlmServer() as server, mock.patch.dict(os.environ, {'OPENAI_BASE_URL': server.base_url}):
+      service = LlmComponentDetectionService()
+      service.label_components(image, 50, bypass_cache=True)
+      loop.run_until_complete(service.alabel_components(image, 50, bypass_cache=True))
+      client, async_client = llm_registry.shared_client(), llm_registry.shared_async_client()
+      pool = async_client._transport._transports[loop][0]._pool
+      self.assertEqual(len(pool.connections), 1)
+
+      llm_registry.clear()
+      self.assertTrue(client.is_closed)
+      self.assertEqual(pool.connections, [])
+
+  def test_release_forgets_models_of_a_client(self):
+    client = httpx.AsyncClient()
+    self.addCleanup(asyncio.run, client.aclose())
+    llm = llm_registry.chat_model('gpt-4o', 100, client)
+    self.assertIs(llm_registry.chat_model('gpt-4o', 100, client), llm)
+    llm_registry.release(client)
+    self.assertIsNot(llm_registry.chat_model('gpt-4o', 100, client), llm)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import (
+  CircuitComponents, Component, ComponentName, ComponentPosition, PackedCircuit, PackedCircuitComponents
+)
+from photocircuit.utils.circuit_image import CircuitImage
+
+
+def component(x: int, y: int) -> Component:
+  return Component(
+    position=ComponentPosition(x=x, y=y), component_name=ComponentName.RESISTOR, positive_input_direction=0, id="R1"
+  )
+
+
+class PackedLlmComponentDetectionServiceTest(unittest.TestCase):
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_small_circuits_share_one_request(self):
+    service = LlmComponentDetectionService()
+    
+    def reply(messages):
+      # every circuit listed gets one component in its own coordinates, at its number times ten
+      listing = messages[1].content[1]['text']
+      numbers = [int(line.split(':')[1]) for line in listing.splitlines() if line.startswith('- circuit:')]
+      return AIMessage(content=PackedCircuitComponents(circuits=[
+        PackedCircuit(circuit=number, components=[component(10 * number, 10 * number)]) for number in numbers
+      ]).json())
+    
+    service.packed_service.output_llm = mock.Mock()
+    service.packed_service.output_llm.ainvoke = mock.AsyncMock(side_effect=reply)
+    service.output_llm = mock.Mock()
+    service.output_llm.ainvoke = mock.AsyncMock(
+      return_value=AIMessage(content=CircuitComponents(components=[component(1, 1)]).json())
+    )
+    
+    small = [CircuitImage.from_array(np.full((200 + 10 * i, 300), 255, dtype=np.uint8)) for i in range(6)]
+    large = CircuitImage.from_array(np.full((2000, 300), 255, dtype=np.uint8))
+    results = service.label_components_packed(small[:3] + [large] + small[3:], 50)
+    
+    service.packed_service.output_llm.ainvoke.assert_awaited_once()
+    # the circuit too large to share a canvas is labelled on its own
+    service.output_llm.ainvoke.assert_awaited_once()
+    self.assertEqual(len(results), 7)
+    # circuits are numbered on the canvas tallest first, each gets back the components reported under its number
+    self.assertEqual([result.components[0].position.x for result in results], [60, 50, 40, 1, 30, 20, 10])
+
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_failed_request_fails_every_circuit_on_its_canvas(self):
+    service = LlmComponentDetectionService()
+    service.packed_service.output_llm = mock.Mock()
+    service.packed_service.output_llm.ainvoke = mock.AsyncMock(side_effect=ValueError("unparseable output"))
+    images = [CircuitImage.from_array(np.full((100, 100), 255, dtype=np.uint8)) for _ in range(3)]
+    results = service.label_components_packed(images, 50)
+    self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+import json
+import unittest
+
+import yaml
+from langchain_core.exceptions import OutputParserException
+
+from photocircuit.component_detection.model import CircuitComponents, SizedCircuitComponents
+from photocircuit.component_detection.streaming_parser import StreamingItemParser
+
+
+def component(i: int) -> dict:
+  return {
+    'position': {'x': 10 * i, 'y': 20 * i},
+    'component_name': 'resistor',
+    'positive_input_direction': 90,
+    'positive_input_direction_reasoning': 'the "+" is {above}: see - marks',
+    'id': f"R{i}",
+    'approximate_size': 40,
+  }
+
+
+def stream(parser: StreamingItemParser, text: str, chunk_size: int = 7) -> list[tuple[int, str]]:
+  """
+  :return: (characters received, id) of every item, in the order they were completed
+  """
+  arrivals = []
+  for i in range(0, len(text), chunk_size):
+    arrivals.extend((i + chunk_size, item.id) for item in parser.feed(text[i:i + chunk_size]))
+  arrivals.extend((len(text), item.id) for item in parser.close())
+  return arrivals
+
+
+class StreamingItemParserTest(unittest.TestCase):
+  def setUp(self):
+    self.output = {'sized_components': [component(i) for i in range(1, 6)]}
+    self.expected = SizedCircuitComponents.parse_obj(self.output)
+
+  def test_items_complete_as_they_arrive(self):
+    for text in [
+      json.dumps(self.output),
+      f"```json\n{json.dumps(self.output, indent=2)}\n```",
+      f"```yaml\n{yaml.safe_dump(self.output, sort_keys=False)}```",
+      yaml.safe_dump(self.output, sort_keys=False),
+    ]:
+      parser = StreamingItemParser(SizedCircuitComponents)
+      arrivals = stream(parser, text)
+      self.assertEqual([item_id for _, item_id in arrivals], ['R1', 'R2', 'R3', 'R4', 'R5'])
+      # the first item is out within the first quarter of the response
+      self.assertLess(arrivals[0][0], len(text) / 4)
+      self.assertEqual(parser.result(), self.expected)
+
+  def test_truncated_and_invalid_items_are_skipped(self):
+    self.output['sized_components'][1]['component_name'] = 'transistor'
+    text = json.dumps(self.output)
+    parser = StreamingItemParser(SizedCircuitComponents)
+    arrivals = stream(parser, text[:text.index('"R5"')])
+    self.assertEqual([item_id for _, item_id in arrivals], ['R1', 'R3', 'R4'])
+    self.assertEqual(parser.dropped, 1)
+
+  def test_response_without_list_raises(self):
+    parser = StreamingItemParser(CircuitComponents)
+    with self.assertRaises(OutputParserException):
+      stream(parser, "I could not find any components in the image")
+    parser = StreamingItemParser(CircuitComponents)
+    self.assertEqual(stream(parser, '{"components": []}'), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import ComponentName
+from photocircuit.component_detection.template_component_detection_service import (
+  TemplateComponentDetectionService, TEMPLATES_DIR, load_template, non_max_suppression
+)
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.image_encoder import ImageEncoder
+
+
+class TemplateComponentDetectionServiceTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.service = TemplateComponentDetectionService()
+    # a resistor lying horizontally and an upside down current source on a blank page
+    cls.image = np.full((200, 300), 255, dtype=np.uint8)
+    cls.image[40:90, 30:80] = np.rot90(load_template(os.path.join(TEMPLATES_DIR, 'resistor.png')))
+    cls.image[100:150, 200:250] = np.rot90(load_template(os.path.join(TEMPLATES_DIR, 'current_source.png')), 2)
+  
+  def test_finds_components_at_their_centers(self):
+    circuit_comps = self.service.label_components(CircuitImage.from_array(self.image))
+    by_name = {comp.component_name: comp for comp in circuit_comps.components}
+    self.assertEqual(set(by_name), {ComponentName.RESISTOR, ComponentName.CURRENT_SOURCE})
+    
+    resistor, current_source = by_name[ComponentName.RESISTOR], by_name[ComponentName.CURRENT_SOURCE]
+    self.assertLessEqual(np.linalg.norm(resistor.position.as_numpy() - [55, 65]), 3)
+    self.assertLessEqual(np.linalg.norm(current_source.position.as_numpy() - [225, 125]), 3)
+    # the arrow of the template points up, rotated by 180 degrees it points down
+    self.assertEqual(current_source.positive_input_direction, 270)
+  
+  def test_blank_image_has_no_components(self):
+    blank = CircuitImage.from_array(np.full((100, 100), 255, dtype=np.uint8))
+    self.assertEqual(self.service.label_components(blank).components, [])
+  
+  def test_non_max_suppression(self):
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [50, 50, 10, 10]])
+    keep = non_max_suppression(boxes, np.array([0.8, 0.9, 0.7]), 0.3)
+    np.testing.assert_array_equal(keep, [1, 2])
+  
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_candidates_are_sent_to_llm(self):
+    llm_service = LlmComponentDetectionService(candidate_detector=self.service, image_encoder=ImageEncoder())
+    hints = llm_service.candidate_hints(CircuitImage.from_array(self.image))
+    self.assertIn('current source', hints)
+    
+    encoded = llm_service.image_encoder.encode(self.image)
+    texts = [part.get('text') for part in llm_service.build_messages(encoded, hints)[1].content]
+    self.assertIn(hints, texts)
+    self.assertEqual(len(llm_service.build_messages(encoded)[1].content), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentPosition, ComponentName
+from photocircuit.component_detection.tiled_component_detection_service import (
+  TiledComponentDetectionService, tile_grid
+)
+from photocircuit.utils.circuit_image import CircuitImage
+
+# components of a 1000x600 schematic
+COMPONENTS = [
+  (ComponentName.RESISTOR, 100, 100),
+  # inside the overlap of the left and right tiles
+  (ComponentName.CAPACITOR, 500, 300),
+  (ComponentName.RESISTOR, 900, 500),
+]
+
+
+class FakeDetectionService:
+  """
+  labels each tile with the components whose center is inside it, slightly off like a real detection
+  """
+  def __init__(self):
+    self.tiles = []
+  
+  async def alabel_components_many(self, images, int_size, include_grid, bypass_cache, concurrency):
+    return [self.label(image) for image in images]
+  
+  def label(self, image: CircuitImage) -> CircuitComponents:
+    # tiles are copies of the full image, which encodes each pixel's x, y in its channels
+    x0, y0 = int(image.array[0, 0, 0]) * 4, int(image.array[0, 0, 1]) * 4
+    h, w = image.shape[:2]
+    self.tiles.append((x0, y0, w, h))
+    return CircuitComponents(components=[
+      Component(
+        position=ComponentPosition(x=x - x0 + len(self.tiles), y=y - y0),
+        component_name=name,
+        positive_input_direction=0,
+        id="X"
+      )
+      for name, x, y in COMPONENTS
+      if x0 <= x < x0 + w and y0 <= y < y0 + h
+    ])
+
+
+class TiledComponentDetectionServiceTest(unittest.TestCase):
+  def test_tiles_cover_image_with_overlap(self):
+    tiles = tile_grid(600, 1000, 400, 100)
+    self.assertEqual(len(tiles), 3 * 2)
+    xs = sorted({x for x, _, _, _ in tiles})
+    self.assertEqual(xs[-1] + 400, 1000)
+    self.assertTrue(all(b - a <= 300 for a, b in zip(xs, xs[1:])))
+    self.assertEqual(tile_grid(300, 300, 400, 100), [(0, 0, 300, 300)])
+  
+  def test_components_are_mapped_back_and_deduplicated(self):
+    ys, xs = np.mgrid[0:600, 0:1000]
+    image = np.stack([xs // 4, ys // 4, np.zeros_like(xs)], axis=2).astype(np.uint8)
+    fake = FakeDetectionService()
+    service = TiledComponentDetectionService(fake, tile_size=600, overlap=200)
+    
+    circuit_comps = asyncio.run(service.alabel_components(CircuitImage.from_array(image), 50))
+    self.assertEqual(len(fake.tiles), 2)
+    found = sorted((comp.component_name.value, comp.position.x, comp.position.y) for comp in circuit_comps.components)
+    expected = sorted((name.value, x, y) for name, x, y in COMPONENTS)
+    self.assertEqual([name for name, _, _ in found], [name for name, _, _ in expected])
+    for (_, x, y), (_, ex, ey) in zip(found, expected):
+      self.assertLessEqual(abs(x - ex) + abs(y - ey), 2)
+    self.assertEqual(sorted(comp.id for comp in circuit_comps.components), ['C1', 'R1', 'R2'])
+  
+  def test_small_image_is_one_call(self):
+    detection_service = mock.Mock()
+    detection_service.alabel_components = mock.AsyncMock(return_value=CircuitComponents(components=[]))
+    service = TiledComponentDetectionService(detection_service, tile_size=750)
+    service.label_components(CircuitImage.from_array(np.zeros((500, 700), dtype=np.uint8)), 50)
+    detection_service.alabel_components.assert_awaited_once()
+    detection_service.alabel_components_many.assert_not_called()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,8 +1,12 @@
+import csv
 import os
 
-from photocircuit.component_detection.model import ComponentPosition
+import numpy as np
+
+from photocircuit.component_detection.model import (
+  ComponentName, ComponentPosition, SizedCircuitComponents, SizedComponent
+)
 from test.component_detection.model import BBox
-import pandas as pd
 
 
 def bbox_center(bbox: BBox) -> ComponentPosition:
@@ -12,17 +16,32 @@ def bbox_center(bbox: BBox) -> ComponentPosition:
   )
   
   
+def sample(*comps: tuple[ComponentName, int, int], direction: int = 0, size: int = 40) -> SizedCircuitComponents:
+  """
+  :param comps: (name, x, y) of every component of the sample
+  :return: one llm sample finding comps, all with the same direction and size
+  """
+  return SizedCircuitComponents(sized_components=[
+    SizedComponent(
+      position=ComponentPosition(x=x, y=y),
+      component_name=name,
+      positive_input_direction=direction,
+      id="X",
+      approximate_size=size
+    )
+    for name, x, y in comps
+  ])
+
+
 def dump_array_to_csv(array, file_path, header=None):
-  # Convert the array to a DataFrame
-  df = pd.DataFrame(array)
-  
-  # Check if the file exists
-  if not os.path.isfile(file_path):
-    # If the file does not exist, add the header if provided
-    if header:
-      df.to_csv(file_path, index=False, header=header)
-    else:
-      df.to_csv(file_path, index=False, header=False)
-  else:
-    # If the file exists, append the data without writing the header
-    df.to_csv(file_path, mode='a', index=False, header=False)
\ No newline at end of file
+  """
+  Appends the rows of array to a csv file, writing header first if the file does not exist yet
+
+  :param array: rows of values, or values written one per row
+  """
+  write_header = header is not None and not os.path.isfile(file_path)
+  with open(file_path, 'a', newline='') as f:
+    writer = csv.writer(f)
+    if write_header:
+      writer.writerow(header)
+    writer.writerows(row if np.ndim(row) else [row] for row in array)
@@ -0,0 +1,69 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentPosition, ComponentName
+from photocircuit.evaluation.scoring import linear_sum_assignment, score_detection, score_detections
+
+
+def components(*comps: tuple[ComponentName, int, int]) -> CircuitComponents:
+  return CircuitComponents(components=[
+    Component(
+      position=ComponentPosition(x=x, y=y),
+      component_name=name,
+      positive_input_direction=0,
+      id="T"
+    )
+    for name, x, y in comps
+  ])
+
+
+class LinearSumAssignmentTest(unittest.TestCase):
+  def test_matches_brute_force(self):
+    rng = np.random.default_rng(0)
+    for n, m in [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5)]:
+      cost = rng.random((n, m)) * 100
+      rows, cols = linear_sum_assignment(cost)
+      self.assertEqual(len(set(rows)), min(n, m))
+      self.assertEqual(len(set(cols)), min(n, m))
+      if n <= m:
+        best = min(sum(cost[i, p[i]] for i in range(n)) for p in itertools.permutations(range(m), n))
+      else:
+        best = min(sum(cost[p[j], j] for j in range(m)) for p in itertools.permutations(range(n), m))
+      self.assertAlmostEqual(cost[rows, cols].sum(), best)
+  
+  def test_empty(self):
+    rows, cols = linear_sum_assignment(np.zeros((0, 3)))
+    self.assertEqual((len(rows), len(cols)), (0, 0))
+
+
+class ScoringTest(unittest.TestCase):
+  def test_same_class_components_are_matched_one_to_one(self):
+    truth = components((ComponentName.RESISTOR, 0, 0), (ComponentName.RESISTOR, 100, 0))
+    # both predictions are closest to the first resistor, only one of them may match it
+    predicted = components((ComponentName.RESISTOR, 5, 0), (ComponentName.RESISTOR, 20, 0))
+    scores = score_detection(truth, predicted, thresholds=(10, 100))
+    np.testing.assert_array_equal(scores.true_positives, [[1, 2]])
+    np.testing.assert_allclose(scores.mean_error, [5, (5 + 80) / 2])
+  
+  def test_wrong_class_is_not_matched(self):
+    truth = components((ComponentName.RESISTOR, 0, 0), (ComponentName.CAPACITOR, 50, 50))
+    predicted = components((ComponentName.INDUCTOR, 0, 0), (ComponentName.CAPACITOR, 53, 54))
+    scores = score_detection(truth, predicted, thresholds=(10,))
+    np.testing.assert_allclose(scores.precision, [0.5])
+    np.testing.assert_allclose(scores.recall, [0.5])
+    np.testing.assert_allclose(scores.mean_error, [5])
+  
+  def test_batch_aggregates_pairs(self):
+    truth = components((ComponentName.RESISTOR, 0, 0))
+    pairs = [(truth, components((ComponentName.RESISTOR, 3, 4)))] * 3 + [(truth, components())]
+    scores = score_detections(pairs, thresholds=(1, 10))
+    self.assertEqual(scores.true_positives.shape, (4, 2))
+    np.testing.assert_allclose(scores.precision, [0, 1])
+    np.testing.assert_allclose(scores.recall, [0, 0.75])
+    self.assertTrue(np.isnan(scores.mean_error[0]))
+
+
+if __name__ == '__main__':
+  unittest.main()
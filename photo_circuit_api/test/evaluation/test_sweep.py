@@ -0,0 +1,75 @@
+import math
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from photocircuit.evaluation.sweep import SweepCell, SweepRunner, sweep_grid, aggregate, write_table
+
+
+class SweepTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.checkpoint_path = os.path.join(self.tmp_dir.name, 'sweep.jsonl')
+    self.cells = sweep_grid(['a', 'b'], repeats=2, screen_size=np.array([500, 600]), step_size=[50])
+  
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+  
+  def test_grid_is_cartesian_product(self):
+    self.assertEqual(len(self.cells), 2 * 2 * 2)
+    self.assertEqual(len({cell.key() for cell in self.cells}), len(self.cells))
+    self.assertIs(type(self.cells[0].screen_size), int)
+    with self.assertRaises(ValueError):
+      sweep_grid(['a'], unknown=[1])
+  
+  def test_resumes_from_checkpoint(self):
+    calls = []
+    failing = {'b'}
+    
+    def flaky(cell: SweepCell) -> dict[str, float]:
+      calls.append(cell)
+      if cell.circuit_id in failing:
+        raise RuntimeError("rate limited")
+      return {'avg_error': cell.screen_size / 100}
+    
+    records = SweepRunner(self.checkpoint_path, max_workers=3).run(self.cells, flaky)
+    self.assertEqual(len(records), 4)
+    
+    # a run killed mid write leaves a partial line behind
+    with open(self.checkpoint_path, 'a') as f:
+      f.write('{"cell": {"circuit_id"')
+    
+    calls.clear()
+    failing.clear()
+    records = SweepRunner(self.checkpoint_path, max_workers=3).run(self.cells, flaky)
+    self.assertEqual(len(calls), 4)
+    self.assertTrue(all(cell.circuit_id == 'b' for cell in calls))
+    self.assertEqual([r['cell']['circuit_id'] for r in records], [cell.circuit_id for cell in self.cells])
+
+    # the records appended after the partial line are read back, nothing runs again
+    calls.clear()
+    records = SweepRunner(self.checkpoint_path, max_workers=3).run(self.cells, flaky)
+    self.assertEqual((len(calls), len(records)), (0, len(self.cells)))
+  
+  def test_aggregate(self):
+    records = [
+      {'cell': {'screen_size': 500}, 'metrics': {'avg_error': 1.0}},
+      {'cell': {'screen_size': 500}, 'metrics': {'avg_error': 3.0}},
+      {'cell': {'screen_size': 500}, 'metrics': {'avg_error': math.inf}},
+      {'cell': {'screen_size': 600}, 'metrics': {'avg_error': math.inf}},
+    ]
+    rows = aggregate(records, by=('screen_size',), metric='avg_error')
+    self.assertEqual([row['screen_size'] for row in rows], [500, 600])
+    self.assertEqual((rows[0]['avg_error_mean'], rows[0]['count'], rows[0]['non_finite']), (2.0, 2, 1))
+    self.assertTrue(math.isnan(rows[1]['avg_error_mean']))
+    
+    table_path = os.path.join(self.tmp_dir.name, 'table.csv')
+    write_table(rows, table_path)
+    with open(table_path) as f:
+      self.assertEqual(len(f.readlines()), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
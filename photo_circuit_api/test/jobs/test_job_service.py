@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+from photocircuit.jobs.job_service import JobService
+from photocircuit.jobs.job_store import JobStore
+from photocircuit.jobs.model import DONE, FAILED
+from photocircuit.main import create_app
+from photocircuit.photocircuit import PhotoCircuit
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.utils.circuit_image import CircuitImage
+from test.test_main import SlowDetectionService, upload
+
+
+class FlakyDetectionService(SlowDetectionService):
+  """
+  Raises on the first attempt of every image whose first pixel is in failing
+  """
+  def __init__(self, seconds: float, failing: set[int]):
+    super().__init__(seconds)
+    self.failing = failing
+
+  async def alabel_components(self, image: CircuitImage, int_size: int):
+    seed = int(image.array.flat[0])
+    if seed in self.failing:
+      self.failing.discard(seed)
+      raise RuntimeError(f"image {seed} failed")
+    return await super().alabel_components(image, int_size)
+
+
+class JobServiceTest(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.path = os.path.join(directory.name, 'jobs.sqlite')
+
+  def job_service(self, service: SlowDetectionService, workers: int, max_attempts: int = 3) -> JobService:
+    store = JobStore(self.path)
+    self.addCleanup(store.close)
+    photo_circuit = PhotoCircuit(service, ScalingPreprocessingService(fixed_size=100))
+    return JobService(photo_circuit, store, workers=workers, max_attempts=max_attempts, poll_interval=0.05)
+
+  async def test_streams_results_as_images_finish(self):
+    service = FlakyDetectionService(0.05, failing={3, 5})
+    job_service = self.job_service(service, workers=4, max_attempts=2)
+    await job_service.start()
+    self.addAsyncCleanup(job_service.stop)
+
+    job_id = await job_service.submit([(f'circuit_{seed}', upload(seed, size=100)) for seed in range(10)])
+    results = [result async for result in job_service.stream_results(job_id)]
+
+    self.assertEqual(sorted(result.position for result in results), list(range(10)))
+    self.assertEqual({result.status for result in results}, {DONE})
+    self.assertEqual(service.calls, 10)
+    progress = await job_service.progress(job_id)
+    self.assertEqual((progress.done, progress.failed), (10, 0))
+    # a stream resumed after the last result has nothing left to read
+    self.assertEqual([result async for result in job_service.stream_results(job_id, results[-1].sequence)], [])
+
+  async def test_workers_survive_store_errors(self):
+    job_service = self.job_service(SlowDetectionService(0.01), workers=1)
+    claim = job_service.store.claim
+    errors = [sqlite3.OperationalError('database is locked')]
+
+    def flaky_claim(*args):
+      if errors:
+        raise errors.pop()
+      return claim(*args)
+
+    job_service.store.claim = flaky_claim
+    with self.assertLogs('photocircuit.jobs.job_service', 'ERROR'):
+      await job_service.start()
+      self.addAsyncCleanup(job_service.stop)
+      job_id = await job_service.submit([('circuit_0', upload(0, size=100))])
+      results = [result async for result in job_service.stream_results(job_id)]
+    self.assertEqual([result.status for result in results], [DONE])
+
+  async def test_resumes_after_restart(self):
+    first = self.job_service(SlowDetectionService(10), workers=2)
+    await first.start()
+    job_id = await first.submit([(f'circuit_{seed}', upload(seed, size=100)) for seed in range(3)])
+    await asyncio.sleep(0.2)
+    self.assertEqual((await first.progress(job_id)).running, 2)
+    await first.stop()
+
+    service = FlakyDetectionService(0.01, failing={1})
+    second = self.job_service(service, workers=2, max_attempts=1)
+    await second.start()
+    self.addAsyncCleanup(second.stop)
+    results = {result.name: result async for result in second.stream_results(job_id)}
+
+    self.assertEqual({name: result.status for name, result in results.items()},
+                     {'circuit_0': DONE, 'circuit_1': FAILED, 'circuit_2': DONE})
+    self.assertIn('image 1 failed', results['circuit_1'].error)
+
+  async def test_job_routes(self):
+    job_service = self.job_service(SlowDetectionService(0.01), workers=2)
+    client = TestClient(TestServer(create_app(job_service.photo_circuit, job_service=job_service)))
+    await client.start_server()
+    self.addAsyncCleanup(client.close)
+
+    form = aiohttp.FormData()
+    for seed in range(3):
+      form.add_field('image', upload(seed, size=100), filename=f'circuit_{seed}.png', content_type='image/png')
+    response = await client.post('/jobs', data=form)
+    self.assertEqual(response.status, 202)
+    submitted = await response.json()
+    self.assertEqual(submitted['total'], 3)
+
+    response = await client.get(f"/jobs/{submitted['job_id']}/results")
+    lines = [json.loads(line) for line in (await response.text()).splitlines()]
+    self.assertEqual(sorted(line['name'] for line in lines), ['circuit_0.png', 'circuit_1.png', 'circuit_2.png'])
+    self.assertEqual(lines[0]['components']['components'][0]['position'], {'x': 50, 'y': 50})
+
+    progress = await (await client.get(f"/jobs/{submitted['job_id']}")).json()
+    self.assertEqual((progress['done'], progress['finished']), (3, True))
+    self.assertEqual((await client.get('/jobs/unknown')).status, 404)
+
+  async def test_job_upload_limit_applies_to_the_batch(self):
+    job_service = self.job_service(SlowDetectionService(0.01), workers=1)
+    app = create_app(job_service.photo_circuit, max_upload_bytes=10_000, job_service=job_service)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    self.addAsyncCleanup(client.close)
+
+    # every part is below the limit, their sum is not
+    form = aiohttp.FormData()
+    for i in range(20):
+      form.add_field('image', bytes(9000), filename=f'circuit_{i}.png', content_type='image/png')
+    with mock.patch.object(job_service, 'submit') as submit:
+      response = await client.post('/jobs', data=form)
+    self.assertEqual(response.status, 413)
+    submit.assert_not_called()
+
+
+if __name__ == '__main__':
+  unittest.main()
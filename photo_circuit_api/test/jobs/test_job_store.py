@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from photocircuit.jobs.job_store import JobStore
+from photocircuit.jobs.model import DONE, FAILED
+
+
+class JobStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+    self.path = os.path.join(self.directory.name, 'jobs.sqlite')
+    self.store = JobStore(self.path)
+    self.addCleanup(self.store.close)
+
+  def test_claims_oldest_first_and_pages_results(self):
+    first = self.store.create_job([('a', b'1'), ('b', b'2')])
+    second = self.store.create_job([('c', b'3')])
+
+    items = self.store.claim(limit=2)
+    self.assertEqual([(item.job_id, item.name, item.image) for item in items], [(first, 'a', b'1'), (first, 'b', b'2')])
+    self.store.complete(items[1], '{"components": []}')
+    self.store.fail(items[0], 'ValueError()', retry=False)
+
+    progress = self.store.progress(first)
+    self.assertEqual((progress.total, progress.done, progress.failed), (2, 1, 1))
+    self.assertTrue(progress.finished)
+    self.assertFalse(self.store.progress(second).finished)
+    self.assertIsNone(self.store.progress('unknown'))
+
+    results = self.store.results(first)
+    self.assertEqual([(result.name, result.status) for result in results], [('b', DONE), ('a', FAILED)])
+    self.assertEqual(self.store.results(first, after=results[0].sequence), results[1:])
+    self.assertEqual(self.store.results(second), [])
+
+  def test_retries_and_resumes_after_restart(self):
+    job_id = self.store.create_job([('a', b'1'), ('b', b'2')])
+    a, b = self.store.claim(limit=2)
+    self.store.fail(a, 'APIError()', retry=True)
+    self.assertEqual([(item.name, item.attempts) for item in self.store.claim()], [('a', 2)])
+    self.store.close()
+
+    # items a stopped process was running are claimed again by the next one
+    self.store = JobStore(self.path)
+    self.assertEqual(self.store.requeue_running(), 2)
+    self.assertEqual(self.store.progress(job_id).pending, 2)
+    self.assertEqual([(item.name, item.attempts) for item in self.store.claim(limit=5)], [('a', 3), ('b', 2)])
+
+
+if __name__ == '__main__':
+  unittest.main()
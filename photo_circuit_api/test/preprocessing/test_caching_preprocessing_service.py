@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from photocircuit.preprocessing.caching_preprocessing_service import CachingPreprocessingService
+from photocircuit.preprocessing.composite_preprocessing_service import CompositePreprocessingService
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.preprocessing.thickness_preprocessing_service import ThicknessPreprocessingService
+from photocircuit.utils.circuit_image import CircuitImage
+
+
+class CachingPreprocessingServiceTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.image = np.zeros((300, 400), dtype=np.uint8)
+    self.image[100:200, 50:350] = 255
+    self.chain = CompositePreprocessingService(ScalingPreprocessingService(), ThicknessPreprocessingService())
+  
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+  
+  def test_memory_tier(self):
+    service = CachingPreprocessingService(self.chain)
+    first = service.preprocess(CircuitImage.from_array(self.image))
+    second = service.preprocess(CircuitImage.from_array(self.image.copy()))
+    self.assertIs(first.array.base, second.array.base)
+    self.assertEqual((service.stats.hits, service.stats.misses), (1, 1))
+    np.testing.assert_array_equal(first.array, self.chain.preprocess_image(self.image))
+  
+  def test_lru_eviction(self):
+    service = CachingPreprocessingService(self.chain, max_entries=1)
+    service.preprocess_image(self.image)
+    service.preprocess_image(255 - self.image)
+    service.preprocess_image(self.image)
+    self.assertEqual((service.stats.hits, service.stats.misses, service.stats.evictions), (0, 3, 2))
+  
+  def test_disk_tier_is_memory_mapped(self):
+    CachingPreprocessingService(self.chain, cache_dir=self.tmp_dir.name).preprocess_image(self.image)
+    service = CachingPreprocessingService(self.chain, cache_dir=self.tmp_dir.name)
+    result = service.preprocess_image(self.image)
+    self.assertIsInstance(result, np.memmap)
+    self.assertEqual((service.stats.hits, service.stats.disk_hits), (1, 1))
+    np.testing.assert_array_equal(result, self.chain.preprocess_image(self.image))
+  
+  def test_chain_configuration_is_part_of_key(self):
+    CachingPreprocessingService(self.chain, cache_dir=self.tmp_dir.name).preprocess_image(self.image)
+    service = CachingPreprocessingService(
+      CompositePreprocessingService(ScalingPreprocessingService(fixed_size=500), ThicknessPreprocessingService()),
+      cache_dir=self.tmp_dir.name
+    )
+    self.assertEqual(max(service.preprocess_image(self.image).shape[:2]), 500)
+    self.assertEqual(service.stats.misses, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
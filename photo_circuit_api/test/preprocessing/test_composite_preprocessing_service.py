@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from photocircuit.preprocessing.composite_preprocessing_service import CompositePreprocessingService
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.preprocessing.thickness_preprocessing_service import ThicknessPreprocessingService
+from test.test_utils import load_circuit_images_with_components
+
+
+class CompositePreprocessingServiceTest(unittest.TestCase):
+  def setUp(self):
+    raw_images, _ = load_circuit_images_with_components()
+    gray_images = [raw_images[circuit_id].array for circuit_id in sorted(raw_images)[:5]]
+    self.images = gray_images + [np.stack([gray] * 3, axis=2) for gray in gray_images]
+    self.chains = [
+      CompositePreprocessingService(ScalingPreprocessingService()),
+      CompositePreprocessingService(ScalingPreprocessingService(), ThicknessPreprocessingService()),
+      CompositePreprocessingService(ThicknessPreprocessingService(), ScalingPreprocessingService()),
+      CompositePreprocessingService(
+        CompositePreprocessingService(ThicknessPreprocessingService(), ScalingPreprocessingService()),
+        ThicknessPreprocessingService()
+      ),
+    ]
+  
+  def test_fused_matches_unfused(self):
+    for chain in self.chains:
+      for image in self.images:
+        expected = chain.preprocess_image_unfused(image)
+        np.testing.assert_array_equal(chain.preprocess_image(image), expected)
+  
+  def test_results_do_not_alias_scratch_buffers(self):
+    chain = self.chains[1]
+    first = chain.preprocess_image(self.images[0])
+    first_copy = first.copy()
+    chain.preprocess_image(self.images[0][::-1])
+    np.testing.assert_array_equal(first, first_copy)
+  
+  def test_scratch_buffers_stay_bounded(self):
+    chain = self.chains[1]
+    rng = np.random.default_rng(0)
+    counts = []
+    for _ in range(20):
+      height, width = rng.integers(100, 1200, size=2)
+      chain.preprocess_image(np.full((height, width), 255, dtype=np.uint8))
+      counts.append(len(chain.scratch))
+    # one buffer per intermediate result, however many image sizes went through
+    self.assertEqual(len(set(counts)), 1)
+  
+  def test_round_trip_to_rgb_is_dropped(self):
+    # thickness -> scaling scales the grayscale result and expands it to RGB once at the end
+    plan = self.chains[2].plan(1, np.dtype(np.uint8))
+    self.assertEqual(len(plan), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from photocircuit.preprocessing.composite_preprocessing_service import CompositePreprocessingService
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.preprocessing.thickness_preprocessing_service import ThicknessPreprocessingService
+from test.test_utils import load_circuit_images_with_components
+
+
+class PreprocessManyTest(unittest.TestCase):
+  def setUp(self):
+    raw_images, _ = load_circuit_images_with_components()
+    self.images = [raw_images[circuit_id].array for circuit_id in sorted(raw_images)[:12]]
+    self.service = CompositePreprocessingService(ScalingPreprocessingService(), ThicknessPreprocessingService())
+  
+  def test_ordered_matches_serial(self):
+    results = list(self.service.preprocess_many(iter(self.images), max_workers=2))
+    self.assertEqual([index for index, _ in results], list(range(len(self.images))))
+    for (_, result), image in zip(results, self.images):
+      np.testing.assert_array_equal(result, self.service.preprocess_image(image))
+  
+  def test_unordered_returns_every_image(self):
+    results = dict(self.service.preprocess_many(self.images, max_workers=3, ordered=False))
+    self.assertEqual(sorted(results), list(range(len(self.images))))
+    np.testing.assert_array_equal(results[5], self.service.preprocess_image(self.images[5]))
+  
+  def test_stopping_early_frees_shared_memory(self):
+    with warnings.catch_warnings():
+      warnings.simplefilter('error')
+      results = self.service.preprocess_many(self.images, max_workers=2)
+      next(results)
+      results.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
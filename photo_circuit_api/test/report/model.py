@@ -1,10 +1,12 @@
 from dataclasses import dataclass
 
+from photocircuit.utils.circuit_image import CircuitImage
+
 
 @dataclass
 class CircuitResult:
   circuit_id: str
-  test_image: str
-  result_image: str
-  oriented_img: str
+  test_image: CircuitImage
+  result_image: CircuitImage
+  oriented_img: CircuitImage
   avg_error: str
@@ -1,20 +1,173 @@
+"""
+Html report of a detection run, streamed to disk while the results are produced.
+
+Rows are rendered one at a time by template.generate as the results are pulled from the iterable, and every image is
+written next to the report as a content-hashed png plus a webp thumbnail instead of being inlined as base64. An image
+shared by several rows, or by several runs, is stored once, and the report only keeps the row being rendered in
+memory, so its size no longer depends on the number of circuits.
+"""
+import io
 import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Iterator
 
-from jinja2 import Environment, FileSystemLoader
+from PIL import Image
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
 
+from photocircuit.utils.circuit_image import CircuitImage
 from test.report.model import CircuitResult
 
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_REPORT_PATH = os.path.abspath(os.path.join(TEMPLATE_DIR, '..', '..', 'report.html'))
+# directory of the image files, next to the report
+ASSETS_DIR_NAME = 'report_assets'
+# longest side of the thumbnails shown in the table, in px
+THUMBNAIL_SIZE = 200
+THUMBNAIL_FORMAT = 'WEBP'
+
+
+@dataclass(frozen=True)
+class ImageAsset:
+  # paths relative to the report
+  src: str
+  href: str
+  width: int
+  height: int
+
+
+@dataclass(frozen=True)
+class ReportRow:
+  circuit_id: str
+  test_image: ImageAsset
+  result_image: ImageAsset
+  oriented_img: ImageAsset
+  avg_error: str
+
+
+@dataclass
+class ReportStats:
+  circuits: int = 0
+  scored: int = 0
+  error_sum: float = 0.0
+
+  @property
+  def mean_error(self) -> float:
+    return self.error_sum / self.scored if self.scored else float('nan')
+
+  def add(self, row: ReportRow):
+    self.circuits += 1
+    try:
+      self.error_sum += float(row.avg_error)
+      self.scored += 1
+    except ValueError:
+      pass
+
+
+class AssetStore:
+  """
+  Writes images under report_dir/name/<first 2 digits of the digest>/<digest>, keyed by CircuitImage.digest(), so an
+  image already on disk is neither encoded nor written again. The state lives on disk only.
+  """
+  def __init__(self, report_dir: str, name: str = ASSETS_DIR_NAME, thumbnail_size: int = THUMBNAIL_SIZE):
+    self.report_dir = report_dir
+    self.name = name
+    self.thumbnail_size = thumbnail_size
+    self.written = 0
+    self.reused = 0
+
+  def add(self, image: CircuitImage | str) -> ImageAsset:
+    """
+    :param image: CircuitImage, or base64 png
+    :return: asset of the image, with the size its thumbnail is shown at
+    """
+    image = CircuitImage.of(image)
+    digest = image.digest()
+    base = f'{self.name}/{digest[:2]}/{digest}'
+    href = f'{base}.png'
+    self._write(href, lambda: image.encode('PNG'))
+
+    height, width = image.shape[:2]
+    scale = min(1.0, self.thumbnail_size / max(width, height))
+    size = max(1, round(width * scale)), max(1, round(height * scale))
+    if scale == 1.0:
+      # already small enough, the full size image is its own thumbnail
+      return ImageAsset(src=href, href=href, width=width, height=height)
+
+    src = f'{base}_{self.thumbnail_size}.{THUMBNAIL_FORMAT.lower()}'
+    self._write(src, lambda: self._thumbnail(image, size))
+    return ImageAsset(src=src, href=href, width=size[0], height=size[1])
+
+  @staticmethod
+  def _thumbnail(image: CircuitImage, size: tuple[int, int]) -> bytes:
+    buffer = io.BytesIO()
+    image.to_pil().resize(size, Image.Resampling.LANCZOS).save(buffer, format=THUMBNAIL_FORMAT)
+    return buffer.getvalue()
+
+  def _write(self, relative_path: str, encode):
+    path = os.path.join(self.report_dir, relative_path)
+    if os.path.exists(path):
+      self.reused += 1
+      return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written under a temporary name, so an interrupted run never leaves a truncated file that would be reused
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      f.write(encode())
+    os.replace(tmp_path, path)
+    self.written += 1
+
+
+@lru_cache(maxsize=None)
+def report_template() -> Template:
+  env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']), trim_blocks=True, lstrip_blocks=True
+  )
+  return env.get_template('template.html')
+
+
+def to_row(result: CircuitResult, assets: AssetStore) -> ReportRow:
+  return ReportRow(
+    circuit_id=result.circuit_id,
+    test_image=assets.add(result.test_image),
+    result_image=assets.add(result.result_image),
+    oriented_img=assets.add(result.oriented_img),
+    avg_error=result.avg_error
+  )
+
+
+def generate_report(
+    circuit_results: Iterable[CircuitResult],
+    path: str = DEFAULT_REPORT_PATH,
+    thumbnail_size: int = THUMBNAIL_SIZE
+) -> ReportStats:
+  """
+  Pass a generator to render every result as soon as it is produced, the report file is flushed after each row, and
+  the results are released once their row is written.
+
+  :param circuit_results: results in the order of the table
+  :param path: report file, its images are written to the report_assets directory next to it
+  :param thumbnail_size: longest side of the thumbnails in px
+  :return: number of circuits and mean error of the report
+  """
+  report_dir = os.path.dirname(os.path.abspath(path))
+  os.makedirs(report_dir, exist_ok=True)
+  assets = AssetStore(report_dir, thumbnail_size=thumbnail_size)
+  stats = ReportStats()
+
+  with open(path, 'w', encoding='utf-8') as f:
+    def rows() -> Iterator[ReportRow]:
+      for result in circuit_results:
+        row = to_row(result, assets)
+        stats.add(row)
+        yield row
+        # the row has been written by now, show it before waiting for the next result
+        f.flush()
+
+    # the footer is rendered after the last row, so it can show the stats of the whole run
+    for chunk in report_template().generate(rows=rows(), stats=stats):
+      f.write(chunk)
 
-def generate_report(circuit_results: list[CircuitResult]):
-  file_path = os.path.abspath(__file__)
-  template_dir = os.path.dirname(file_path)
-  print('looking for report template in ', template_dir)
-  env = Environment(loader=FileSystemLoader(template_dir))
-  template = env.get_template('template.html')
-  
-  # Render the template with the circuit results
-  html_content = template.render(circuit_results=circuit_results)
-  
-  # Save the rendered HTML to a file
-  with open(f'{template_dir}/../../report.html', 'w') as f:
-    f.write(html_content)
+  print(f'report of {stats.circuits} circuits written to {path}, {assets.written} images written, '
+        f'{assets.reused} reused')
+  return stats
@@ -0,0 +1,99 @@
+import os
+import re
+import tempfile
+import unittest
+import weakref
+from typing import Iterator
+
+import numpy as np
+from PIL import Image
+
+from photocircuit.utils.circuit_image import CircuitImage
+from test.report.model import CircuitResult
+from test.report.report import generate_report, ASSETS_DIR_NAME
+
+
+def circuit_image(value: int, width: int = 400, height: int = 300) -> CircuitImage:
+  array = np.full((height, width, 3), 255, dtype=np.uint8)
+  array[value % height, :] = 0
+  return CircuitImage.from_array(array)
+
+
+class ReportTest(unittest.TestCase):
+  def setUp(self):
+    tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    self.report_dir = tmp_dir.name
+    self.path = os.path.join(self.report_dir, 'report.html')
+
+  def read_report(self) -> str:
+    with open(self.path, encoding='utf-8') as f:
+      return f.read()
+
+  def test_streams_rows_with_shared_image_files(self):
+    test_image = circuit_image(0)
+
+    def results() -> Iterator[CircuitResult]:
+      for i in range(3):
+        if i:
+          # the previous row is on disk before the next result is produced
+          self.assertIn(f'<td>circuit-{i - 1}</td>', self.read_report())
+        yield CircuitResult(
+          circuit_id=f'circuit-{i}',
+          test_image=test_image,
+          result_image=circuit_image(i + 1),
+          oriented_img=circuit_image(i + 1, width=100, height=80),
+          avg_error=f'{i:.2f}'
+        )
+
+    stats = generate_report(results(), path=self.path)
+    self.assertEqual((stats.circuits, stats.mean_error), (3, 1.0))
+
+    html = self.read_report()
+    self.assertNotIn('data:image', html)
+    self.assertEqual(html.count('loading="lazy"'), 9)
+    self.assertIn('3 circuits, mean avg error 1.00px', html)
+    paths = set(re.findall(r'(?:src|href)="([^"]+)"', html))
+    for path in paths:
+      self.assertTrue(path.startswith(f'{ASSETS_DIR_NAME}/'), path)
+      self.assertTrue(os.path.isfile(os.path.join(self.report_dir, path)), path)
+
+    # 1 test image and 3 result images with a thumbnail each, the small oriented images are their own thumbnail
+    self.assertEqual(len(paths), 4 * 2 + 3)
+    digest = test_image.digest()
+    thumbnail = f'{ASSETS_DIR_NAME}/{digest[:2]}/{digest}_200.webp'
+    self.assertEqual(Image.open(os.path.join(self.report_dir, thumbnail)).size, (200, 150))
+    self.assertIn(f'<img src="{thumbnail}" alt="Test Image" width="200" height="150"', html)
+
+    # images already written by an earlier report are reused
+    mtimes = {path: os.stat(os.path.join(self.report_dir, path)).st_mtime_ns for path in paths}
+    generate_report(results(), path=self.path)
+    self.assertEqual(mtimes, {path: os.stat(os.path.join(self.report_dir, path)).st_mtime_ns for path in paths})
+
+  def test_releases_written_results(self):
+    refs = []
+
+    def results() -> Iterator[CircuitResult]:
+      for i in range(20):
+        if i >= 2:
+          self.assertIsNone(refs[i - 2](), f'result {i - 2} still referenced')
+        result = CircuitResult(
+          circuit_id=f'circuit-{i}', test_image=circuit_image(i), result_image=circuit_image(i),
+          oriented_img=circuit_image(i), avg_error='n/a'
+        )
+        refs.append(weakref.ref(result))
+        yield result
+        del result
+
+    stats = generate_report(results(), path=self.path)
+    self.assertEqual((stats.circuits, stats.scored), (20, 0))
+    self.assertIn('<p>20 circuits</p>', self.read_report())
+
+  def test_escapes_circuit_ids(self):
+    image = circuit_image(0)
+    generate_report([CircuitResult('<b>x</b>', image, image, image, '1.00')], path=self.path)
+    self.assertIn('<td>&lt;b&gt;x&lt;/b&gt;</td>', self.read_report())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,10 +3,12 @@ import io
 import os
 from io import BytesIO
 
+import numpy as np
 from PIL import Image, ImageFont, ImageDraw
 from matplotlib import pyplot as plt
 
 from photocircuit.component_detection.model import ComponentName, Component, CircuitComponents
+from photocircuit.utils.circuit_image import CircuitImage
 
 
 def get_image_path_for_comp(component_name: ComponentName):
@@ -75,7 +77,14 @@ def get_base64_png(circuit_image: Image.Image) -> str:
   return img_str
 
 
-def get_image_from_base64(base64_str: str) -> Image.Image:
+def get_circuit_image(circuit_image: Image.Image) -> CircuitImage:
+  return CircuitImage.from_array(np.asarray(circuit_image))
+
+
+def get_image_from_base64(base64_str: CircuitImage | str) -> Image.Image:
+    # reuse the decoded pixels if this image was already decoded
+    if isinstance(base64_str, CircuitImage):
+      return base64_str.to_pil()
     # Decode the Base64 string to binary data
     img_data = base64.b64decode(base64_str)
     # Load the binary data into a BytesIO buffer
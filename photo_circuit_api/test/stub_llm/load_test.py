@@ -0,0 +1,152 @@
+"""
+End to end throughput and latency of the component detection services against the stub llm server, so only our own
+code and the simulated llm latency are measured.
+
+Every stage of the pipeline is timed, the table printed at the end shows which stage dominates p95 latency.
+
+run from photo_circuit_api/ with: python -m test.stub_llm.load_test --requests 200 --concurrency 16 --latency-ms 800
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.instrumentation import INSTRUMENTATION, HistogramSink, JsonLinesSink, PrometheusSink
+from test.benchmark.utils import load_raw_circuit_images
+from test.stub_llm.server import StubLlmServer
+
+
+async def run_load(
+    service_name: str,
+    images: list[CircuitImage],
+    concurrency: int,
+    batch_size: int = 1,
+    first_latencies: Optional[list[float]] = None
+) -> tuple[np.ndarray, int, int, float]:
+  """
+  :param batch_size: circuits per call of the packed service
+  :param first_latencies: the stream service appends the time to the first component of every call to it
+  :return: (latency in seconds of every call that succeeded, number of circuits labelled by them, number of failed
+           calls, wall time in seconds)
+  """
+  # imported after the environment points at the stub server
+  from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+  from photocircuit.component_detection.multistage_llm_component_detection_service import \
+    MultistageLlmComponentDetectionService
+
+  if service_name == 'packed':
+    service = LlmComponentDetectionService()
+    
+    async def detect(batch: list[CircuitImage], int_size: int, bypass_cache: bool):
+      for result in await service.alabel_components_packed(batch, int_size, bypass_cache=bypass_cache):
+        if isinstance(result, BaseException):
+          raise result
+    
+    calls = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+  elif service_name == 'stream':
+    service = LlmComponentDetectionService()
+    
+    async def detect(image: CircuitImage, int_size: int, bypass_cache: bool):
+      start = time.perf_counter()
+      async for _ in service.astream_components(image, int_size, bypass_cache=bypass_cache):
+        if start is not None and first_latencies is not None:
+          first_latencies.append(time.perf_counter() - start)
+        start = None
+    
+    calls = images
+  else:
+    if service_name == 'multistage':
+      detect = MultistageLlmComponentDetectionService().aget_positioned_components
+    else:
+      detect = LlmComponentDetectionService().alabel_components
+    calls = images
+
+  semaphore = asyncio.Semaphore(concurrency)
+  latencies, circuits, failures = [], 0, 0
+
+  async def timed(call: CircuitImage | list[CircuitImage]):
+    nonlocal circuits, failures
+    async with semaphore:
+      start = time.perf_counter()
+      try:
+        await detect(call, 50, bypass_cache=True)
+        latencies.append(time.perf_counter() - start)
+        circuits += len(call) if isinstance(call, list) else 1
+      except Exception as e:
+        failures += 1
+        print(f"failed: {e!r}")
+
+  start = time.perf_counter()
+  await asyncio.gather(*(timed(call) for call in calls))
+  return np.array(latencies), circuits, failures, time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--service', choices=('llm', 'multistage', 'packed', 'stream'), default='llm')
+  parser.add_argument('--batch-size', type=int, default=8, help="circuits per call of the packed service")
+  parser.add_argument('--requests', type=int, default=100)
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--base-url', default=None, help="already running stub server, otherwise one is started")
+  parser.add_argument('--latency-ms', type=float, default=0)
+  parser.add_argument('--latency-sigma', type=float, default=0.5)
+  parser.add_argument('--error-rate', type=float, default=0)
+  parser.add_argument('--rate-limit', type=float, default=None)
+  parser.add_argument('--burst', type=int, default=1)
+  parser.add_argument('--chunk-delay-ms', type=float, default=0, help="delay between streamed chunks")
+  parser.add_argument('--events', default=None, help="json lines file to append every stage event to")
+  parser.add_argument('--prometheus', default=None, help="file to write stage metrics to in prometheus text format")
+  args = parser.parse_args()
+
+  server = None
+  if args.base_url is None:
+    server = StubLlmServer(
+      latency_ms=args.latency_ms,
+      latency_sigma=args.latency_sigma,
+      error_rate=args.error_rate,
+      rate_limit=args.rate_limit,
+      burst=args.burst,
+      chunk_delay_ms=args.chunk_delay_ms
+    ).start()
+  os.environ['OPENAI_BASE_URL'] = args.base_url or server.base_url
+  os.environ.setdefault('OPENAI_API_KEY', 'stub')
+
+  raw_images = [CircuitImage.from_base64(image) for image in load_raw_circuit_images().values()]
+  images = [raw_images[i % len(raw_images)] for i in range(args.requests)]
+  first_latencies = []
+  histogram = INSTRUMENTATION.add_sink(HistogramSink())
+  events = INSTRUMENTATION.add_sink(JsonLinesSink(args.events)) if args.events else None
+  prometheus = INSTRUMENTATION.add_sink(PrometheusSink()) if args.prometheus else None
+  try:
+    latencies, circuits, failures, wall_time = asyncio.run(
+      run_load(args.service, images, args.concurrency, args.batch_size, first_latencies)
+    )
+  finally:
+    if server is not None:
+      server.stop()
+    if events is not None:
+      events.close()
+
+  print(f"{args.service}: {len(latencies)} ok, {failures} failed in {wall_time:.2f}s "
+        f"({len(latencies) / wall_time:.1f} calls/s, {circuits / wall_time * 60:.0f} "
+        f"circuits/min at concurrency {args.concurrency})")
+  if len(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f"latency p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms max={latencies.max() * 1000:.1f}ms")
+  if first_latencies:
+    p50, p95 = np.percentile(first_latencies, [50, 95]) * 1000
+    print(f"time to first component p50={p50:.1f}ms p95={p95:.1f}ms")
+  if server is not None:
+    print(f"server responses by status: {dict(server.status_counts)}")
+  print(f"\n{histogram.format_summary()}")
+  print(f"stage with the highest p95 latency: {histogram.dominant_stage(95)}")
+  if prometheus is not None:
+    prometheus.write(args.prometheus)
+
+
+if __name__ == '__main__':
+  main()
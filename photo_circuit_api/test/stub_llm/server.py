@@ -0,0 +1,383 @@
+"""
+OpenAI compatible stand-in for the chat completions endpoint the component detection services call, for load testing
+and running the pipeline offline.
+
+Replies with the recording for a request if there is one (recordings_dir/<request hash>.yaml holding the assistant
+message), otherwise with components of a test circuit picked by the request hash, in the output format the request
+asks for, as json for requests in json mode and yaml otherwise. Crop refinement requests are answered by confirming
+the listed crops, packed requests with a test circuit for every listed circuit. Latency, server errors and rate
+limiting are configurable.
+
+Point the services at it through the environment alone:
+  OPENAI_BASE_URL=http://127.0.0.1:8080/v1 OPENAI_API_KEY=stub
+
+run from photo_circuit_api/ with: python -m test.stub_llm.server --port 8080 --latency-ms 800
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import yaml
+
+COMPONENTS_DIR = os.path.dirname(os.path.abspath(__file__)) + "/../test_data/components"
+
+ID_PREFIXES = {
+  'resistor': 'R',
+  'capacitor': 'C',
+  'voltage source': 'V',
+  'current source': 'I',
+  'inductor': 'L',
+  'dependant voltage source': 'E',
+  'dependant current source': 'G',
+  'unknown': 'U',
+}
+
+# characters of the reply in each chunk of a streamed response
+STREAM_CHUNK_SIZE = 16
+
+# crop listing sent with crop refinement requests
+CROPS_PATTERN = re.compile(r"```yaml\n(crops:.*?)```", re.DOTALL)
+# circuit listing sent with requests for several circuits packed onto one canvas
+CIRCUITS_PATTERN = re.compile(r"```yaml\n(circuits:.*?)```", re.DOTALL)
+
+
+def request_hash(body: dict) -> str:
+  """
+  :param body: chat completions request
+  :return: key of the recording replayed for requests with the same model, temperature and messages
+  """
+  key = {name: body.get(name) for name in ('model', 'temperature', 'messages')}
+  return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_recording(recordings_dir: str, body: dict, content: str):
+  """
+  records content as the reply to requests matching body
+  """
+  os.makedirs(recordings_dir, exist_ok=True)
+  with open(os.path.join(recordings_dir, f"{request_hash(body)}.yaml"), 'w') as f:
+    f.write(content)
+
+
+def load_synthetic_circuits(components_dir: str = COMPONENTS_DIR) -> list[list[dict]]:
+  """
+  :return: components of every test circuit, with the bounding boxes converted to the services' output fields
+  """
+  circuits = []
+  for filename in sorted(os.listdir(components_dir)):
+    if not filename.endswith('.yaml'):
+      continue
+    with open(os.path.join(components_dir, filename)) as f:
+      test_data = yaml.safe_load(f)
+    counts = Counter()
+    components = []
+    for comp in test_data['components']:
+      bbox, name = comp['bbox'], comp['component_name']
+      counts[name] += 1
+      components.append({
+        'position': {'x': bbox['x'] + bbox['w'] // 2, 'y': bbox['y'] + bbox['h'] // 2},
+        'component_name': name,
+        'positive_input_direction': 0,
+        'id': f"{ID_PREFIXES.get(name, 'U')}{counts[name]}",
+        'approximate_size': max(bbox['w'], bbox['h']),
+      })
+    circuits.append(components)
+  return circuits
+
+
+def message_text(body: dict) -> str:
+  parts = []
+  for message in body.get('messages', []):
+    content = message.get('content')
+    if isinstance(content, str):
+      parts.append(content)
+    elif isinstance(content, list):
+      parts.extend(part.get('text', '') for part in content if part.get('type') == 'text')
+  return "\n".join(parts)
+
+
+def format_output(body: dict, output: dict) -> str:
+  """
+  :return: output as json for requests in json mode, otherwise as a yaml code block
+  """
+  if (body.get('response_format') or {}).get('type') == 'json_object':
+    return json.dumps(output)
+  return f"```yaml\n{yaml.safe_dump(output, sort_keys=False)}```"
+
+
+def count_images(body: dict) -> int:
+  return sum(
+    1
+    for message in body.get('messages', [])
+    if isinstance(message.get('content'), list)
+    for part in message['content']
+    if part.get('type') == 'image_url'
+  )
+
+
+class StubLlmServer:
+  """
+  Chat completions server running in a background thread, use as a context manager or with start / stop.
+  """
+  def __init__(
+      self,
+      host: str = '127.0.0.1',
+      port: int = 0,
+      recordings_dir: Optional[str] = None,
+      components_dir: str = COMPONENTS_DIR,
+      latency_ms: float = 0,
+      latency_sigma: float = 0.5,
+      error_rate: float = 0,
+      rate_limit: Optional[float] = None,
+      burst: int = 1,
+      seed: Optional[int] = None,
+      chunk_delay_ms: float = 0
+  ):
+    """
+    :param port: port to listen on, 0 for any free port
+    :param recordings_dir: directory of recorded replies, see save_recording
+    :param components_dir: test circuits synthetic replies are built from
+    :param latency_ms: median of the lognormally distributed response latency
+    :param latency_sigma: sigma of the latency distribution, larger gives a longer tail
+    :param error_rate: fraction of requests answered with a 500
+    :param rate_limit: requests per second accepted before answering with a 429, None for no limit
+    :param burst: number of requests accepted at once before the rate limit applies
+    :param seed: seed of the latency / error sampling
+    :param chunk_delay_ms: delay between the chunks of a streamed response, simulating the rate tokens are generated at
+    """
+    self.recordings_dir = recordings_dir
+    self.circuits = load_synthetic_circuits(components_dir)
+    self.latency_ms = latency_ms
+    self.latency_sigma = latency_sigma
+    self.error_rate = error_rate
+    self.rate_limit = rate_limit
+    self.burst = burst
+    self.chunk_delay_ms = chunk_delay_ms
+    self.status_counts = Counter()
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._tokens = float(burst)
+    self._last_refill = time.monotonic()
+    self._server = ThreadingHTTPServer((host, port), self._handler_class())
+    self._server.daemon_threads = True
+    self._thread: Optional[threading.Thread] = None
+
+  @property
+  def base_url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+  def start(self) -> 'StubLlmServer':
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+    if self._thread is not None:
+      self._thread.join()
+
+  def __enter__(self) -> 'StubLlmServer':
+    return self.start()
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  def serve_forever(self):
+    try:
+      self._server.serve_forever()
+    finally:
+      self._server.server_close()
+
+  def reply(self, body: dict) -> str:
+    """
+    :return: assistant message for a chat completions request
+    """
+    key = request_hash(body)
+    if self.recordings_dir is not None:
+      recording_path = os.path.join(self.recordings_dir, f"{key}.yaml")
+      if os.path.isfile(recording_path):
+        with open(recording_path) as f:
+          return f.read()
+
+    text = message_text(body)
+    crops = CROPS_PATTERN.search(text)
+    # crop refinement requests list the first stage guess for every crop, confirmed as they are
+    if 'refined_components' in text and crops is not None:
+      output = {'refined_components': yaml.safe_load(crops.group(1))['crops']}
+      return format_output(body, output)
+
+    circuits = CIRCUITS_PATTERN.search(text)
+    # packed requests get a different test circuit for every circuit on the canvas
+    if circuits is not None:
+      output = {'circuits': [
+        {'circuit': listed['circuit'], 'components': [
+          {name: value for name, value in comp.items() if name != 'approximate_size'}
+          for comp in self.circuits[(int(key, 16) + listed['circuit']) % len(self.circuits)]
+        ]}
+        for listed in yaml.safe_load(circuits.group(1))['circuits']
+      ]}
+      return format_output(body, output)
+
+    components = self.circuits[int(key, 16) % len(self.circuits)]
+    # the multistage service asks for sized components, identified by the field name in its format instructions
+    if 'sized_components' in text:
+      output = {'sized_components': components}
+    else:
+      output = {'components': [
+        {name: value for name, value in comp.items() if name != 'approximate_size'}
+        for comp in components
+      ]}
+    return format_output(body, output)
+
+  def _admit(self) -> tuple[int, float]:
+    """
+    :return: (http status to answer with, latency in seconds)
+    """
+    with self._lock:
+      latency = self._random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000 if self.latency_ms else 0
+      if self.rate_limit is not None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_limit)
+        self._last_refill = now
+        if self._tokens < 1:
+          return 429, 0
+        self._tokens -= 1
+      if self._random.random() < self.error_rate:
+        return 500, latency
+      return 200, latency
+
+  def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+          self._send_json(404, {'error': {'message': f"unknown path {self.path}", 'type': 'invalid_request_error'}})
+          return
+
+        status, latency = stub._admit()
+        time.sleep(latency)
+        if status == 429:
+          retry_after = 1 / stub.rate_limit
+          self._send_json(
+            429,
+            {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+            {'retry-after-ms': str(int(retry_after * 1000))}
+          )
+        elif status == 500:
+          self._send_json(500, {'error': {'message': 'stub server error', 'type': 'server_error'}})
+        elif body.get('stream'):
+          self._send_stream(body, stub.reply(body))
+        else:
+          self._send_json(200, self._completion(body, stub.reply(body)))
+        with stub._lock:
+          stub.status_counts[status] += 1
+
+      def _completion(self, body: dict, content: str) -> dict:
+        # rough token counts, openai charges a fixed 85 tokens for a low detail image tile
+        prompt_tokens = len(message_text(body)) // 4 + 85 * count_images(body)
+        completion_tokens = len(content) // 4
+        return {
+          'id': f"chatcmpl-stub-{request_hash(body)[:16]}",
+          'object': 'chat.completion',
+          'created': int(time.time()),
+          'model': body.get('model', 'stub'),
+          'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'logprobs': None,
+            'finish_reason': 'stop',
+          }],
+          'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+          },
+        }
+
+      def _send_stream(self, body: dict, content: str):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion = self._completion(body, content)
+        base = {name: completion[name] for name in ('id', 'created', 'model')}
+        pieces = [content[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(content), STREAM_CHUNK_SIZE)]
+        for i, piece in enumerate(pieces):
+          time.sleep(stub.chunk_delay_ms / 1000)
+          delta = {'role': 'assistant', 'content': piece} if i == 0 else {'content': piece}
+          self._send_event({**base, 'object': 'chat.completion.chunk',
+                            'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+        self._send_event({**base, 'object': 'chat.completion.chunk',
+                          'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if (body.get('stream_options') or {}).get('include_usage'):
+          self._send_event({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': completion['usage']})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+      def _send_event(self, event: dict):
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+
+      def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+      def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+          self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+      def log_message(self, format, *args):
+        pass
+
+    return Handler
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--recordings-dir', default=None)
+  parser.add_argument('--latency-ms', type=float, default=0)
+  parser.add_argument('--latency-sigma', type=float, default=0.5)
+  parser.add_argument('--error-rate', type=float, default=0)
+  parser.add_argument('--rate-limit', type=float, default=None, help="requests per second")
+  parser.add_argument('--burst', type=int, default=1)
+  parser.add_argument('--chunk-delay-ms', type=float, default=0)
+  args = parser.parse_args()
+
+  server = StubLlmServer(
+    host=args.host,
+    port=args.port,
+    recordings_dir=args.recordings_dir,
+    latency_ms=args.latency_ms,
+    latency_sigma=args.latency_sigma,
+    error_rate=args.error_rate,
+    rate_limit=args.rate_limit,
+    burst=args.burst,
+    chunk_delay_ms=args.chunk_delay_ms
+  )
+  print(f"serving chat completions, use with: OPENAI_BASE_URL={server.base_url} OPENAI_API_KEY=stub")
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import CircuitComponents
+from photocircuit.component_detection.multistage_llm_component_detection_service import \
+  MultistageLlmComponentDetectionService
+from photocircuit.utils.circuit_image import CircuitImage
+from test.benchmark.utils import load_raw_circuit_images
+from test.stub_llm.server import StubLlmServer, save_recording
+
+
+def post(base_url: str, body: dict) -> tuple[int, dict]:
+  request = urllib.request.Request(
+    f"{base_url}/chat/completions",
+    data=json.dumps(body).encode('utf-8'),
+    headers={'Content-Type': 'application/json'}
+  )
+  try:
+    with urllib.request.urlopen(request) as response:
+      return response.status, json.loads(response.read())
+  except urllib.error.HTTPError as e:
+    return e.code, json.loads(e.read())
+
+
+class StubLlmServerTest(unittest.TestCase):
+  def setUp(self):
+    self.body = {'model': 'gpt-4o', 'temperature': 0, 'messages': [{'role': 'user', 'content': 'label this'}]}
+    self.image = CircuitImage.from_base64(next(iter(load_raw_circuit_images().values())))
+  
+  def test_replays_recording(self):
+    with tempfile.TemporaryDirectory() as recordings_dir:
+      save_recording(recordings_dir, self.body, 'components: []')
+      with StubLlmServer(recordings_dir=recordings_dir) as server:
+        status, completion = post(server.base_url, self.body)
+        self.assertEqual(status, 200)
+        self.assertEqual(completion['choices'][0]['message']['content'], 'components: []')
+        
+        status, completion = post(server.base_url, {**self.body, 'temperature': 1})
+        self.assertIn('```yaml', completion['choices'][0]['message']['content'])
+  
+  def test_errors_and_rate_limit(self):
+    with StubLlmServer(error_rate=1) as server:
+      self.assertEqual(post(server.base_url, self.body)[0], 500)
+    with StubLlmServer(rate_limit=0.01, burst=1) as server:
+      self.assertEqual(post(server.base_url, self.body)[0], 200)
+      self.assertEqual(post(server.base_url, self.body)[0], 429)
+      self.assertEqual(dict(server.status_counts), {200: 1, 429: 1})
+  
+  def test_services_point_at_server_through_environment(self):
+    with StubLlmServer() as server:
+      with mock.patch.dict(os.environ, {'OPENAI_BASE_URL': server.base_url, 'OPENAI_API_KEY': 'stub'}):
+        circuit_comps = LlmComponentDetectionService().label_components(self.image, 50, bypass_cache=True)
+        sized_comps = MultistageLlmComponentDetectionService().get_positioned_components(
+          self.image, 50, bypass_cache=True
+        )
+        refined_comps = MultistageLlmComponentDetectionService().label_components(self.image, 50, bypass_cache=True)
+    self.assertGreater(len(circuit_comps.components), 0)
+    self.assertGreater(len(sized_comps.sized_components), 0)
+    self.assertEqual(len(refined_comps.components), len(sized_comps.sized_components))
+    self.assertEqual(dict(server.status_counts), {200: 4})
+
+  
+  def test_components_stream_before_response_ends(self):
+    with StubLlmServer(chunk_delay_ms=5) as server:
+      with mock.patch.dict(os.environ, {'OPENAI_BASE_URL': server.base_url, 'OPENAI_API_KEY': 'stub'}):
+        service = LlmComponentDetectionService()
+        expected = service.label_components(self.image, 50, bypass_cache=True)
+        start = time.perf_counter()
+        arrivals, streamed = [], []
+        for comp in service.stream_components(self.image, 50, bypass_cache=True):
+          arrivals.append(time.perf_counter() - start)
+          streamed.append(comp)
+        total = time.perf_counter() - start
+    self.assertEqual(CircuitComponents(components=streamed), expected)
+    self.assertGreater(len(streamed), 1)
+    self.assertLess(arrivals[0], total / 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
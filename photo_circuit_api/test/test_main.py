@@ -0,0 +1,96 @@
+import asyncio
+import io
+import unittest
+
+import numpy as np
+from PIL import Image
+from aiohttp.test_utils import TestClient, TestServer
+
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentName, ComponentPosition
+from photocircuit.main import create_app
+from photocircuit.photocircuit import PhotoCircuit
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.utils.async_utils import AdmissionController
+from photocircuit.utils.circuit_image import CircuitImage
+
+
+class SlowDetectionService:
+  """
+  Finds one resistor in the center of every image after a delay, like a slow llm request
+  """
+  def __init__(self, seconds: float):
+    self.seconds = seconds
+    self.calls = 0
+
+  async def alabel_components(self, image: CircuitImage, int_size: int) -> CircuitComponents:
+    self.calls += 1
+    await asyncio.sleep(self.seconds)
+    height, width = image.shape[:2]
+    return CircuitComponents(components=[
+      Component(
+        position=ComponentPosition(x=width // 2, y=height // 2),
+        component_name=ComponentName.RESISTOR,
+        positive_input_direction=0,
+        id="R1"
+      )
+    ])
+
+
+def upload(seed: int, size: int = 200) -> bytes:
+  return CircuitImage.from_array(np.full((size, size), seed, dtype=np.uint8)).encode()
+
+
+class PhotoCircuitServerTest(unittest.IsolatedAsyncioTestCase):
+  async def start(self, service: SlowDetectionService, admission: AdmissionController) -> TestClient:
+    # preprocessing halves the 200px uploads
+    photo_circuit = PhotoCircuit(service, ScalingPreprocessingService(fixed_size=100))
+    client = TestClient(TestServer(create_app(photo_circuit, admission)))
+    await client.start_server()
+    self.addAsyncCleanup(client.close)
+    return client
+
+  async def test_identical_uploads_share_one_detection(self):
+    service = SlowDetectionService(0.2)
+    client = await self.start(service, AdmissionController(max_in_flight=1, max_queue=0))
+    responses = await asyncio.gather(*(client.post('/detect', data=upload(1)) for _ in range(20)))
+
+    self.assertEqual(service.calls, 1)
+    self.assertEqual([response.status for response in responses], [200] * 20)
+    coalesced = [response.headers['X-Coalesced'] for response in responses]
+    self.assertEqual(coalesced.count('false'), 1)
+    # components come back in pixels of the upload, not of the preprocessed image
+    body = await responses[0].json()
+    self.assertEqual(body['components'][0]['position'], {'x': 100, 'y': 100})
+    health = await (await client.get('/healthz')).json()
+    self.assertEqual((health['coalesced'], health['in_flight']), (19, 0))
+
+  async def test_overload_is_rejected(self):
+    service = SlowDetectionService(0.2)
+    client = await self.start(service, AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5))
+    responses = await asyncio.gather(*(client.post('/detect', data=upload(seed)) for seed in range(4)))
+
+    statuses = sorted(response.status for response in responses)
+    self.assertEqual(statuses, [200, 200, 429, 429])
+    rejected = next(response for response in responses if response.status == 429)
+    self.assertEqual(rejected.headers['Retry-After'], '1')
+
+  async def test_queue_timeout_and_bad_upload(self):
+    service = SlowDetectionService(0.3)
+    client = await self.start(service, AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.05))
+    responses = await asyncio.gather(*(client.post('/detect', data=upload(seed)) for seed in range(2)))
+    self.assertEqual(sorted(response.status for response in responses), [200, 503])
+    self.assertEqual((await client.post('/detect', data=b'not an image')).status, 400)
+
+  async def test_undecodable_uploads_are_rejected(self):
+    service = SlowDetectionService(0)
+    client = await self.start(service, AdmissionController())
+    truncated = upload(1)[:-100]
+    buffer = io.BytesIO()
+    Image.new('LA', (200, 200)).save(buffer, format='PNG')
+    for data in (truncated, buffer.getvalue()):
+      self.assertEqual((await client.post('/detect', data=data)).status, 400)
+    self.assertEqual(service.calls, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
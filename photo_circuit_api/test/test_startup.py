@@ -0,0 +1,21 @@
+import os
+import unittest
+
+from test.benchmark.startup import ENTRY_POINTS, DEFAULT_BUDGET_SECONDS, deferred_imports, import_times, \
+  time_to_first_request
+
+
+class StartupTest(unittest.TestCase):
+  def test_entry_points_defer_heavy_dependencies(self):
+    for module in ENTRY_POINTS:
+      with self.subTest(module=module):
+        self.assertEqual(deferred_imports(import_times(module)), [])
+
+  def test_time_to_first_request_within_budget(self):
+    # slower machines can raise the budget, e.g. PHOTOCIRCUIT_STARTUP_BUDGET=10
+    budget = float(os.environ.get('PHOTOCIRCUIT_STARTUP_BUDGET', DEFAULT_BUDGET_SECONDS))
+    self.assertLess(time_to_first_request(), budget)
+
+
+if __name__ == '__main__':
+  unittest.main()
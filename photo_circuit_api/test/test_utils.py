@@ -1,7 +1,9 @@
 import base64
 import io
 import os
+import tempfile
 from io import BytesIO
+from typing import Optional
 
 import cv2
 import numpy as np
@@ -9,17 +11,36 @@ from PIL import ImageDraw, ImageFont, Image
 from langchain.output_parsers import YamlOutputParser
 
 from photocircuit.component_detection.model import Component, CircuitComponents, SizedCircuitComponents
+from photocircuit.evaluation.scoring import matched_distances
+from photocircuit.utils.circuit_image import CircuitImage
 from test.component_detection.model import TestDataCircuitComponents
 from test.component_detection.utils import bbox_center
 from test.constants import COMP_COLOR_MAP
 
 type json_raw_type = dict[str, json_raw_type | str]
 
+# set to keep the preprocessed test images across runs, they are cached in a temporary directory otherwise
+PREPROCESSING_CACHE_DIR_ENV = 'PHOTOCIRCUIT_TEST_PREPROCESSING_CACHE_DIR'
+_preprocessing_tmp_dir: Optional[tempfile.TemporaryDirectory] = None
 
-def load_circuit_images_with_components() -> tuple[dict[str, str], dict[str, CircuitComponents]]:
+
+def preprocessing_cache_dir() -> str:
+  """
+  :return: $PHOTOCIRCUIT_TEST_PREPROCESSING_CACHE_DIR, or a temporary directory removed when the process exits
+  """
+  global _preprocessing_tmp_dir
+  cache_dir = os.environ.get(PREPROCESSING_CACHE_DIR_ENV)
+  if cache_dir:
+    return cache_dir
+  if _preprocessing_tmp_dir is None:
+    _preprocessing_tmp_dir = tempfile.TemporaryDirectory(prefix='photocircuit-preprocessed-')
+  return _preprocessing_tmp_dir.name
+
+
+def load_circuit_images_with_components() -> tuple[dict[str, CircuitImage], dict[str, CircuitComponents]]:
   """
   loads CircuitComponents / circuit images from test data
-  :return: (list of dicts of circuit_id to base64 circuit image, list of circuit components)
+  :return: (list of dicts of circuit_id to circuit image, list of circuit components)
   """
   file_path = os.path.abspath(__file__)
   test_data_dir = os.path.dirname(file_path) + "/../test/test_data"
@@ -32,9 +53,8 @@ def load_circuit_images_with_components() -> tuple[dict[str, str], dict[str, Cir
     if filename.endswith(".png"):
       file_path = os.path.join(images_path, filename)
       with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
         circuit_id = filename.split('.')[0]
-        raw_images[circuit_id] = encoded_string
+        raw_images[circuit_id] = CircuitImage.from_bytes(image_file.read(), 'PNG')
   
   parser = YamlOutputParser(pydantic_object=TestDataCircuitComponents)
   # load components in images
@@ -71,10 +91,9 @@ def get_background_color(component_name):
   return COMP_COLOR_MAP.get(component_name, "white")
 
 
-def add_labels_to_image(base64_image: str, circuit_components: CircuitComponents) -> str:
-  # Decode the base64 image
-  image_data = base64.b64decode(base64_image)
-  image = Image.open(BytesIO(image_data)).convert("RGB")
+def add_labels_to_image(base64_image: CircuitImage | str, circuit_components: CircuitComponents) -> CircuitImage:
+  # reuse the already decoded pixels
+  image = CircuitImage.of(base64_image).to_pil().convert("RGB")
   
   # Initialize ImageDraw
   draw = ImageDraw.Draw(image)
@@ -109,15 +128,8 @@ def add_labels_to_image(base64_image: str, circuit_components: CircuitComponents
     # Draw the text
     draw.text(text_position, text, fill="white", font=font)
   
-  # Save the edited image to a BytesIO object
-  output_buffer = BytesIO()
-  image.save(output_buffer, format="PNG")
-  byte_data = output_buffer.getvalue()
-  
-  # Encode the image back to base64
-  base64_encoded_result = base64.b64encode(byte_data).decode('utf-8')
-  
-  return base64_encoded_result
+  # encoded lazily, only if the labeled image is actually shown / saved
+  return CircuitImage.from_array(np.asarray(image))
 
 
 def get_worst_dist(loc: np.array, image_shape: tuple[int, ...]):
@@ -136,71 +148,20 @@ def rank_component_detection_err(ground_truth_comps: CircuitComponents, predicte
   if len(ground_truth_comps.components) != len(predicted_comps.components):
     return float('inf')
 
-  # map of component name to ground truth positions
-  ground_truth_positions_by_name = {}
-  for comp in ground_truth_comps.components:
-    ground_truth_positions_by_name.setdefault(comp.component_name, [])
-    ground_truth_positions_by_name.get(comp.component_name).append(comp.position.as_numpy())
-
-  sum_dists = 0
-  for comp in predicted_comps.components:
-    loc_arr = comp.position.as_numpy()
-    true_locs = ground_truth_positions_by_name.get(comp.component_name)
-
-    # incorrect component, give worst possible dist
-    if true_locs is None:
-      return float('inf')
-
-    min_dist = min(
-      np.linalg.norm(loc_arr - true_loc)
-      for true_loc in true_locs
-    )
-    sum_dists += dist_weight(min_dist)
-  return sum_dists / len(ground_truth_comps.components)
+  # each ground truth component is matched to at most one predicted component of the same class
+  dists = matched_distances(ground_truth_comps, predicted_comps)
 
+  # incorrect component, give worst possible dist
+  if len(dists) != len(predicted_comps.components):
+    return float('inf')
 
-def calculate_distance(loc1, loc2):
-  return np.linalg.norm(loc1 - loc2)
+  return float(np.sum(dist_weight(dists))) / max(len(ground_truth_comps.components), 1)
 
 
-def rank_component_detection(ground_truth_comps: CircuitComponents, predicted_comps: CircuitComponents,
-                             image_shape: tuple[int, ...]):
-  total_score = 0
-  total_locations = len(ground_truth_comps.components)
-  
-  # Create dictionaries for easier lookup
-  ground_truth_dict = {comp.component_name: comp.position.as_numpy() for comp in ground_truth_comps.components}
-  predicted_dict = {comp.component_name: comp.position.as_numpy() for comp in predicted_comps.components}
-  
-  # Find the maximum possible distance for normalization (e.g., diagonal of the bounding box)
-  # min_x = float('inf')
-  # min_y = float('inf')
-  # max_x = float('-inf')
-  # max_y = float('-inf')
-  # for l1 in ground_truth_comps.components:
-  #   min_x = min(min_x, l1.position.x)
-  #   min_y = min(min_y, l1.position.y)
-  #   max_x = max(max_x, l1.position.x)
-  #   max_y = max(max_y, l1.position.y)
-  # max_possible_distance = ((max_y - min_y)**2 + (max_x - min_x)**2)**0.5
-  max_possible_distance = (image_shape[0] ** 2 + image_shape[1] ** 2) ** 0.5
-  
-  for component_name, true_loc in ground_truth_dict.items():
-    if component_name in predicted_dict:
-      guessed_loc = predicted_dict[component_name]
-      distance = calculate_distance(guessed_loc, true_loc)
-      normalized_distance = distance / max_possible_distance
-      score = 1 / (1 + normalized_distance)  # Adding 1 to avoid division by zero
-      total_score += score
-  
-  percent_score = (total_score / total_locations) * 100
-  return percent_score
-  
-  
-def add_labels_and_bboxs_to_image(base64_image: str, circuit_components: SizedCircuitComponents) -> str:
-  # Decode the base64 image
-  image_data = base64.b64decode(base64_image)
-  image = Image.open(BytesIO(image_data)).convert("RGB")
+def add_labels_and_bboxs_to_image(base64_image: CircuitImage | str,
+                                  circuit_components: SizedCircuitComponents) -> CircuitImage:
+  # reuse the already decoded pixels
+  image = CircuitImage.of(base64_image).to_pil().convert("RGB")
   
   # Initialize ImageDraw
   draw = ImageDraw.Draw(image)
@@ -241,33 +202,5 @@ def add_labels_and_bboxs_to_image(base64_image: str, circuit_components: SizedCi
     bbox_bottom_right = (position.x + approximate_size // 2, position.y + approximate_size // 2)
     draw.rectangle([bbox_top_left, bbox_bottom_right], outline="red", width=2)
   
-  # Save the edited image to a BytesIO object
-  output_buffer = BytesIO()
-  image.save(output_buffer, format="PNG")
-  byte_data = output_buffer.getvalue()
-  
-  # Encode the image back to base64
-  base64_encoded_result = base64.b64encode(byte_data).decode('utf-8')
-  
-  return base64_encoded_result
-
-
-# def rank_component_detection_avg_err(ground_truth_comps: CircuitComponents, predicted_comps: CircuitComponents,
-#                                      image_shape: tuple[int, ...]):
-#   total_score = 0
-#   total_locations = len(ground_truth_comps.components)
-#
-#   # Create dictionaries for easier lookup
-#   ground_truth_dict = {comp.component_name: comp.position.as_numpy() for comp in ground_truth_comps.components}
-#   predicted_dict = {comp.component_name: comp.position.as_numpy() for comp in predicted_comps.components}
-#
-#   for component_name, true_loc in ground_truth_dict.items():
-#     if component_name in predicted_dict:
-#       guessed_loc = predicted_dict[component_name]
-#       distance = calculate_distance(guessed_loc, true_loc)
-#       normalized_distance = distance / max_possible_distance
-#       score = 1 / (1 + normalized_distance)  # Adding 1 to avoid division by zero
-#       total_score += score
-#
-#   percent_score = (total_score / total_locations) * 100
-#   return percent_score
+  # encoded lazily, only if the labeled image is actually shown / saved
+  return CircuitImage.from_array(np.asarray(image))
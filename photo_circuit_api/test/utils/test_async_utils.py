@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+
+from photocircuit.utils.async_utils import AdmissionController, QueueFull, QueueTimeout, SingleFlight, gather_limited
+
+
+class GatherLimitedTest(unittest.TestCase):
+  def test_order_concurrency_and_failures(self):
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def task(i: int) -> int:
+      nonlocal in_flight, max_in_flight
+      in_flight += 1
+      max_in_flight = max(max_in_flight, in_flight)
+      # finish in reverse order of submission
+      await asyncio.sleep(0.01 * (10 - i))
+      in_flight -= 1
+      if i == 3:
+        raise ValueError('bad image')
+      return i
+    
+    results = asyncio.run(gather_limited((lambda i=i: task(i) for i in range(10)), concurrency=4))
+    
+    self.assertEqual(max_in_flight, 4)
+    self.assertIsInstance(results[3], ValueError)
+    self.assertEqual([r for i, r in enumerate(results) if i != 3], [0, 1, 2, 4, 5, 6, 7, 8, 9])
+
+
+class AdmissionControllerTest(unittest.TestCase):
+  def test_sheds_load_beyond_queue(self):
+    admission = AdmissionController(max_in_flight=2, max_queue=2, queue_timeout=5)
+    
+    async def request() -> str:
+      try:
+        async with admission.admit():
+          await asyncio.sleep(0.05)
+          return 'ok'
+      except QueueFull:
+        return 'full'
+    
+    async def burst() -> list[str]:
+      return await asyncio.gather(*(request() for _ in range(6)))
+    
+    self.assertEqual(sorted(asyncio.run(burst())), ['full', 'full', 'ok', 'ok', 'ok', 'ok'])
+    self.assertEqual((admission.in_flight, admission.waiting, admission.rejected), (0, 0, 2))
+  
+  def test_queue_timeout(self):
+    admission = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.05)
+    
+    async def hold():
+      async with admission.admit():
+        await asyncio.sleep(0.2)
+    
+    async def wait_behind():
+      holder = asyncio.ensure_future(hold())
+      await asyncio.sleep(0)
+      with self.assertRaises(QueueTimeout):
+        async with admission.admit():
+          pass
+      await holder
+    
+    asyncio.run(wait_behind())
+
+
+class SingleFlightTest(unittest.TestCase):
+  def test_concurrent_calls_share_one_run(self):
+    single_flight = SingleFlight()
+    runs = []
+    
+    async def detect(key: str) -> str:
+      runs.append(key)
+      await asyncio.sleep(0.05)
+      return key.upper()
+    
+    async def uploads() -> list:
+      return await asyncio.gather(*(
+        single_flight.do(key, lambda key=key: detect(key)) for key in ['a', 'a', 'b', 'a']
+      ))
+    
+    results = asyncio.run(uploads())
+    self.assertEqual(results, [('A', False), ('A', True), ('B', False), ('A', True)])
+    self.assertEqual(sorted(runs), ['a', 'b'])
+    self.assertEqual((single_flight.in_flight, single_flight.coalesced), (0, 2))
+    # once finished, the next call runs again
+    self.assertEqual(asyncio.run(single_flight.do('a', lambda: detect('a'))), ('A', False))
+  
+  def test_cancelled_caller_does_not_cancel_shared_run(self):
+    single_flight = SingleFlight()
+    
+    async def detect() -> str:
+      await asyncio.sleep(0.05)
+      return 'done'
+    
+    async def uploads() -> tuple:
+      first = asyncio.ensure_future(single_flight.do('a', detect))
+      second = asyncio.ensure_future(single_flight.do('a', detect))
+      await asyncio.sleep(0)
+      first.cancel()
+      return await second
+    
+    self.assertEqual(asyncio.run(uploads()), ('done', True))
+
+
+if __name__ == '__main__':
+  unittest.main()
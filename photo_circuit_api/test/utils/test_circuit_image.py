@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from photocircuit.preprocessing.scaling_preprocessing_service import ScalingPreprocessingService
+from photocircuit.utils import circuit_image
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.common import numpy_to_base64
+
+
+class CircuitImageTest(unittest.TestCase):
+  def setUp(self):
+    self.array = np.zeros((30, 40), dtype=np.uint8)
+    self.array[10:20, 5:35] = 255
+    self.base64_png = numpy_to_base64(self.array)
+  
+  def test_decodes_once(self):
+    image = CircuitImage.from_base64(self.base64_png)
+    with mock.patch.object(circuit_image.Image, 'open', wraps=circuit_image.Image.open) as image_open:
+      np.testing.assert_array_equal(image.array, self.array)
+      self.assertEqual(image.shape, (30, 40))
+      image.array
+    self.assertEqual(image_open.call_count, 1)
+  
+  def test_source_encoding_is_reused(self):
+    image = CircuitImage.from_base64(self.base64_png)
+    self.assertIs(image.base64('png'), self.base64_png)
+  
+  def test_encodes_once_per_format(self):
+    image = CircuitImage.from_array(self.array)
+    self.assertIs(image.encode('PNG'), image.encode('PNG'))
+    self.assertIs(image.base64('JPEG'), image.base64('JPEG'))
+    np.testing.assert_array_equal(CircuitImage.from_base64(image.base64()).array, self.array)
+  
+  def test_digest_ignores_encoding(self):
+    self.assertEqual(CircuitImage.from_base64(self.base64_png).digest(), CircuitImage.from_array(self.array).digest())
+  
+  def test_array_is_read_only(self):
+    with self.assertRaises(ValueError):
+      CircuitImage.from_array(self.array).array[0, 0] = 1
+  
+  def test_preprocess(self):
+    preprocessed = ScalingPreprocessingService().preprocess(CircuitImage.from_array(self.array))
+    self.assertEqual(max(preprocessed.shape), 750)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+
+from photocircuit.utils.grid_renderer import render_grid, grid_layout, GRID_COLOR
+
+
+class GridRendererTest(unittest.TestCase):
+  def setUp(self):
+    self.image = np.full((120, 200), 255, dtype=np.uint8)
+    self.image[60, 100] = 0
+  
+  def test_image_is_not_resampled(self):
+    layout = grid_layout(120, 200, 50)
+    canvas = render_grid(self.image, 50, include_grid=False)
+    image_region = canvas[layout.top:layout.top + 120, layout.left:layout.left + 200]
+    np.testing.assert_array_equal(image_region[:, :, 0], self.image)
+  
+  def test_gridlines_on_exact_pixels(self):
+    layout = grid_layout(120, 200, 50)
+    canvas = render_grid(self.image, 50)
+    image_region = canvas[layout.top:layout.top + 120, layout.left:layout.left + 200]
+    for x in (0, 50, 100, 150):
+      np.testing.assert_array_equal(image_region[:, x], np.broadcast_to(GRID_COLOR, (120, 3)))
+    np.testing.assert_array_equal(image_region[61, 51], [255, 255, 255])
+  
+  def test_layout_is_cached(self):
+    self.assertIs(grid_layout(120, 200, 50), grid_layout(120, 200, 50))
+    self.assertFalse(grid_layout(120, 200, 50).canvas.flags.writeable)
+  
+  def test_rgba_input(self):
+    rgba = np.zeros((40, 40, 4), dtype=np.uint8)
+    canvas = render_grid(rgba, 10, include_grid=False)
+    layout = grid_layout(40, 40, 10)
+    self.assertTrue(np.all(canvas[layout.top:layout.top + 40, layout.left:layout.left + 40] == 255))
+
+
+if __name__ == '__main__':
+  unittest.main()
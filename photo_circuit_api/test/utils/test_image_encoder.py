@@ -0,0 +1,47 @@
+import io
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.image_encoder import ImageEncoder
+
+
+class ImageEncoderTest(unittest.TestCase):
+  def assert_mime_matches(self, encoded):
+    self.assertEqual(Image.MIME[Image.open(io.BytesIO(encoded.data)).format], encoded.mime_type)
+  
+  def test_line_art_is_1_bit_png(self):
+    array = np.full((100, 100, 3), 255, dtype=np.uint8)
+    array[40:60] = 0
+    encoded = ImageEncoder().encode(CircuitImage.from_array(array))
+    self.assertEqual((encoded.format, encoded.bits), ('PNG', 1))
+    self.assert_mime_matches(encoded)
+    np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(encoded.data)).convert('RGB')), array)
+  
+  def test_few_colors_is_lossless_palette_png(self):
+    array = np.zeros((64, 64, 3), dtype=np.uint8)
+    array[:, :32] = (128, 128, 128)
+    array[:32, :, 0] = 200
+    encoded = ImageEncoder().encode(array)
+    self.assertEqual((encoded.format, encoded.bits), ('PNG', 2))
+    np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(encoded.data)).convert('RGB')), array)
+  
+  def test_falls_back_to_lossy_within_budget(self):
+    array = np.random.default_rng(0).integers(0, 256, (200, 200, 3), dtype=np.uint8)
+    encoded = ImageEncoder(max_bytes=20_000).encode(array)
+    self.assertNotEqual(encoded.format, 'PNG')
+    self.assertTrue(encoded.within_budget)
+    self.assertLessEqual(len(encoded.data), 20_000)
+    self.assert_mime_matches(encoded)
+    self.assertTrue(encoded.data_url.startswith(f"data:{encoded.mime_type};base64,"))
+  
+  def test_reports_when_budget_cannot_be_met(self):
+    array = np.random.default_rng(0).integers(0, 256, (200, 200, 3), dtype=np.uint8)
+    encoded = ImageEncoder(max_bytes=10).encode(array)
+    self.assertFalse(encoded.within_budget)
+
+
+if __name__ == '__main__':
+  unittest.main()
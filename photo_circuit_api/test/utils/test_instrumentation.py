@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from photocircuit.component_detection.detection_cache import DetectionCache
+from photocircuit.component_detection.llm_component_detection_service import LlmComponentDetectionService
+from photocircuit.component_detection.model import CircuitComponents, Component, ComponentPosition, ComponentName
+from photocircuit.utils.circuit_image import CircuitImage
+from photocircuit.utils.instrumentation import (
+  HistogramSink, Instrumentation, INSTRUMENTATION, JsonLinesSink, PrometheusSink, StageEvent, annotate
+)
+
+
+class InstrumentationTest(unittest.TestCase):
+  def setUp(self):
+    self.histogram = HistogramSink()
+    self.instrumentation = Instrumentation([self.histogram])
+
+  def test_stage_records_attributes_and_errors(self):
+    with self.instrumentation.stage('llm_request', service='test') as attributes:
+      attributes['prompt_tokens'] = 100
+      annotate(completion_tokens=20)
+    with self.assertRaises(ValueError):
+      with self.instrumentation.stage('parse'):
+        raise ValueError("unparseable output")
+
+    self.assertEqual(self.histogram.stages(), ['llm_request', 'parse'])
+    summary = self.histogram.summary('llm_request')
+    self.assertEqual(summary.counters, {'prompt_tokens': 100, 'completion_tokens': 20})
+    self.assertEqual(self.histogram.summary('parse').errors, 1)
+    # outside any stage annotate is ignored
+    annotate(completion_tokens=1)
+    self.assertEqual(self.histogram.summary('llm_request').counters['completion_tokens'], 20)
+
+  def test_dominant_stage_by_p95(self):
+    # parse is usually slower, but llm requests have a slow tail
+    for i in range(100):
+      self.instrumentation.record('parse', 0.01)
+      self.instrumentation.record('llm_request', 1.0 if i % 10 == 0 else 0.001)
+    self.assertAlmostEqual(self.histogram.percentile('llm_request', 50), 0.001)
+    self.assertEqual(self.histogram.dominant_stage(95), 'llm_request')
+    self.assertEqual(self.histogram.dominant_stage(50), 'parse')
+
+  def test_json_lines_sink(self):
+    file = io.StringIO()
+    self.instrumentation.add_sink(JsonLinesSink(file=file))
+    with self.instrumentation.stage('cache_lookup', service='test') as attributes:
+      attributes['cache_hit'] = True
+    event, = [json.loads(line) for line in file.getvalue().splitlines()]
+    self.assertEqual((event['stage'], event['service'], event['cache_hit']), ('cache_lookup', 'test', True))
+    self.assertGreaterEqual(event['seconds'], 0)
+
+  def test_prometheus_exposition(self):
+    sink = PrometheusSink(buckets=(0.01, 0.1))
+    for seconds in (0.005, 0.05, 0.5):
+      sink.record(StageEvent('llm_request', 0, seconds, {'service': 'svc', 'prompt_tokens': 10}))
+    sink.record(StageEvent('cache_lookup', 0, 0.001, {'service': 'svc', 'cache_hit': False}))
+    lines = sink.exposition().splitlines()
+
+    self.assertIn('photocircuit_stage_duration_seconds_bucket{stage="llm_request",service="svc",le="0.01"} 1', lines)
+    self.assertIn('photocircuit_stage_duration_seconds_bucket{stage="llm_request",service="svc",le="0.1"} 2', lines)
+    self.assertIn('photocircuit_stage_duration_seconds_bucket{stage="llm_request",service="svc",le="+Inf"} 3', lines)
+    self.assertIn('photocircuit_stage_duration_seconds_count{stage="llm_request",service="svc"} 3', lines)
+    self.assertIn('photocircuit_llm_tokens_total{stage="llm_request",service="svc",kind="prompt"} 30.0', lines)
+    self.assertIn('photocircuit_cache_lookups_total{stage="cache_lookup",service="svc",result="miss"} 1.0', lines)
+    self.assertIn('# TYPE photocircuit_stage_duration_seconds histogram', lines)
+
+
+class PipelineInstrumentationTest(unittest.TestCase):
+  def setUp(self):
+    self.histogram = INSTRUMENTATION.add_sink(HistogramSink())
+
+  def tearDown(self):
+    INSTRUMENTATION.remove_sink(self.histogram)
+
+  @mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test'})
+  def test_detection_records_every_stage(self):
+    service = LlmComponentDetectionService(cache=DetectionCache(':memory:'))
+    components = CircuitComponents(components=[
+      Component(
+        position=ComponentPosition(x=50, y=50), component_name=ComponentName.RESISTOR, positive_input_direction=0, id="R1"
+      )
+    ])
+    service.output_llm = mock.Mock()
+    service.output_llm.invoke.return_value = AIMessage(
+      content=components.json(),
+      usage_metadata={'input_tokens': 900, 'output_tokens': 60, 'total_tokens': 960}
+    )
+    image = CircuitImage.from_array(np.full((100, 100), 255, dtype=np.uint8))
+    service.label_components(image, 50)
+    service.label_components(image, 50)
+
+    self.assertEqual(
+      self.histogram.stages(), ['decode', 'grid_render', 'encode', 'cache_lookup', 'llm_request', 'parse']
+    )
+    self.assertEqual(self.histogram.summary('cache_lookup').cache_hit_rate, 0.5)
+    llm_request = self.histogram.summary('llm_request')
+    self.assertEqual(llm_request.count, 1)
+    self.assertEqual(llm_request.counters, {'prompt_tokens': 900, 'completion_tokens': 60})
+    self.assertGreater(self.histogram.summary('encode').counters['payload_bytes'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from photocircuit.utils.lazy_import import lazy_import, LazyModule
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LazyImportTest(unittest.TestCase):
+  def test_imports_on_first_use(self):
+    # run in a fresh interpreter, so the module is not imported yet by anything else
+    code = (
+      "import sys\n"
+      "from concurrent.futures import ThreadPoolExecutor\n"
+      "from photocircuit.utils.lazy_import import lazy_import, LazyModule\n"
+      "wave = lazy_import('wave')\n"
+      "assert isinstance(wave, LazyModule) and 'wave' not in sys.modules, 'imported before use'\n"
+      "with ThreadPoolExecutor(8) as pool:\n"
+      "  opened = set(pool.map(lambda _: wave.open, range(32)))\n"
+      "assert opened == {sys.modules['wave'].open}, opened\n"
+      "assert 'open' in vars(wave), 'attributes not copied'\n"
+    )
+    completed = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, capture_output=True, text=True)
+    self.assertEqual(completed.returncode, 0, completed.stderr)
+
+  def test_returns_imported_module(self):
+    module = lazy_import('unittest')
+    self.assertIs(module, unittest)
+    self.assertNotIsInstance(module, LazyModule)
+
+  def test_missing_module_raises_on_use(self):
+    module = lazy_import('photocircuit_no_such_module')
+    with self.assertRaises(ModuleNotFoundError):
+      module.anything
+
+
+if __name__ == '__main__':
+  unittest.main()
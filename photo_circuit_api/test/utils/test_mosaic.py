@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from photocircuit.utils.mosaic import crop_squares, tile_mosaic, BACKGROUND, FRAME
+
+
+class MosaicTest(unittest.TestCase):
+  def test_crops_are_resampled_and_padded_outside_image(self):
+    image = np.arange(100 * 100, dtype=np.uint32).reshape(100, 100) % 251
+    image = image.astype(np.uint8)
+    crops = crop_squares(image, np.array([[50, 50], [0, 0]]), np.array([20, 40]), 10)
+    self.assertEqual(crops.shape, (2, 10, 10))
+    # every other pixel of the 20px square around (50, 50)
+    np.testing.assert_array_equal(crops[0], image[41:60:2, 41:60:2])
+    # the square around the corner is half outside the image
+    self.assertTrue(np.all(crops[1, :5] == BACKGROUND))
+    self.assertTrue(np.all(crops[1, :, :5] == BACKGROUND))
+    np.testing.assert_array_equal(crops[1, 5:, 5:], image[2:20:4, 2:20:4])
+
+  def test_mosaic_places_crops_row_by_row(self):
+    crops = np.stack([np.full((8, 8, 3), value, dtype=np.uint8) for value in (10, 20, 30)])
+    mosaic = tile_mosaic(crops, ['1', '2', '3'], columns=2, padding=2)
+    cell_h, cell_w = mosaic.shape[0] // 2, mosaic.shape[1] // 2
+    self.assertEqual(cell_w, 8 + 4)
+    for i, value in enumerate((10, 20, 30)):
+      row, column = divmod(i, 2)
+      cell = mosaic[row * cell_h:(row + 1) * cell_h, column * cell_w:(column + 1) * cell_w]
+      np.testing.assert_array_equal(cell[-10:-2, 2:-2], value)
+      np.testing.assert_array_equal(cell[0], FRAME)
+      # the label is drawn above the crop
+      self.assertTrue(np.any(cell[2:-10, 2:-2] == 0))
+    # the unused cell is blank
+    self.assertTrue(np.all(mosaic[cell_h + 1:-1, cell_w + 1:-1] == BACKGROUND))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from photocircuit.utils.shelf_packing import shelf_pack
+
+
+class ShelfPackingTest(unittest.TestCase):
+  def assert_valid(self, sizes: np.ndarray, bins, max_size: int, gap: int):
+    self.assertEqual(sorted(i for b in bins for i in b.indices), list(range(len(sizes))))
+    for b in bins:
+      boxes = np.concatenate([b.offsets, b.offsets + sizes[b.indices]], axis=1)
+      if len(b.indices) > 1:
+        self.assertTrue(np.all(boxes[:, 2:] <= max_size))
+      for i in range(len(boxes)):
+        for j in range(i + 1, len(boxes)):
+          # separated by at least gap along some axis
+          separated = (boxes[i, 2] + gap <= boxes[j, 0]) or (boxes[j, 2] + gap <= boxes[i, 0]) \
+            or (boxes[i, 3] + gap <= boxes[j, 1]) or (boxes[j, 3] + gap <= boxes[i, 1])
+          self.assertTrue(separated, f"{boxes[i]} overlaps {boxes[j]}")
+      self.assertEqual((b.width, b.height), tuple(boxes[:, 2:].max(axis=0)))
+
+  def test_small_rectangles_share_bins(self):
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(100, 400, (30, 2))
+    bins = shelf_pack(sizes, 1000, 1000, gap=10)
+    self.assert_valid(sizes, bins, 1000, 10)
+    area = (sizes + 10).prod(axis=1).sum()
+    # within a factor of two of the best possible bin count
+    self.assertLessEqual(len(bins), 2 * int(np.ceil(area / 1000 ** 2)))
+
+  def test_oversized_rectangle_gets_own_bin(self):
+    sizes = np.array([[300, 200], [1200, 100], [300, 200]])
+    bins = shelf_pack(sizes, 1000, 1000, gap=10)
+    self.assert_valid(sizes, bins, 1000, 10)
+    self.assertEqual(sorted(b.indices for b in bins), [[0, 2], [1]])
+    oversized, = [b for b in bins if b.indices == [1]]
+    self.assertEqual((oversized.width, oversized.height), (1200, 100))
+
+
+if __name__ == '__main__':
+  unittest.main()